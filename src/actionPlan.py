@@ -0,0 +1,71 @@
+import datetime
+import json
+import os
+from typing import Iterable, List, Tuple
+
+from datatypes import UserAction, UserInfo, UserTableData
+
+
+class ActionPlanError(Exception):
+    pass
+
+
+class ActionPlan:
+    """ План действий первой части обработки файла
+
+        JSON lines: первая строка - заголовок
+            {"plan": VERSION, "file": "...", "created": "..."},
+        далее по строке на пользователя
+            {"email": "...", "mid": 1, "login": "...", "actions": [...]}
+        email - адрес из таблицы, по нему выполняются действия с файлом.
+    """
+
+    VERSION = 1
+
+    @classmethod
+    def write(cls, planpath: str, filepath: str,
+            user_actions: Iterable[Tuple[UserInfo, List[UserAction]]]) -> int:
+        """ Writes plan atomically, returns number of users with actions """
+        header = {
+            'plan': cls.VERSION,
+            'file': os.path.abspath(filepath),
+            'created': datetime.datetime.now().isoformat(timespec='seconds'),
+        }
+        written = 0
+        tmp_planpath = planpath + '.tmp'
+        with open(tmp_planpath, 'w', encoding='utf-8') as f:
+            f.write(json.dumps(header, ensure_ascii=False) + '\n')
+            for uinfo, uactions in user_actions:
+                actions = [x.as_dict() for x in uactions if not x.completed]
+                if not actions: continue
+                for action in actions:
+                    del action['completed']
+                entry = {
+                    'email': uinfo.table.email if uinfo.table else uinfo.email,
+                    'mid': uinfo.mid, 'login': uinfo.login, 'actions': actions,
+                }
+                f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+                written += 1
+        os.replace(tmp_planpath, planpath)
+        return written
+
+    @classmethod
+    def read(cls, planpath: str) -> Tuple[dict, List[Tuple[UserInfo, List[UserAction]]]]:
+        """ Returns plan header and (UserInfo, actions) pairs ready for perform_user_actions """
+        user_actions = []
+        try:
+            with open(planpath, 'r', encoding='utf-8') as f:
+                header = json.loads(f.readline() or 'null')
+                if not isinstance(header, dict) or header.get('plan') != cls.VERSION:
+                    raise ActionPlanError(f"{planpath} is not an action plan of version {cls.VERSION}")
+                for line in f:
+                    if not line.strip(): continue
+                    entry = json.loads(line)
+                    uinfo = UserInfo(
+                        mid=entry['mid'], login=entry['login'], email=entry['email'], fio='',
+                        table=UserTableData(email=entry['email'], login=None),
+                    )
+                    user_actions.append((uinfo, [UserAction.from_dict(x) for x in entry['actions']]))
+        except (OSError, json.JSONDecodeError, KeyError, AttributeError) as e:
+            raise ActionPlanError(f"Cannot read plan {planpath}: {e!r}")
+        return header, user_actions
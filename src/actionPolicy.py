@@ -0,0 +1,75 @@
+import json
+from typing import FrozenSet, Iterable, List, Optional, Tuple
+
+from datatypes import UserAction, UserActionType
+
+
+class ActionPolicyError(Exception):
+    pass
+
+
+class ActionPolicy:
+    """ Правила автоматического выбора действий над пользователями
+
+        Файл правил - JSON вида
+            {"accept": ["ADD_LABEL", "MARK_REGISTERED"], "never": ["DELETE"]}
+        Предложенное действие принимается, если его тип есть в accept
+        (или accept не задан) и нет в never. Типы можно указывать как
+        именем, так и значением UserActionType.
+    """
+
+    def __init__(self, accept: Optional[Iterable[UserActionType]] = None,
+            never: Iterable[UserActionType] = ()):
+        self.accept: Optional[FrozenSet[UserActionType]] = frozenset(accept) if accept is not None else None
+        self.never: FrozenSet[UserActionType] = frozenset(never)
+
+    @staticmethod
+    def _parse_types(values, key: str) -> List[UserActionType]:
+        if not isinstance(values, list):
+            raise ActionPolicyError(f"`{key}` should be a list of action types")
+        types = []
+        for value in values:
+            name = str(value).strip()
+            if name.upper() in UserActionType.__members__:
+                types.append(UserActionType[name.upper()])
+                continue
+            try:
+                types.append(UserActionType(name.lower()))
+            except ValueError:
+                raise ActionPolicyError(f"Unknown action type `{value}` in `{key}`")
+        return types
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'ActionPolicy':
+        if not isinstance(data, dict):
+            raise ActionPolicyError("Policy should be a JSON object")
+        unknown = set(data) - {'accept', 'never'}
+        if unknown:
+            raise ActionPolicyError(f"Unknown policy keys: {', '.join(sorted(unknown))}")
+        accept = None
+        if data.get('accept') is not None:
+            accept = cls._parse_types(data['accept'], 'accept')
+        never = cls._parse_types(data.get('never', []), 'never')
+        return cls(accept, never)
+
+    @classmethod
+    def load(cls, filepath: str) -> 'ActionPolicy':
+        try:
+            with open(filepath, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            raise ActionPolicyError(f"Cannot read policy file {filepath}: {e}")
+        return cls.from_dict(data)
+
+    def is_accepted(self, uaction: UserAction) -> bool:
+        if uaction.action in self.never:
+            return False
+        return self.accept is None or uaction.action in self.accept
+
+    def apply(self, suggested: Iterable[UserAction]) -> Tuple[List[UserAction], List[UserAction]]:
+        """ Returns (accepted, rejected) actions, accepted are sorted for execution """
+        accepted, rejected = [], []
+        for uaction in suggested:
+            (accepted if self.is_accepted(uaction) else rejected).append(uaction)
+        accepted.sort(key=lambda x: x.sort_key)
+        return accepted, rejected
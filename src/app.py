@@ -4,9 +4,17 @@ if __name__ == "__main__":
     if ('--help' in sys.argv or '-h' in sys.argv): 
         print("elexam is an utility program to make Excel file processing for e-learning a bit easier.")
         print("Usage: app.py [options]")
+        print("       app.py step1 --policy policy.json [--workers N] [--report report.json] [--incremental] file.xlsx")
+        print("       app.py plan --policy policy.json [--workers N] file.xlsx plan.jsonl")
+        print("       app.py apply [--file file.xlsx] [--workers N] plan.jsonl")
+        print("       app.py watch [--interval SECONDS] [--workers N] file.xlsx")
+        print("       app.py daemon [--stop] [--cache-ttl SECONDS]")
+        print("       app.py info [--no-courses] email [email ...]")
+        print("       app.py audit [--workers N] [--report report.json] file.xlsx")
         print("\nOptions:")
         print("\t -h, --help\tShow this help")
         print("\t --settings\tShow settings file location")
+        print("\t --startup-profile\tShow import time of modules at startup")
         print("\t -v, --version\tShow program version")
     elif '--version' in sys.argv or '-v' in sys.argv:
         import version
@@ -0,0 +1,362 @@
+""" Неинтерактивные команды для запуска без оператора (например, из cron)
+
+    app.py step1 --policy policy.json [--incremental] file.xlsx
+    app.py plan --policy policy.json file.xlsx plan.jsonl
+    app.py apply plan.jsonl
+    app.py watch file.xlsx
+    app.py daemon
+    app.py info email@example.com
+    app.py audit file.xlsx
+"""
+import argparse
+import datetime
+import json
+import os
+import sys
+import traceback
+from typing import List, Optional
+
+from settings import Settings
+from datatypes import AuthCookies, UserAction, UserInfo
+from actionPolicy import ActionPolicy, ActionPolicyError
+
+
+class Step1Report:
+    """ Отчёт о решениях, принятых по правилам в пакетном режиме """
+
+    def __init__(self, filepath: str, policy_path: str):
+        self.data = {
+            'file': os.path.abspath(filepath),
+            'policy': os.path.abspath(policy_path),
+            'started': datetime.datetime.now().isoformat(timespec='seconds'),
+            'finished': None,
+            'completed': False,
+            'error': None,
+            'users': [],
+            'messages': [],
+        }
+        self._decisions = []  # (userinfo, accepted, rejected)
+
+    def add_decision(self, userinfo: UserInfo, accepted: List[UserAction],
+            rejected: List[UserAction]) -> None:
+        # UserAction.completed меняется при выполнении, поэтому словари
+        # собираются при записи отчёта
+        self._decisions.append((userinfo, accepted, rejected))
+
+    def add_message(self, message, status: str) -> None:
+        if isinstance(message, list):
+            message = [x.as_dict() if isinstance(x, UserAction) else str(x) for x in message]
+        self.data['messages'].append({'status': status, 'message': message})
+
+    def write(self, filepath: str) -> None:
+        self.data['finished'] = datetime.datetime.now().isoformat(timespec='seconds')
+        self.data['users'] = [
+            {
+                'email': userinfo.email,
+                'table_email': userinfo.table.email if userinfo.table else None,
+                'mid': userinfo.mid,
+                'login': userinfo.login,
+                'accepted': [x.as_dict() for x in accepted],
+                'rejected': [x.as_dict() for x in rejected],
+            }
+            for userinfo, accepted, rejected in self._decisions
+        ]
+        with open(filepath, 'w', encoding='utf-8') as f:
+            json.dump(self.data, f, ensure_ascii=False, indent=4)
+
+
+def _print_message(message, status='ok'):
+    if isinstance(message, list):
+        message = ", ".join(repr(x) for x in message)
+    print(f"[{status}] {message}", file=sys.stderr if status == 'bad' else sys.stdout)
+
+
+def _no_progress(iterable, title=''):
+    return iterable
+
+
+def _create_learning():
+    from learning import LearningDriver
+
+    auth = Settings().get_crypted('auth')
+    return LearningDriver(AuthCookies(*auth) if auth else None)
+
+
+def run_step1(args) -> int:
+    from fileController import FileController
+    from learning import NotAuthorized, RequestError
+
+    try:
+        policy = ActionPolicy.load(args.policy)
+    except ActionPolicyError as e:
+        print(e, file=sys.stderr)
+        return 2
+
+    report_path = args.report or os.path.splitext(args.file)[0] + '.step1.json'
+    report = Step1Report(args.file, args.policy)
+
+    def message_callback(message, status='ok'):
+        report.add_message(message, status)
+        _print_message(message, status)
+
+    def ask_user_actions(userinfo, suggested):
+        accepted, rejected = policy.apply(suggested)
+        report.add_decision(userinfo, accepted, rejected)
+        return accepted
+
+    learning = _create_learning()
+    try:
+        if not learning.auth_check():
+            print("Not logged in to eLearning, log in using the interactive mode first", file=sys.stderr)
+            return 1
+        report.data['completed'] = FileController.step1(
+            filepath=args.file,
+            progress_gen=_no_progress,
+            ask_user_actions=ask_user_actions,
+            confirm_users_actions=lambda user_actions: True,
+            message_callback=message_callback,
+            learning=learning,
+            workers=args.workers or FileController.MAX_WORKERS,
+            incremental=args.incremental,
+        )
+    except (NotAuthorized, RequestError) as e:
+        report.data['error'] = f"{e.__class__.__name__}: {e}"
+        message_callback(traceback.format_exc(), status='bad')
+    finally:
+        report.write(report_path)
+        print(f"Report: {os.path.abspath(report_path)}")
+
+    return 0 if report.data['completed'] else 1
+
+
+def run_plan(args) -> int:
+    from fileController import FileController
+    from learning import NotAuthorized, RequestError
+
+    try:
+        policy = ActionPolicy.load(args.policy)
+    except ActionPolicyError as e:
+        print(e, file=sys.stderr)
+        return 2
+
+    learning = _create_learning()
+    try:
+        if not learning.auth_check():
+            print("Not logged in to eLearning, log in using the interactive mode first", file=sys.stderr)
+            return 1
+        completed = FileController.plan_step1(
+            filepath=args.file,
+            planpath=args.plan,
+            progress_gen=_no_progress,
+            ask_user_actions=lambda userinfo, suggested: policy.apply(suggested)[0],
+            confirm_users_actions=lambda user_actions: True,
+            message_callback=_print_message,
+            learning=learning,
+            workers=args.workers or FileController.MAX_WORKERS,
+        )
+    except (NotAuthorized, RequestError):
+        _print_message(traceback.format_exc(), status='bad')
+        return 1
+    return 0 if completed else 1
+
+
+def run_apply(args) -> int:
+    from fileController import FileController
+    from learning import NotAuthorized, RequestError
+    from actionPlan import ActionPlanError
+
+    learning = _create_learning()
+    try:
+        if not learning.auth_check():
+            print("Not logged in to eLearning, log in using the interactive mode first", file=sys.stderr)
+            return 1
+        completed = FileController.apply_plan(
+            args.plan,
+            progress_gen=_no_progress,
+            message_callback=_print_message,
+            filepath=args.file,
+            learning=learning,
+            workers=args.workers or FileController.MAX_WORKERS,
+        )
+    except ActionPlanError as e:
+        print(e, file=sys.stderr)
+        return 2
+    except (NotAuthorized, RequestError):
+        _print_message(traceback.format_exc(), status='bad')
+        return 1
+    return 0 if completed else 1
+
+
+def run_watch(args) -> int:
+    from intakeWatcher import IntakeWatcher
+    from learning import DataAgreementNotAccepted, NotAuthorized
+
+    learning = _create_learning()
+    if not learning.auth_check():
+        print("Not logged in to eLearning, log in using the interactive mode first", file=sys.stderr)
+        return 1
+    watcher = IntakeWatcher(
+        args.file, learning, _print_message,
+        workers=args.workers or IntakeWatcher.WORKERS,
+        interval=args.interval,
+    )
+    try:
+        watcher.run()
+    except KeyboardInterrupt:
+        pass
+    except (NotAuthorized, DataAgreementNotAccepted):
+        _print_message(traceback.format_exc(), status='bad')
+        return 1
+    return 0
+
+
+def run_daemon(args) -> int:
+    from daemon import DaemonClient, DaemonError, LearningDaemon, get_socket_path
+
+    if args.stop:
+        client = DaemonClient.connect()
+        if client is None:
+            print("Daemon is not running", file=sys.stderr)
+            return 1
+        client.call('shutdown')
+        return 0
+
+    daemon = LearningDaemon(cache_ttl=args.cache_ttl)
+    if not daemon.learning.auth_check():
+        print("Not logged in to eLearning, log in using the interactive mode first", file=sys.stderr)
+        return 1
+    print(f"Listening on {args.socket or get_socket_path()}, stop with Ctrl+C")
+    try:
+        daemon.serve(args.socket)
+    except DaemonError as e:
+        print(e, file=sys.stderr)
+        return 1
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+def run_info(args) -> int:
+    from daemon import DaemonClient, DaemonError
+
+    load_courses = not args.no_courses
+    client = DaemonClient.connect()
+    if client is not None:
+        # Без демона пришлось бы импортировать LearningDriver и проверять вход
+        def lookup(email):
+            try:
+                return client.call('get_user_info', email=email, load_courses=load_courses)
+            except DaemonError as e:
+                if e.type == 'UserNotFound':
+                    return []
+                raise
+    else:
+        from learning import UserNotFound
+        learning = _create_learning()
+
+        def lookup(email):
+            try:
+                return [x.as_dict() for x in learning.get_user_info(email, load_courses=load_courses)]
+            except UserNotFound:
+                return []
+
+    found_all = True
+    for email in args.emails:
+        users = lookup(email)
+        if not users:
+            print(json.dumps({'email': email, 'found': False}, ensure_ascii=False))
+            found_all = False
+        for user in users:
+            print(json.dumps(user, ensure_ascii=False))
+    return 0 if found_all else 1
+
+
+def run_audit(args) -> int:
+    from fileController import FileController
+    from learning import NotAuthorized, RequestError
+
+    learning = _create_learning()
+    try:
+        if not learning.auth_check():
+            print("Not logged in to eLearning, log in using the interactive mode first", file=sys.stderr)
+            return 1
+        differences = FileController.audit_labels(
+            args.file, _print_message,
+            learning=learning,
+            workers=args.workers or FileController.AUDIT_WORKERS,
+        )
+    except (NotAuthorized, RequestError):
+        _print_message(traceback.format_exc(), status='bad')
+        return 1
+    if differences is None:
+        return 2
+    if args.report:
+        with open(args.report, 'w', encoding='utf-8') as f:
+            json.dump({
+                email: {'missing': sorted(missing), 'extra': sorted(extra)}
+                for email, (missing, extra) in differences.items()
+            }, f, ensure_ascii=False, indent=4)
+    return 1 if differences else 0
+
+
+def _build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog='app.py', description="Non-interactive elexam commands")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    step1 = subparsers.add_parser('step1', help="Process file (part 1) using an action policy")
+    step1.add_argument('file', help="Excel file to process")
+    step1.add_argument('--policy', required=True, help="JSON file with accept/never action types")
+    step1.add_argument('--report', help="Where to write the decision report (default: <file>.step1.json)")
+    step1.add_argument('--workers', type=int, default=None,
+                       help="Number of concurrent eLearning requests")
+    step1.add_argument('--incremental', action='store_true',
+                       help="Look up only rows added or changed since the last run, reuse results for the rest")
+    step1.set_defaults(func=run_step1)
+
+    plan = subparsers.add_parser('plan', help="Look up users and write chosen actions to a plan without applying them")
+    plan.add_argument('file', help="Excel file to plan for, it is not changed")
+    plan.add_argument('plan', help="Where to write the plan (JSON lines)")
+    plan.add_argument('--policy', required=True, help="JSON file with accept/never action types")
+    plan.add_argument('--workers', type=int, default=None,
+                      help="Number of concurrent eLearning requests")
+    plan.set_defaults(func=run_plan)
+
+    apply = subparsers.add_parser('apply', help="Apply a plan, an interrupted run continues where it stopped")
+    apply.add_argument('plan', help="Plan written by 'plan' or the interactive mode")
+    apply.add_argument('--file', help="Excel file to change (default: the file the plan was made for)")
+    apply.add_argument('--workers', type=int, default=None,
+                       help="Number of concurrent eLearning requests")
+    apply.set_defaults(func=run_apply)
+
+    watch = subparsers.add_parser('watch', help="Prepare suggestions for rows appended to the file until interrupted")
+    watch.add_argument('file', help="Excel file filled with new applications")
+    watch.add_argument('--interval', type=float, default=5.0,
+                       help="Seconds between checks of the file (default: 5)")
+    watch.add_argument('--workers', type=int, default=None,
+                       help="Number of concurrent eLearning requests")
+    watch.set_defaults(func=run_watch)
+
+    daemon = subparsers.add_parser('daemon', help="Keep an eLearning session and caches for other commands until stopped")
+    daemon.add_argument('--stop', action='store_true', help="Stop the running daemon")
+    daemon.add_argument('--socket', help="Unix socket path (default: next to the settings file)")
+    daemon.add_argument('--cache-ttl', type=float, default=60.0,
+                        help="Seconds to keep user lookups (default: 60)")
+    daemon.set_defaults(func=run_daemon)
+
+    info = subparsers.add_parser('info', help="Print users as JSON lines, through the daemon when it is running")
+    info.add_argument('emails', nargs='+', help="Emails to look up")
+    info.add_argument('--no-courses', action='store_true', help="Do not load user courses")
+    info.set_defaults(func=run_info)
+
+    audit = subparsers.add_parser('audit', help="Compare labels of users in eLearning with labels computed from the file")
+    audit.add_argument('file', help="Excel file after part 1, it is not changed")
+    audit.add_argument('--report', help="Where to write differences as JSON")
+    audit.add_argument('--workers', type=int, default=None,
+                       help="Number of concurrent eLearning requests")
+    audit.set_defaults(func=run_audit)
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = _build_parser().parse_args(argv)
+    return args.func(args)
@@ -0,0 +1,261 @@
+""" Фоновый процесс, который держит сессию eLearning и кэши между запусками
+
+    app.py daemon           - запустить (работает до Ctrl+C или app.py daemon --stop)
+    app.py info EMAIL ...   - информация о пользователях, через демон, если он запущен
+
+    Клиент и демон обмениваются строками JSON через Unix socket рядом с
+    файлом настроек: запрос {"method": "...", "params": {...}}, ответ
+    {"result": ...} или {"error": {"type": "UserNotFound", "message": "..."}}.
+    На системах без Unix socket (Windows) демон недоступен.
+"""
+import datetime
+import json
+import os
+import socket
+import socketserver
+import threading
+import time
+from typing import Dict, Iterable, List, Optional
+
+from datatypes import AuthCookies, UserInfo
+from settings import Settings
+
+DAEMON_SUPPORTED = hasattr(socket, 'AF_UNIX')
+
+
+class DaemonError(Exception):
+    def __init__(self, type_: str, message: str = ''):
+        super().__init__(f"{type_}: {message}" if message else type_)
+        self.type = type_
+        self.message = message
+
+
+def get_socket_path() -> str:
+    return os.path.join(Settings.get_dirpath('run'), 'daemon.sock')
+
+
+class LearningDaemon:
+    """ Выполняет запросы клиентов одной сессией LearningDriver
+
+        Результаты get_user_info и get_user_password хранятся CACHE_TTL
+        секунд, после изменений пользователей сбрасываются (invalidate).
+        Если сессия устарела, авторизация перечитывается из настроек (вход
+        мог быть выполнен в интерактивном режиме) и запрос повторяется
+        один раз.
+    """
+
+    CACHE_TTL = 60.0
+
+    def __init__(self, cache_ttl: float = CACHE_TTL):
+        self.cache_ttl = cache_ttl
+        self.started = datetime.datetime.now()
+        self.learning = self._create_learning()
+        self._cache: Dict[tuple, tuple] = dict()  # key -> (time, result)
+        self._lock = threading.Lock()
+        self._server: Optional[socketserver.BaseServer] = None
+
+    @staticmethod
+    def _create_learning():
+        from learning import LearningDriver
+
+        auth = Settings().get_crypted('auth')
+        return LearningDriver(AuthCookies(*auth) if auth else None)
+
+    def _cached(self, key: tuple, func):
+        with self._lock:
+            cached = self._cache.get(key)
+        if cached is not None and time.monotonic() - cached[0] < self.cache_ttl:
+            return cached[1]
+        result = func()
+        with self._lock:
+            self._cache[key] = (time.monotonic(), result)
+        return result
+
+    def _with_relogin(self, func):
+        from learning import NotAuthorized
+
+        try:
+            return func()
+        except NotAuthorized:
+            self.learning = self._create_learning()
+            return func()
+
+    def handle(self, method: str, params: dict):
+        if method == 'ping':
+            return {'pid': os.getpid(), 'started': self.started.isoformat(timespec='seconds')}
+        if method == 'get_user_info':
+            email = str(params['email']).strip()
+            load_courses = bool(params.get('load_courses', True))
+            return self._cached(
+                ('get_user_info', email.lower(), load_courses),
+                lambda: self._with_relogin(lambda: [
+                    x.as_dict() for x in self.learning.get_user_info(email, load_courses=load_courses)
+                ]),
+            )
+        if method == 'get_user_password':
+            user_id = int(params['user_id'])
+            return self._cached(
+                ('get_user_password', user_id),
+                lambda: self._with_relogin(lambda: self.learning.get_user_password(user_id)),
+            )
+        if method == 'invalidate':
+            # Без emails и user_ids кэш очищается полностью
+            emails = {str(x).strip().lower() for x in params.get('emails') or ()}
+            user_ids = {int(x) for x in params.get('user_ids') or ()}
+            with self._lock:
+                if emails or user_ids:
+                    for key in [k for k in self._cache if k[1] in (emails if k[0] == 'get_user_info' else user_ids)]:
+                        del self._cache[key]
+                else:
+                    self._cache.clear()
+            self.learning.user_index.clear()
+            return True
+        if method == 'shutdown':
+            threading.Thread(target=self._server.shutdown, daemon=True).start()
+            return True
+        raise DaemonError('UnknownMethod', method)
+
+    def serve(self, path: Optional[str] = None) -> None:
+        """ Принимает запросы до вызова shutdown """
+        if not DAEMON_SUPPORTED:
+            raise DaemonError('NotSupported', "Unix sockets are not available on this system")
+        path = path or get_socket_path()
+        if os.path.exists(path):
+            if DaemonClient(path).is_alive():
+                raise DaemonError('AlreadyRunning', path)
+            os.remove(path)
+
+        daemon = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                for line in self.rfile:
+                    try:
+                        request = json.loads(line)
+                        response = {'result': daemon.handle(request['method'], request.get('params') or {})}
+                    except DaemonError as e:
+                        response = {'error': {'type': e.type, 'message': e.message}}
+                    except Exception as e:
+                        response = {'error': {'type': e.__class__.__name__, 'message': str(e)}}
+                    self.wfile.write(json.dumps(response, ensure_ascii=False).encode() + b'\n')
+                    self.wfile.flush()
+
+        self._server = socketserver.ThreadingUnixStreamServer(path, Handler)
+        self._server.daemon_threads = True
+        try:
+            os.chmod(path, 0o600)
+            self._server.serve_forever()
+        finally:
+            self._server.server_close()
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+class DaemonClient:
+    """ Клиент демона. Соединения открываются по мере необходимости и
+        переиспользуются, одновременные запросы из разных потоков идут
+        по разным соединениям.
+    """
+
+    TIMEOUT = 60.0
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or get_socket_path()
+        self._idle: List[tuple] = []  # (socket, file)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def connect(cls) -> Optional['DaemonClient']:
+        """ Returns client of the running daemon or None """
+        if not DAEMON_SUPPORTED:
+            return None
+        client = cls()
+        return client if client.is_alive() else None
+
+    def is_alive(self) -> bool:
+        try:
+            self.call('ping')
+        except (OSError, DaemonError):
+            self.close()
+            return False
+        return True
+
+    def close(self) -> None:
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for sock, file in idle:
+            file.close()
+            sock.close()
+
+    def _open(self) -> tuple:
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.TIMEOUT)
+        try:
+            sock.connect(self.path)
+        except OSError:
+            sock.close()
+            raise
+        return sock, sock.makefile('rwb')
+
+    def call(self, method: str, **params):
+        sock, file = self._open()
+        try:
+            file.write(json.dumps({'method': method, 'params': params}).encode() + b'\n')
+            file.flush()
+            line = file.readline()
+        except BaseException:
+            file.close()
+            sock.close()
+            raise
+        if not line:
+            file.close()
+            sock.close()
+            raise DaemonError('ConnectionClosed')
+        with self._lock:
+            self._idle.append((sock, file))
+        response = json.loads(line)
+        if 'error' in response:
+            raise DaemonError(response['error']['type'], response['error']['message'])
+        return response['result']
+
+    @staticmethod
+    def _raise_learning_error(e: DaemonError):
+        """ Ошибки LearningDriver передаются вызывающему коду как есть """
+        import learning
+
+        error_class = getattr(learning, e.type, None)
+        if isinstance(error_class, type) and issubclass(error_class, Exception):
+            raise error_class(e.message) from None
+        raise e
+
+    def get_user_info(self, email: str, load_courses: bool = True) -> List[UserInfo]:
+        try:
+            return [UserInfo.from_dict(x) for x in self.call('get_user_info', email=email, load_courses=load_courses)]
+        except DaemonError as e:
+            self._raise_learning_error(e)
+
+    def get_user_password(self, user_id) -> Optional[str]:
+        try:
+            return self.call('get_user_password', user_id=user_id)
+        except DaemonError as e:
+            self._raise_learning_error(e)
+
+
+def invalidate_daemon_cache(emails: Iterable[str] = (), user_ids: Iterable = ()) -> None:
+    """ Сбрасывает кэш запущенного демона для изменённых пользователей
+        (всех, если ничего не передано). Без демона ничего не делает.
+    """
+    client = DaemonClient.connect()
+    if client is None:
+        return
+    try:
+        client.call('invalidate', emails=list(emails), user_ids=[int(x) for x in user_ids])
+    except (OSError, DaemonError):
+        pass  # демон остановлен, кэша больше нет
+    finally:
+        client.close()
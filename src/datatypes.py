@@ -1,4 +1,6 @@
 import datetime
+import sys
+import weakref
 from dataclasses import dataclass
 from enum import Enum
 from collections import namedtuple
@@ -6,13 +8,28 @@ from typing import List, NamedTuple, Optional, Tuple, TypeAlias
 
 AuthCookies = namedtuple('AuthCookies', ('PHPSESSID', 'hmkey'))
 
-@dataclass
+@dataclass(frozen=True, slots=True, weakref_slot=True)
 class Course:
     cid: int  # course id
     title: str
     starts: Optional[datetime.datetime] = None
     ends: Optional[datetime.datetime] = None
-    teachers: Optional[List[str]] = None
+    teachers: Optional[Tuple[str, ...]] = None
+
+    @classmethod
+    def get_shared(cls, cid: int, title: str, starts: Optional[datetime.datetime] = None,
+            ends: Optional[datetime.datetime] = None, teachers: Optional[Tuple[str, ...]] = None) -> 'Course':
+        """ Returns one shared Course object for equal courses of different users """
+        title = sys.intern(title)
+        teachers = tuple(sys.intern(x) for x in teachers) if teachers else None
+        key = (cid, title, starts, ends, teachers)
+        course = _shared_courses.get(key)
+        if course is None:
+            course = cls(cid, title, starts, ends, teachers)
+            _shared_courses[key] = course
+        return course
+
+_shared_courses: 'weakref.WeakValueDictionary[tuple, Course]' = weakref.WeakValueDictionary()
 
 EmailNLogin = namedtuple('EmailNLogin', ('email', 'login'))
 
@@ -54,50 +71,60 @@ class UserActionMeta(type):
 
 class UserAction(metaclass=UserActionMeta):
 
+    __slots__ = ('action', 'param', 'completed')
+
+    _param_required = (
+        UserActionType.ADD_LABEL, UserActionType.REMOVE_LABEL,
+        UserActionType.SET_COMMENT,
+        UserActionType.CHANGE_PASSW_EDU, UserActionType.CHANGE_PASSW_LOCAL,
+        UserActionType.DELETE_FROM_TABLE_WITH_SUBJECT
+    )
+
+    _weights = {
+        UserActionType.DELETE: 100,
+        UserActionType.DELETE_FROM_TABLE: 99,
+        UserActionType.SET_COMMENT: 90,
+        UserActionType.DELETE_FROM_TABLE_WITH_SUBJECT: 87,
+        UserActionType.MARK_REGISTERED: 85,
+        UserActionType.SKIP: 86,
+        UserActionType.CHANGE_LOGIN: 10,
+        UserActionType.CHANGE_PASSW_EDU: 11,
+        UserActionType.CHANGE_PASSW_LOCAL: 20,
+    }
+
+    _requires = {
+        UserActionType.SKIP: ('excel',),
+        UserActionType.DELETE: ('learning',),
+        UserActionType.DELETE_FROM_TABLE: ('excel',),
+        UserActionType.DELETE_FROM_TABLE_WITH_SUBJECT: ('excel',),
+        UserActionType.ADD_LABEL: ('learning', 'excel'),
+        UserActionType.REMOVE_LABEL: ('learning',),
+        UserActionType.CHANGE_LOGIN: ('learning', 'excel'),
+        UserActionType.CHANGE_PASSW_LOCAL: ('excel',),
+        UserActionType.CHANGE_PASSW_EDU: ('learning',),
+        UserActionType.MARK_REGISTERED: ('excel',),
+        UserActionType.SILENT_SKIP: (),
+        UserActionType.SET_COMMENT: ('excel',),
+    }
+
     def __init__(self, action: UserActionType, param: str = ""):
         if not isinstance(action, UserActionType):
             raise AttributeError(f"action attribute must be UserActionType instance")
-        
-        param_required = (
-            UserActionType.ADD_LABEL, UserActionType.REMOVE_LABEL,
-            UserActionType.SET_COMMENT,
-            UserActionType.CHANGE_PASSW_EDU, UserActionType.CHANGE_PASSW_LOCAL,
-            UserActionType.DELETE_FROM_TABLE_WITH_SUBJECT
-        )
 
-        if not param and action in param_required:
+        if not param and action in self._param_required:
             raise AttributeError(f"param should be passed when action is {action.name}")
 
         self.action = action
-        self.param = param
-        self.weight = 50
+        self.param = sys.intern(param) if type(param) == str else param
         self.completed = False
-        self.requires = ()
-
-        match action:
-            case UserActionType.DELETE: self.weight = 100
-            case UserActionType.DELETE_FROM_TABLE: self.weight = 99
-            case UserActionType.SET_COMMENT: self.weight = 90
-            case UserActionType.DELETE_FROM_TABLE_WITH_SUBJECT: self.weight = 87
-            case UserActionType.MARK_REGISTERED: self.weight = 85
-            case UserActionType.SKIP: self.weight = 86
-            case UserActionType.CHANGE_LOGIN: self.weight = 10
-            case UserActionType.CHANGE_PASSW_EDU: self.weight = 11
-            case UserActionType.CHANGE_PASSW_LOCAL: self.weight = 20
-
-        match action:
-            case UserActionType.SKIP: self.requires = ('excel')
-            case UserActionType.DELETE: self.requires = ('learning')
-            case UserActionType.DELETE_FROM_TABLE: self.requires = ('excel')
-            case UserActionType.DELETE_FROM_TABLE_WITH_SUBJECT: self.requires = ('excel')
-            case UserActionType.ADD_LABEL: self.requires = ('learning', 'excel')
-            case UserActionType.REMOVE_LABEL: self.requires = ('learning')
-            case UserActionType.CHANGE_LOGIN: self.requires = ('learning', 'excel')
-            case UserActionType.CHANGE_PASSW_LOCAL: self.requires = ('excel')
-            case UserActionType.CHANGE_PASSW_EDU: self.requires = ('learning')
-            case UserActionType.MARK_REGISTERED: self.requires = ('excel')
-            case UserActionType.SILENT_SKIP: self.requires = ()
-            case UserActionType.SET_COMMENT: self.requires = ('excel')
+
+    @property
+    def weight(self) -> int:
+        return self._weights.get(self.action, 50)
+
+    @property
+    def requires(self) -> Tuple[str, ...]:
+        return self._requires.get(self.action, ())
 
     def __eq__(self, other):
         if isinstance(other, UserActionType):
@@ -128,6 +155,19 @@ class UserAction(metaclass=UserActionMeta):
     def sort_key(self):
         return self.weight
 
+    def as_dict(self) -> dict:
+        return {'action': self.action.name, 'param': self.param, 'completed': self.completed}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'UserAction':
+        try:
+            action = UserActionType[data['action']]
+        except KeyError:
+            raise AttributeError(f"unknown action {data.get('action')!r}")
+        uaction = cls(action, data.get('param', ''))
+        uaction.completed = bool(data.get('completed', False))
+        return uaction
+
     def descr(self):
         if self.action == UserActionType.SKIP: return "Пропустить с пометкой в таблице"
         elif self.action == UserActionType.DELETE: return "Удалить пользователя"
@@ -151,18 +191,56 @@ class UserTableData(NamedTuple):
     email: str
     login: str
     fio: Optional[str] = None
-    subjects: Optional[List[TableSubject]] = None
-    marks: Optional[List[str]] = None  # отметки заливкой, по типу "зарегистрирован"
+    subjects: Optional[Tuple[TableSubject, ...]] = None
+    marks: Optional[Tuple[str, ...]] = None  # отметки заливкой, по типу "зарегистрирован"
 
-@dataclass
+@dataclass(slots=True)
 class UserInfo:
     mid: int
     login: str
     email: str
     fio: str
-    tags: Optional[Tuple[str]] = None
+    tags: Optional[Tuple[str, ...]] = None
     table: Optional[UserTableData] = None
     registered: Optional[datetime.datetime] = None
     last_login: Optional[datetime.datetime] = None
     courses: Optional[Tuple[Course]] = None
     source: Optional[str] = 'elexam'
+    fio_match: Optional[float] = None  # сходство ФИО, если найден не по email (не сохраняется)
+
+    def as_dict(self) -> dict:
+        """ Returns JSON-compatible dict, table data is not included """
+        isoformat = lambda x: x.isoformat() if x else None
+        return {
+            'mid': self.mid, 'login': self.login, 'email': self.email, 'fio': self.fio,
+            'tags': list(self.tags) if self.tags is not None else None,
+            'registered': isoformat(self.registered),
+            'last_login': isoformat(self.last_login),
+            'courses': [
+                [x.cid, x.title, isoformat(x.starts), isoformat(x.ends),
+                 list(x.teachers) if x.teachers else None]
+                for x in self.courses
+            ] if self.courses is not None else None,
+            'source': self.source,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict, table: Optional[UserTableData] = None) -> 'UserInfo':
+        fromisoformat = lambda x: datetime.datetime.fromisoformat(x) if x else None
+        courses = data.get('courses')
+        if courses is not None:
+            courses = tuple(
+                Course.get_shared(cid, title, fromisoformat(starts), fromisoformat(ends),
+                                  tuple(teachers) if teachers else None)
+                for cid, title, starts, ends, teachers in courses
+            )
+        tags = data.get('tags')
+        return cls(
+            mid=data['mid'], login=data['login'], email=data['email'], fio=data['fio'],
+            tags=tuple(sys.intern(x) for x in tags) if tags is not None else None,
+            table=table,
+            registered=fromisoformat(data.get('registered')),
+            last_login=fromisoformat(data.get('last_login')),
+            courses=courses,
+            source=data.get('source', 'elexam'),
+        )
@@ -0,0 +1,125 @@
+import datetime
+import heapq
+import json
+import os
+import re
+from collections import Counter, defaultdict
+from typing import TYPE_CHECKING, Dict, FrozenSet, Iterable, List, Tuple
+
+from datatypes import UserInfo
+from settings import Settings
+
+if TYPE_CHECKING:
+    from learning import LearningDriver
+
+
+class DirectorySnapshot:
+    """ Список всех пользователей eLearning (без курсов)
+
+        Загружается одним просмотром /user/list и хранится рядом с файлом
+        настроек, через TTL загружается заново.
+    """
+
+    FILENAME = 'directory.jsonl'
+    TTL = datetime.timedelta(days=1)
+
+    @classmethod
+    def _get_filepath(cls) -> str:
+        return os.path.join(Settings.get_dirpath('cache'), cls.FILENAME)
+
+    @classmethod
+    def _read(cls) -> List[UserInfo]:
+        with open(cls._get_filepath(), 'r', encoding='utf-8') as f:
+            return [UserInfo.from_dict(json.loads(line)) for line in f]
+
+    @classmethod
+    def is_fresh(cls) -> bool:
+        try:
+            mtime = os.path.getmtime(cls._get_filepath())
+        except OSError:
+            return False
+        return datetime.datetime.now() - datetime.datetime.fromtimestamp(mtime) < cls.TTL
+
+    @classmethod
+    def load(cls, learning: 'LearningDriver') -> List[UserInfo]:
+        """ Returns users from the snapshot, loads it first if it is missing or older than TTL """
+        if cls.is_fresh():
+            try:
+                return cls._read()
+            except (OSError, ValueError, KeyError, TypeError):
+                pass  # снимок повреждён, загружается заново
+
+        users = list(learning.iter_users())
+        path = cls._get_filepath()
+        try:
+            with open(path + '.tmp', 'w', encoding='utf-8') as f:
+                for user in users:
+                    f.write(json.dumps(user.as_dict(), ensure_ascii=False) + '\n')
+            os.replace(path + '.tmp', path)
+        except OSError:
+            pass
+        return users
+
+
+class FioIndex:
+    """ Нечёткий поиск пользователей по ФИО
+
+        Каждое слово ФИО разбивается на триграммы (с границами слова), для
+        каждой триграммы хранится список пользователей. Сходство - коэффициент
+        Дайса по множествам триграмм, порядок слов не важен. match_all() ищет
+        сразу все имена: список каждой триграммы читается один раз.
+    """
+
+    MIN_SCORE = 0.6
+    TOP = 3
+
+    _NOT_LETTERS = re.compile(r'[^\w]+|[\d_]+')
+
+    def __init__(self, users: Iterable[UserInfo]):
+        self.users = list(users)
+        self._sizes: List[int] = []
+        self._postings: Dict[str, List[int]] = defaultdict(list)  # триграмма -> номера пользователей
+        for i, user in enumerate(self.users):
+            grams = self.trigrams(user.fio)
+            self._sizes.append(len(grams))
+            for gram in grams:
+                self._postings[gram].append(i)
+
+    def __len__(self):
+        return len(self.users)
+
+    @classmethod
+    def trigrams(cls, fio) -> FrozenSet[str]:
+        words = cls._NOT_LETTERS.sub(' ', str(fio or '').casefold().replace('ё', 'е')).split()
+        return frozenset(
+            word[i:i + 3]
+            for word in (f"^{x}$" for x in words)
+            for i in range(len(word) - 2)
+        )
+
+    def match_all(self, names: Iterable[str], top: int = TOP,
+            min_score: float = MIN_SCORE) -> List[List[Tuple[UserInfo, float]]]:
+        """ Returns [[(UserInfo, score), ...] best first, ...] for every name, keeping order """
+        queries = [self.trigrams(x) for x in names]
+        by_gram = defaultdict(list)  # триграмма -> номера имён
+        for q, grams in enumerate(queries):
+            for gram in grams:
+                by_gram[gram].append(q)
+
+        common = [Counter() for _ in queries]  # номер пользователя -> общих триграмм
+        for gram, query_ids in by_gram.items():
+            postings = self._postings.get(gram)
+            if not postings:
+                continue
+            for q in query_ids:
+                common[q].update(postings)
+
+        result = []
+        for grams, counts in zip(queries, common):
+            scored = (
+                (2 * count / (len(grams) + self._sizes[i]), i)
+                for i, count in counts.items()
+            )
+            best = heapq.nlargest(top, (x for x in scored if x[0] >= min_score))
+            result.append([(self.users[i], round(score, 3)) for score, i in best])
+        return result
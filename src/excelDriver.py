@@ -1,15 +1,18 @@
 from openpyxl import load_workbook, Workbook
+from openpyxl.cell import WriteOnlyCell
 from openpyxl.comments import Comment
 from openpyxl.styles import PatternFill, Font, Alignment
 from openpyxl.utils import get_column_letter
 from openpyxl.worksheet.worksheet import Worksheet
 import os
 import re
+import sys
 import errno
-from typing import List, Tuple, NamedTuple, Optional, Iterable
+from typing import Dict, List, Tuple, NamedTuple, Optional, Iterable
 from copy import copy
 
 from datatypes import EmailNLogin, UserTableData, TableSubject
+from tableCache import TableCache, TableSnapshot
 from utils import convert_date_string, is_array_consecutive, is_blue_color, is_red_color
 
 
@@ -33,9 +36,47 @@ class ExcelDriver:
 
     _xlsx = None
     _filepath = None
+    _deferred = False  # файл ещё не разобран openpyxl (см. load(lazy=True))
+    _snapshot: Optional[TableSnapshot] = None
+    _table_clean = False  # данные пользователей на первом листе не менялись после загрузки
+
+    def _get_headers(self) -> Dict[str, Tuple]:
+        return {
+            sheet.title: next(sheet.iter_rows(max_row=1, values_only=True), ())
+            for sheet in self._xlsx
+        }
+
+    def _get_user_columns(self, worksheet) -> Dict[str, int]:
+        return {
+            'email': self.get_email_column_id(worksheet),
+            'login': self.get_column_by_name(worksheet, 'логин'),
+            'subject': self.get_column_by_name(worksheet, 'предмет'),
+            'date': self.get_column_by_name(worksheet, 'выбранная дата'),
+            'fio': self.get_columns_with_fio(worksheet)[0],
+        }
+
+    def _is_snapshot_valid(self) -> bool:
+        """ Снимок годится, если таблица не менялась методами драйвера, а заголовки
+            листов и столбцы первого листа совпадают со снимком (книгу могли
+            изменить и напрямую через openpyxl)
+        """
+        if self._snapshot is None or not self._table_clean:
+            return False
+        if self._xlsx is None:
+            return True  # книга не разобрана, файл не менялся (см. TableCache.get)
+        try:
+            columns = self._get_user_columns(self.get_first_worksheet())
+        except (ColumnNotFoundException, SheetNotFoundException):
+            columns = None
+        if columns != self._snapshot.columns or self._get_headers() != self._snapshot.headers:
+            self._snapshot = None
+            self._table_clean = False
+            return False
+        return True
 
     def append_rows(self, rows: Iterable[Iterable], worksheet=None) -> bool:
         self.check_loaded()
+        self._table_clean = False
         ws = worksheet if worksheet else self._xlsx.active
 
         rows_count = len(rows)
@@ -65,6 +106,7 @@ class ExcelDriver:
         """
 
         self.check_loaded()
+        self._table_clean = False
 
         for ws in self._xlsx:
             email_col = self.get_email_column_id(ws)
@@ -87,6 +129,7 @@ class ExcelDriver:
 
     def change_login_password(self, email: str, login: str, password: str):
         self.check_loaded()
+        self._table_clean = False
         for sheetname in self._xlsx.sheetnames:
             ws = self._xlsx[sheetname]
 
@@ -107,15 +150,21 @@ class ExcelDriver:
                 passw_cell.value = password
 
     def check_loaded(self):
+        if self._xlsx == None and self._deferred:
+            self._xlsx = load_workbook(self._filepath)
+            self._deferred = False
         if self._xlsx == None:
             raise NotLoadedException()
 
     def clone_sheet(self, source_worksheet) -> Worksheet:
         """ Returns worksheet with cloned data (unique) """
+        self.check_loaded()
+        self._table_clean = False
         return self._xlsx.copy_worksheet(source_worksheet)
 
     def clone_sheet_unique(self, ws_copy, ws_paste, unique_column_name) -> None:
         """ Copy data from ws_copy to ws_paste (unique) """
+        self._table_clean = False
         unique_column = self.get_column_by_name(ws_copy, unique_column_name)
         email_column = self.get_email_column_id(ws_copy)
         password_column = self.get_column_by_name(ws_copy, 'пароль')
@@ -132,7 +181,8 @@ class ExcelDriver:
             for cell in row:
                 new_cell = ws_paste.cell(row=last_inserted_row, column=cell.column,
                         value=cell.value)
-                if cell.column == password_column and i != 0 and formula_reexp.match(cell.value):
+                if cell.column == password_column and i != 0 and isinstance(cell.value, str) \
+                        and formula_reexp.match(cell.value):
                         new_cell.value = password_formula.replace('%i', str(last_inserted_row))
                 if cell.has_style:
                     new_cell.font = copy(cell.font)
@@ -147,6 +197,7 @@ class ExcelDriver:
 
     def create_sheet(self, *args, **kwargs):
         self.check_loaded()
+        self._table_clean = False
         return self._xlsx.create_sheet(*args, **kwargs)
 
     def delete_rows(self, worksheet: Worksheet, row: int, amount=1) -> None:
@@ -154,6 +205,7 @@ class ExcelDriver:
         self.check_loaded()
         if amount < 1 or row > worksheet.max_row:
             return
+        self._table_clean = False
 
         max_row = worksheet.max_row
         max_column = worksheet.max_column
@@ -172,6 +224,7 @@ class ExcelDriver:
 
     def delete_user_from_workbook(self, email: str, subject: Optional[str] = None) -> None:
         self.check_loaded()
+        self._table_clean = False
 
         general_worksheet = self._xlsx["Общий"]
         rows_in_general_list = self.get_rows_with_user(general_worksheet, email)
@@ -204,6 +257,9 @@ class ExcelDriver:
                     self.delete_row(worksheet, row)
             
     def get_all_users_data(self, first_row_is_header=True) -> Tuple[UserTableData]:
+        if first_row_is_header and self._is_snapshot_valid():
+            return self._snapshot.users
+
         self.check_loaded()
         userdata = dict()
         ws = self.get_first_worksheet()
@@ -214,6 +270,7 @@ class ExcelDriver:
         sel_date_column = self.get_column_by_name(ws, 'выбранная дата')
         fio_columns = self.get_columns_with_fio(ws)
         
+        subjects = dict()  # одинаковые TableSubject разделяются между пользователями
         start_row = 2 if first_row_is_header else 1
         for column in ws.iter_cols(min_col=email_column, max_col=email_column, min_row=start_row):
             for cell in column:
@@ -229,7 +286,7 @@ class ExcelDriver:
                     if not fio: fio = None
 
                     mark = self.get_cell_mark(ws.cell(row=cell.row, column=fio_columns[0]))
-                    marks = [mark] if mark != 'none' else None
+                    marks = (mark,) if mark != 'none' else None
 
                     userdata[email] = UserTableData(
                         email=email,
@@ -241,10 +298,29 @@ class ExcelDriver:
                     utd = userdata[email]
                 subject_name = ws.cell(row=cell.row, column=subject_column).value
                 subject_date = ws.cell(row=cell.row, column=sel_date_column).value
-                subject_date = convert_date_string(str(subject_date)) if subject_date else None
-                utd.subjects.append(TableSubject(subject_name, subject_date))
-
-        return tuple(userdata.values())
+                subject = subjects.get((subject_name, subject_date))
+                if subject is None:
+                    subject = TableSubject(
+                        sys.intern(subject_name) if type(subject_name) == str else subject_name,
+                        convert_date_string(str(subject_date)) if subject_date else None
+                    )
+                    subjects[(subject_name, subject_date)] = subject
+                utd.subjects.append(subject)
+
+        users = tuple(utd._replace(subjects=tuple(utd.subjects)) for utd in userdata.values())
+        if first_row_is_header and self._table_clean:
+            self._snapshot = TableSnapshot(
+                users=users,
+                columns={
+                    'email': email_column, 'login': login_column,
+                    'subject': subject_column, 'date': sel_date_column,
+                    'fio': fio_columns[0],
+                },
+                headers=self._get_headers(),
+                email_index={user.email: i for i, user in enumerate(users)},
+            )
+            TableCache.put(self._filepath, self._snapshot)
+        return users
 
     @classmethod
     def get_cell_mark(cls, cell) -> str:
@@ -362,6 +438,17 @@ class ExcelDriver:
         return "=(RIGHT(H%i,5)+23000)*15"
 
     def get_user_data(self, email, first_row_is_header=True) -> UserTableData:
+        if first_row_is_header and self._table_clean:
+            # Одна выборка всей таблицы дешевле поиска по листу для каждого email
+            # и сразу попадает в кэш снимков
+            try:
+                users = self.get_all_users_data()
+            except (ColumnNotFoundException, SheetNotFoundException):
+                users = None
+            if users is not None and self._snapshot is not None:
+                idx = self._snapshot.email_index.get(email)
+                return users[idx] if idx is not None else None
+
         self.check_loaded()
         _email = email
         userdata = None
@@ -388,7 +475,7 @@ class ExcelDriver:
                     if not fio: fio = None
 
                     mark = self.get_cell_mark(ws.cell(row=cell.row, column=fio_columns[0]))
-                    marks = [mark] if mark != 'none' else None
+                    marks = (mark,) if mark != 'none' else None
 
                     userdata = UserTableData(
                         email=email,
@@ -402,8 +489,18 @@ class ExcelDriver:
                 subject_date = convert_date_string(str(subject_date)) if subject_date else None
                 userdata.subjects.append(TableSubject(subject_name, subject_date))
 
+        if userdata:
+            userdata = userdata._replace(subjects=tuple(userdata.subjects))
         return userdata
 
+    def get_users_data(self, emails: Iterable[str], first_row_is_header=True) -> Dict[str, Optional[UserTableData]]:
+        """ Returns {email: get_user_data(email)} for all emails using one pass over the sheet """
+        users = {x.email: x for x in self.get_all_users_data(first_row_is_header)}
+        return {email: users.get(email) for email in emails}
+
+    def get_filepath(self) -> str:
+        return self._filepath
+
     def get_worksheet(self, name):
         self.check_loaded()
         for sheetname in self._xlsx.sheetnames:
@@ -418,6 +515,7 @@ class ExcelDriver:
                   %i for row number
             formula = ExcelDriver.get_password_formula()
         """
+        self._table_clean = False
         formula = self.get_password_formula()
         password_column_id = self.get_column_by_name(worksheet, 'пароль')
         start_row = 2 if first_row_is_header else 1
@@ -428,24 +526,67 @@ class ExcelDriver:
 
     def create_empty(self):
         self._xlsx = Workbook()
+        self._deferred = False
+        self._snapshot = None
+        self._table_clean = False
 
-    def load(self, filepath):
+    def load(self, filepath, lazy=False):
+        """ Load workbook from file
+
+            lazy(bool=False): if the file is unchanged since the last time its users
+                                were read, postpone openpyxl parsing until the workbook
+                                itself is needed, get_all_users_data() and get_user_data()
+                                are answered from the cached snapshot
+        """
         if not os.path.isfile(filepath):
             raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT), filepath)
-        self._xlsx = load_workbook(filepath)
         self._filepath = filepath
+        self._snapshot = TableCache.get(filepath)
+        self._table_clean = True
+        if lazy and self._snapshot is not None:
+            self._xlsx = None
+            self._deferred = True
+            return
+        self._xlsx = load_workbook(filepath)
+        self._deferred = False
 
     def remove_other_sheets(self, worksheet):
+        """ Remove every sheet except worksheet.
+
+            openpyxl.Workbook.remove() leaves the active sheet index, book views
+            and workbook-level defined names pointing at the removed sheets,
+            so they are reset here and the workbook stays usable without reloading.
+        """
         self.check_loaded()
+        self._table_clean = False
+        removed_titles = set()
         for sheet in self._xlsx:
             if sheet != worksheet:
+                removed_titles.add(sheet.title)
                 self._xlsx.remove(sheet)
 
+        self._xlsx.active = worksheet
+        for view in self._xlsx.views:
+            view.firstSheet = 0
+            view.activeTab = 0
+        worksheet.sheet_view.tabSelected = True
+
+        for name, defined_name in list(self._xlsx.defined_names.items()):
+            try:
+                destinations = list(defined_name.destinations)
+            except Exception:
+                continue
+            if any(sheetname in removed_titles for sheetname, _ in destinations):
+                del self._xlsx.defined_names[name]
+
     def save(self, filepath=None):
         self.check_loaded()
         _filepath = filepath if filepath else self._filepath
         self._xlsx.save(_filepath)
         self._filepath = _filepath
+        if self._is_snapshot_valid():
+            # Данные пользователей не изменились, снимок годится и для нового файла
+            TableCache.put(_filepath, self._snapshot)
 
     @classmethod
     def mark_user(cls, worksheet, email, first_row_is_header=True, fgColor='FF558ED5'):
@@ -463,19 +604,21 @@ class ExcelDriver:
 
     def mark_user_as_registered(self, email, first_row_is_header=True):
         self.check_loaded()
+        self._table_clean = False
         for worksheet in self._xlsx:
             self.mark_user(worksheet, email, first_row_is_header, COLOR_FILL_REGISTERED)
     
     def mark_user_as_skipped(self, email, first_row_is_header=True):
         self.check_loaded()
+        self._table_clean = False
         for worksheet in self._xlsx:
             self.mark_user(worksheet, email, first_row_is_header, COLOR_FILL_SKIPPED)
 
-    @classmethod
-    def set_comment(cls, worksheet, email, comment) -> bool:
+    def set_comment(self, worksheet, email, comment) -> bool:
         """ Sets the comment at the first email cell. """
+        self._table_clean = False
         fill = PatternFill('solid', fgColor=COLOR_FILL_COMMENT)
-        email_column = cls.get_email_column_id(worksheet)
+        email_column = self.get_email_column_id(worksheet)
         for col_items in worksheet.iter_cols(min_col=email_column, max_col=email_column):
             for cell in col_items:
                 if cell.value == email:
@@ -484,8 +627,41 @@ class ExcelDriver:
                     return True
         return False
 
+    @staticmethod
+    def write_table(filepath, header: Iterable, cols_size: Optional[Iterable] = None,
+            rows: Iterable[Iterable] = ()) -> int:
+        """ Writes a new workbook with one sheet row by row without keeping it in memory
+            Returns number of written rows (without header)
+        """
+        header = list(header)
+        if cols_size and len(cols_size) != len(header):
+            raise ValueError("Length of 'cols_size' should be equal to 'header' length")
+
+        xlsx = Workbook(write_only=True)
+        ws = xlsx.create_sheet()
+        for i, size in enumerate(cols_size or ()):
+            ws.column_dimensions[get_column_letter(i + 1)].width = size
+
+        bold_font = Font(name='Calibri', bold=True)
+        center_alignment = Alignment(horizontal='center', vertical='center')
+        header_cells = []
+        for title in header:
+            cell = WriteOnlyCell(ws, value=title)
+            cell.font = bold_font
+            cell.alignment = center_alignment
+            header_cells.append(cell)
+        ws.append(header_cells)
+
+        written = 0
+        for row in rows:
+            ws.append(row)
+            written += 1
+        xlsx.save(filepath)
+        return written
+
     def write_header(self, header: Iterable, cols_size: Optional[Iterable] = None, row_num=1, worksheet=None):
         self.check_loaded()
+        self._table_clean = False
         ws = worksheet if worksheet else self._xlsx.active
 
         header_len = len(header)
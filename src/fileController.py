@@ -2,47 +2,83 @@
 #                           а операцию обработки файла в целом
 
 from copy import copy
-from collections import namedtuple
-from typing import Callable, Iterable, List, Optional
+from collections import defaultdict, namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+import datetime
 import traceback
 import re
 import os
 from time import sleep
 
 from excelDriver import ExcelDriver
-from label import LabelController
+from actionPlan import ActionPlan
+from journal import ActionJournal
+from noticeLog import PasswordIndex
+from directoryIndex import DirectorySnapshot, FioIndex
+from incrementalStore import IncrementalStore
+from suggestionStore import SuggestionStore
+from label import LabelController, LabelControllerError
 from learning import LearningDriver, UserNotFound
+from daemon import invalidate_daemon_cache
 from datatypes import UserAction, UserActionType, UserInfo, AuthCookies
 from utils import (
     generate_random_string, suggest_user_actions, 
-    convert_date_string, is_blue_color, is_red_color
+    convert_date_string, is_blue_color, is_red_color,
+    get_file_hash, is_password_lookup_needed, get_last_autumn,
+    normalize_email
 )
 from settings import Settings
 
     
 class FileController:
-    # Небольшая пауза между запросами защищает связанный сервис от всплесков
-    # нагрузки при обработке больших таблиц.
-    REQUEST_DELAY_SECONDS = 0.05
     USER_SELECTION_DELAY_SECONDS = 1.5
+    # Число потоков для запросов к eLearning в пакетном режиме
+    MAX_WORKERS = 8
+    # Сколько пользователей получают метку одним запросом
+    TAG_BATCH_SIZE = 100
+    # Через сколько пользователей сохранять файл при выполнении плана
+    CHECKPOINT_USERS = 100
+    # С этого числа пользователей пароли ищутся одним просмотром журнала уведомлений
+    PASSWORD_INDEX_MIN_USERS = 20
+    # Сколько похожих по ФИО пользователей предлагать для строки, не найденной по email
+    FIO_MATCH_TOP = 3
+
+    # Действия, которые выполняются только в eLearning и не меняют таблицу
+    LEARNING_ACTIONS = frozenset((
+        UserActionType.DELETE, UserActionType.ADD_LABEL,
+        UserActionType.REMOVE_LABEL, UserActionType.CHANGE_PASSW_EDU,
+    ))
+
+    @staticmethod
+    @contextmanager
+    def _executor(workers: int):
+        """ Пул потоков, при ошибке отменяющий ещё не начатые задачи """
+        executor = ThreadPoolExecutor(max_workers=workers)
+        try:
+            yield executor
+        except BaseException:
+            executor.shutdown(wait=True, cancel_futures=True)
+            raise
+        executor.shutdown(wait=True)
 
     @staticmethod
     def _prepare_workbook(xlsx: ExcelDriver, filepath: str):
+        """ Оставляет в книге только лист «Общий» и его копию
+            «Для предметов и меток». Файл читается и записывается один раз.
+        """
         xlsx.load(filepath)
 
         worksheet = xlsx.get_first_worksheet()
         xlsx.remove_other_sheets(worksheet)
-        xlsx.save()
-
-        # openpyxl keeps references to removed worksheets, so reopen the file
-        # before creating the working copies.
-        xlsx.load(filepath)
-        worksheet = xlsx.get_first_worksheet()
         worksheet.title = "Общий"
         xlsx.insert_passwords(worksheet)
 
         labels_worksheet = xlsx.clone_sheet(worksheet)
         labels_worksheet.title = "Для предметов и меток"
+        labels_worksheet.sheet_view.tabSelected = False
+        xlsx.save()
         return labels_worksheet
 
     @staticmethod
@@ -50,24 +86,247 @@ class FileController:
             user_table_data: Iterable,
             learning: LearningDriver,
             progress_gen: Callable,
-            sleep_func: Callable[[float], None],
+            workers: int = 1,
+            journal: Optional[ActionJournal] = None,
+            prepared: Optional[dict] = None,
     ) -> list[UserInfo]:
-        users = []
-        progress = progress_gen(user_table_data, title="Поиск пользователей...")
+        """ prepared: {table email: [(UserInfo, suggested), ...]} из SuggestionStore
+
+            Адреса нормализуются (normalize_email), каждый адрес ищется один раз,
+            результат раздаётся всем строкам таблицы с этим адресом
+        """
+        user_table_data = list(user_table_data)
+        found: List[Optional[List[UserInfo]]] = [None] * len(user_table_data)
+
+        # Результаты поиска из журнала прерванной обработки
+        known = dict()
+        if journal is not None:
+            known = {x['email']: x['users'] for x in journal.records('lookup')}
+
+        def add(i, matched_users, is_new):
+            table_user = user_table_data[i]
+            if is_new and journal is not None:
+                journal.append({
+                    't': 'lookup', 'email': table_user.email,
+                    'users': [x.as_dict() for x in matched_users],
+                }, sync=False)
+            found[i] = matched_users
+
+        planned = defaultdict(list)  # normalized email -> номера строк
+        for i, table_user in enumerate(user_table_data):
+            if prepared and table_user.email in prepared:
+                add(i, [x for x, _ in prepared[table_user.email]], True)
+            elif table_user.email in known:
+                add(i, [UserInfo.from_dict(x) for x in known[table_user.email]], False)
+            else:
+                planned[normalize_email(table_user.email)].append(i)
 
-        for table_user in progress:
-            sleep_func(FileController.REQUEST_DELAY_SECONDS)
+        def lookup(email):
+            # Паузы между запросами и их число ограничивает LearningDriver.request
             try:
-                matched_users = learning.get_user_info(table_user.email)
+                return email, learning.get_user_info(email)
             except UserNotFound:
-                continue
+                return email, []
+
+        def add_all(email, matched_users):
+            for n, i in enumerate(planned[email]):
+                add(i, matched_users if n == 0 else [copy(x) for x in matched_users], True)
+
+        if workers > 1:
+            with FileController._executor(workers) as executor:
+                futures = [executor.submit(lookup, x) for x in planned]
+                for future in progress_gen(futures, title="Поиск пользователей..."):
+                    add_all(*future.result())
+        else:
+            for email in progress_gen(list(planned), title="Поиск пользователей..."):
+                add_all(*lookup(email))
 
+        users = []
+        for table_user, matched_users in zip(user_table_data, found):
             for user_info in matched_users:
                 user_info.table = table_user
                 users.append(user_info)
-
         return users
 
+    @staticmethod
+    def _match_by_fio(table_rows: List, table_emails: set, learning: LearningDriver,
+            message_callback: Callable) -> List[UserInfo]:
+        """ Кандидаты для строк, пользователи которых не найдены по email:
+            до FIO_MATCH_TOP пользователей с похожим ФИО из DirectorySnapshot.
+            Пользователи с адресом из таблицы не предлагаются.
+            Returns UserInfo with table and fio_match set
+        """
+        table_rows = [x for x in table_rows if x.fio and x.fio.strip()]
+        if not table_rows:
+            return []
+        message_callback("Поиск по ФИО для пользователей, не найденных по email...", status="info")
+        index = FioIndex(DirectorySnapshot.load(learning))
+        candidates = []
+        matched_rows = 0
+        all_matches = index.match_all((x.fio for x in table_rows), top=FileController.FIO_MATCH_TOP)
+        for table_user, matches in zip(table_rows, all_matches):
+            matches = [(x, score) for x, score in matches if normalize_email(x.email) not in table_emails]
+            matched_rows += bool(matches)
+            for userinfo, score in matches:
+                candidate = copy(userinfo)
+                candidate.table = table_user
+                candidate.fio_match = score
+                candidates.append(candidate)
+        message_callback(f"Похожие по ФИО пользователи найдены для {matched_rows}/{len(table_rows)} строк", status="info")
+        return candidates
+
+    @staticmethod
+    def _suggest_all(users: List[UserInfo], learning: LearningDriver,
+            workers: int = 1, passwords=None) -> List[List[UserAction]]:
+        """ Returns suggest_user_actions() for every user, keeping order """
+        suggest = lambda userinfo: suggest_user_actions(userinfo, learning=learning, passwords=passwords)
+        if workers <= 1:
+            return [suggest(x) for x in users]
+        with FileController._executor(workers) as executor:
+            return list(executor.map(suggest, users))
+
+    @staticmethod
+    def _build_password_index(users: List[UserInfo], learning: LearningDriver, workers: int,
+            message_callback: Callable) -> Optional[PasswordIndex]:
+        """ Собирает пароли одним просмотром журнала уведомлений, если их нужно
+            искать хотя бы для PASSWORD_INDEX_MIN_USERS пользователей и
+            просмотр дешевле поиска писем каждого из них отдельно
+        """
+        candidates = [x for x in users if is_password_lookup_needed(x)]
+        if len(candidates) < FileController.PASSWORD_INDEX_MIN_USERS:
+            return None
+        # Письма с паролем не старше регистрации пользователя
+        since = get_last_autumn()
+        if all(x.registered for x in candidates):
+            since = min(x.registered for x in candidates) - datetime.timedelta(days=1)
+        max_pages = len(candidates) // PasswordIndex.PAGE_COST
+        passwords = PasswordIndex(learning, since, workers=max(1, workers), max_pages=max_pages)
+        found = passwords.build()
+        if found is None:
+            message_callback("Журнал уведомлений за период регистрации слишком велик, "
+                             "пароли ищутся для каждого пользователя отдельно", status="info")
+            return None
+        message_callback(f"Письма с паролями найдены для {found} пользователей", status="info")
+        return passwords
+
+    @staticmethod
+    def _checkpoint(xlsx: ExcelDriver, user_actions: List[tuple],
+            journal: Optional[ActionJournal] = None) -> None:
+        """ Сохраняет файл, если таблица менялась, и записывает
+            выполненные действия в журнал вместе с хэшем сохранённого файла
+        """
+        records = []
+        xlsx_changed = False
+        for userinfo, uactions in user_actions:
+            done = [x for x in uactions if x.completed]
+            if done:
+                records.append(ActionJournal.done_record(userinfo, done))
+            xlsx_changed |= any(x.action not in FileController.LEARNING_ACTIONS for x in done)
+        if xlsx_changed:
+            xlsx.save()
+            if journal is not None:
+                records.append({'t': 'checkpoint', 'sha256': get_file_hash(xlsx.get_filepath())})
+        if journal is not None:
+            journal.extend(records)
+
+    @staticmethod
+    def _perform_all_user_actions(
+            xlsx: ExcelDriver,
+            learning: LearningDriver,
+            user_actions: List[tuple],
+            progress_gen: Callable,
+            message_callback: Callable,
+            workers: int = 1,
+            journal: Optional[ActionJournal] = None,
+    ) -> set:
+        """ Выполняет выбранные действия над пользователями
+            Returns indexes of user_actions whose actions failed
+
+            При workers > 1 действия в eLearning выполняются параллельно,
+            метки назначаются сразу группе пользователей, а изменения
+            таблицы - по порядку в текущем потоке с сохранением каждые
+            CHECKPOINT_USERS пользователей.
+            С журналом выполненные действия записываются в него,
+            изменения таблицы - только после сохранения файла.
+            Кэш запущенного демона сбрасывается для всех пользователей с
+            действиями в eLearning, даже если выполнение прервано.
+        """
+        failed = set()
+
+        def report_error(i, userinfo, uactions):
+            failed.add(i)
+            message_callback(traceback.format_exc(), status="info")
+            message_callback(f"Не удалось выполнить действия для пользователя ({userinfo.mid}, {userinfo.email})", status="bad")
+            message_callback(uactions, status='info')
+
+        try:
+            if workers <= 1:
+                for i, (userinfo, uactions) in enumerate(progress_gen(user_actions, title="Выполнение действий...")):
+                    todo = [x for x in uactions if not x.completed]
+                    if not todo: continue
+                    try:
+                        FileController.perform_user_actions(xlsx, learning, userinfo, todo, save=journal is None)
+                    except Exception:
+                        report_error(i, userinfo, uactions)
+                    if journal is not None:
+                        FileController._checkpoint(xlsx, [(userinfo, todo)], journal)
+                return failed
+
+            failed.update(FileController._perform_learning_actions_batched(
+                learning, user_actions, progress_gen, message_callback, journal, workers))
+
+            # Таблица меняется только после успешных действий в eLearning
+            pending = []
+            for i, (userinfo, uactions) in enumerate(progress_gen(user_actions, title="Изменение таблицы...")):
+                if i in failed: continue
+                todo = [x for x in uactions if not x.completed]
+                if not todo: continue
+                try:
+                    FileController.perform_user_actions(xlsx, learning, userinfo, todo, save=False)
+                except Exception:
+                    report_error(i, userinfo, uactions)
+                pending.append((userinfo, todo))
+                if len(pending) >= FileController.CHECKPOINT_USERS:
+                    FileController._checkpoint(xlsx, pending, journal)
+                    pending.clear()
+            FileController._checkpoint(xlsx, pending, journal)
+            return failed
+        finally:
+            FileController._invalidate_daemon_cache(user_actions)
+
+    @staticmethod
+    def _invalidate_daemon_cache(user_actions: Iterable[tuple]) -> None:
+        """ Запущенный демон (app.py daemon) не должен отдавать из кэша
+            пользователей, изменённых в eLearning
+        """
+        changed = [
+            uinfo for uinfo, uactions in user_actions
+            if any(x.action in FileController.LEARNING_ACTIONS for x in uactions)
+        ]
+        if changed:
+            invalidate_daemon_cache(emails=[x.email for x in changed],
+                                    user_ids=[x.mid for x in changed if x.mid is not None])
+
+    @staticmethod
+    def _open_journal(filepath: str, message_callback: Callable) -> ActionJournal:
+        """ Returns journal of step1 for the file
+
+            Если файл изменён после последней контрольной точки, из журнала
+            остаются только результаты поиска пользователей.
+        """
+        journal = ActionJournal.for_file(filepath, 'step1', os.path.abspath(filepath))
+        if not any(True for _ in journal.records()):
+            return journal
+
+        checkpoint = journal.last('checkpoint')
+        if checkpoint is None or checkpoint['sha256'] != get_file_hash(filepath):
+            journal.reset(keep=('lookup',))
+            message_callback("Файл изменён после прерванной обработки, "
+                             "из неё используются только результаты поиска пользователей", status="info")
+        else:
+            message_callback("Продолжение прерванной обработки файла", status="info")
+        return journal
+
     @staticmethod
     def step1(
             filepath: str,
@@ -79,6 +338,10 @@ class FileController:
             learning: Optional[LearningDriver] = None,
             xlsx: Optional[ExcelDriver] = None,
             sleep_func: Callable[[float], None] = sleep,
+            workers: int = 1,
+            resume: bool = True,
+            incremental: bool = False,
+            match_fio: bool = False,
     ) -> bool:
         """ Обработка файла часть 1
             Args:
@@ -89,6 +352,16 @@ class FileController:
                 ask_user_actions (Callable): Callback для выбора действий над пользователем
                 confirm_user_actions (Callable): Callback для подтверждения действий
                 message_callback (Callable): Callback для отправки сообщений
+                workers (int): Число потоков для запросов к eLearning
+                resume (bool): Вести журнал и продолжить прерванную обработку файла.
+                                Найденные пользователи, выбранные и выполненные
+                                действия берутся из журнала
+                incremental (bool): Искать и выбирать действия только для новых
+                                и изменённых строк, для остальных взять результаты
+                                прошлой обработки файла. Результаты запоминаются
+                                при любом значении
+                match_fio (bool): Для строк, не найденных по email, предложить
+                                пользователей с похожим ФИО
         """
         if learning is None:
             auth = Settings().get_crypted('auth')
@@ -96,15 +369,135 @@ class FileController:
         if xlsx is None:
             xlsx = ExcelDriver()
 
-        ws_labels = FileController._prepare_workbook(xlsx, filepath)
+        journal = FileController._open_journal(filepath, message_callback) if resume else None
+        if journal is not None and journal.has('prepared'):
+            xlsx.load(filepath)
+            ws_labels = xlsx.get_worksheet("Для предметов и меток")
+        else:
+            # Подготовка повторяема: лишние листы удаляются снова
+            ws_labels = FileController._prepare_workbook(xlsx, filepath)
+            if journal is not None:
+                journal.extend(({'t': 'prepared'}, {'t': 'checkpoint', 'sha256': get_file_hash(filepath)}))
 
         # Обработка пользователей
         user_table_data = xlsx.get_all_users_data()
+        fresh_table_data, reused = user_table_data, []
+        store = IncrementalStore.for_file(filepath)
+        if incremental:
+            fresh_table_data, reused = FileController._split_known_rows(user_table_data, store)
+            message_callback(
+                f"Без изменений с прошлой обработки: {len(user_table_data) - len(fresh_table_data)}"
+                f"/{len(user_table_data)} строк", status="info")
+
+        user_actions = []
+        if fresh_table_data or not incremental:
+            user_actions = FileController._choose_user_actions(
+                fresh_table_data, learning,
+                progress_gen, ask_user_actions, confirm_users_actions, message_callback,
+                sleep_func, workers, journal,
+                SuggestionStore.for_file(filepath).find_all(fresh_table_data),
+                match_fio,
+            )
+            if user_actions is None:
+                return False
+        user_actions = reused + user_actions
+
+        # Реализация судьбы пользователей
+        if user_actions:
+            if journal is not None:
+                for userinfo, uactions in user_actions:
+                    journal.restore_completed(userinfo, uactions)
+            FileController._perform_all_user_actions(
+                xlsx, learning, user_actions,
+                progress_gen, message_callback, workers, journal,
+            )
+
+        # Финиш
+        if xlsx.get_worksheet("Для логинов") is None:
+            FileController._finish_workbook(xlsx, ws_labels)
+        xlsx.save()
+        FileController._update_known_rows(store, xlsx, user_table_data, user_actions)
+        if journal is not None:
+            journal.delete()
+        message_callback("Обработка пользователей завершена. Файл сохранён.")
+        return True
+
+    @staticmethod
+    def _split_known_rows(user_table_data: Iterable,
+            store: IncrementalStore) -> Tuple[list, List[tuple]]:
+        """ Делит строки таблицы на новые/изменённые и обработанные ранее
+            Returns (fresh rows, [(UserInfo, [UserAction, ...]), ...] from the store)
+        """
+        fresh, reused = [], []
+        for table_user in user_table_data:
+            found = store.find(table_user)
+            if found is None:
+                fresh.append(table_user)
+                continue
+            entry, is_processed = found
+            for data in entry['users']:
+                userinfo = UserInfo.from_dict(data, table=table_user)
+                uactions = [UserAction.from_dict(x) for x in entry['actions'].get(str(userinfo.mid), [])]
+                if not is_processed:
+                    # Строка в исходном виде: действия с таблицей нужно повторить,
+                    # действия в eLearning уже выполнены
+                    for uaction in uactions:
+                        if uaction.action not in FileController.LEARNING_ACTIONS:
+                            uaction.completed = False
+                reused.append((userinfo, uactions))
+        return fresh, reused
+
+    @staticmethod
+    def _update_known_rows(store: IncrementalStore, xlsx: ExcelDriver,
+            user_table_data: Iterable, user_actions: List[tuple]) -> None:
+        """ Запоминает результаты обработки строк с найденными пользователями.
+            Строки без пользователей (и с найденными только по ФИО) не
+            запоминаются: пользователь может зарегистрироваться до следующей обработки.
+        """
+        processed = {x.email: x for x in xlsx.get_all_users_data()}
+        by_email = defaultdict(list)
+        for userinfo, uactions in user_actions:
+            if userinfo.fio_match is None:  # найденные по ФИО не запоминаются
+                by_email[userinfo.table.email].append((userinfo, uactions))
+        for table_user in user_table_data:
+            if table_user.email not in by_email:
+                continue
+            found = store.find(table_user)
+            if found is not None and found[1]:
+                continue  # строка уже была в обработанном виде
+            store.put(table_user, processed.get(table_user.email), by_email[table_user.email])
+        store.save()
+
+    @staticmethod
+    def _choose_user_actions(
+            user_table_data: Iterable,
+            learning: LearningDriver,
+            progress_gen: Callable,
+            ask_user_actions: Callable,
+            confirm_users_actions: Callable,
+            message_callback: Callable,
+            sleep_func: Callable[[float], None],
+            workers: int = 1,
+            journal: Optional[ActionJournal] = None,
+            prepared: Optional[dict] = None,
+            match_fio: bool = False,
+    ) -> Optional[List[tuple]]:
+        """ Ищет пользователей таблицы в eLearning и выбирает действия над ними
+            prepared: заранее найденные пользователи и предложенные действия,
+                        см. SuggestionStore.find_all()
+            match_fio: для строк, пользователи которых не найдены по email,
+                        предложить похожих по ФИО (см. _match_by_fio)
+            Returns [(UserInfo, [UserAction, ...]), ...] or None if the choice was not confirmed
+        """
+        index = learning.user_index
+        index_hits, index_lookups = index.hits, index.lookups
         users_exists = FileController._find_existing_users(
             user_table_data,
             learning,
             progress_gen,
-            sleep_func,
+            workers,
+            journal,
+            prepared,
         )
         
         # Отправка сообщения о завершении загрузки пользователей
@@ -112,43 +505,257 @@ class FileController:
         _t2 = len(users_exists)
         _t3 = round(_t2 / _t1 * 100, 2) if _t1 else 0
         message_callback(f"Найдено {_t2}/{_t1} ({_t3}%) пользователей", status="info")
+        index_hits, index_lookups = index.hits - index_hits, index.lookups - index_lookups
+        if index_lookups:
+            message_callback(
+                f"Найдено без запроса по ответам прошлых поисков: {index_hits}/{index_lookups} "
+                f"({round(index_hits / index_lookups * 100, 2)}%)", status="info")
         
-        if not _t2:
+
+        candidates = []
+        if match_fio:
+            found_emails = {normalize_email(x.table.email) for x in users_exists}
+            candidates = FileController._match_by_fio(
+                [x for x in user_table_data if normalize_email(x.email) not in found_emails],
+                {normalize_email(x.email) for x in user_table_data},
+                learning, message_callback,
+            )
+            users_exists = users_exists + candidates
+
+        if not users_exists:
             message_callback(f"Зарегистрированных пользователей нет.", status="info")
-        else:
-            message_callback(f"Выберите действия для найденных пользователей...")
-            sleep_func(FileController.USER_SELECTION_DELAY_SECONDS)
-
-            # Выбор судьбы пользователей
-            user_actions = list() # список действий над пользователями
-            for userinfo in users_exists:
-                suggested = suggest_user_actions(userinfo, learning=learning)
-                uactions = ask_user_actions(userinfo, suggested)
-                user_actions.append((userinfo, uactions))
-
-            # Подтверждение
-            users_actions_confirmed = confirm_users_actions(user_actions)
-            if not users_actions_confirmed:
-                message_callback("Обработка прервана.", status='bad')
-                return False
+            return []
 
-            # Реализация судьбы пользователей
-            for user_action in progress_gen(user_actions, title="Выполнение действий..."):
-                try:
-                    FileController.perform_user_actions(
-                        xlsx, 
-                        learning, user_action[0], user_action[1]
-                    )
-                except Exception as e:
-                    message_callback(traceback.format_exc(), status="info")
-                    message_callback(f"Не удалось выполнить действия для пользователя ({user_action[0].mid}, {user_action[0].email})", status="bad")
-                    message_callback(user_action[1], status='info')
-            
-        # Финиш
+        if journal is not None and journal.has('confirmed'):
+            decisions = {
+                (x['mid'], x['email']): [UserAction.from_dict(a) for a in x['actions']]
+                for x in journal.records('decision')
+            }
+            message_callback("Действия уже выбраны в прерванной обработке", status="info")
+            return [(x, decisions.get((x.mid, x.table.email), [])) for x in users_exists]
+
+        message_callback(f"Выберите действия для найденных пользователей...")
+        sleep_func(FileController.USER_SELECTION_DELAY_SECONDS)
+
+        # Выбор судьбы пользователей
+        user_actions = list() # список действий над пользователями
+        suggested_all = {
+            (uinfo.mid, uinfo.table.email): suggested
+            for rows in (prepared or {}).values() for uinfo, suggested in rows
+        }
+        if suggested_all:
+            message_callback(f"Действия подобраны заранее для {len(suggested_all)} пользователей", status="info")
+        for userinfo in candidates:
+            # Совпадение по ФИО может быть случайным, действия выбирает оператор
+            suggested_all[(userinfo.mid, userinfo.table.email)] = []
+        rest = [x for x in users_exists if (x.mid, x.table.email) not in suggested_all]
+        passwords = FileController._build_password_index(rest, learning, workers, message_callback)
+        if workers > 1:
+            for userinfo, suggested in zip(rest, FileController._suggest_all(rest, learning, workers, passwords)):
+                suggested_all[(userinfo.mid, userinfo.table.email)] = suggested
+        for userinfo in users_exists:
+            suggested = suggested_all.get((userinfo.mid, userinfo.table.email))
+            if suggested is None:
+                suggested = suggest_user_actions(userinfo, learning=learning, passwords=passwords)
+            uactions = ask_user_actions(userinfo, suggested)
+            user_actions.append((userinfo, uactions))
+
+        # Подтверждение
+        users_actions_confirmed = confirm_users_actions(user_actions)
+        if not users_actions_confirmed:
+            message_callback("Обработка прервана.", status='bad')
+            return None
+
+        if journal is not None:
+            records = [
+                {'t': 'decision', 'mid': userinfo.mid, 'email': userinfo.table.email,
+                 'actions': [x.as_dict() for x in uactions]}
+                for userinfo, uactions in user_actions
+            ]
+            records.append({'t': 'confirmed'})
+            journal.extend(records)
+        return user_actions
+
+    @staticmethod
+    def _finish_workbook(xlsx: ExcelDriver, ws_labels) -> None:
+        """ Добавляет лист «Для логинов» с уникальными пользователями """
         ws_logins = xlsx.create_sheet(title="Для логинов", index=1)
         xlsx.clone_sheet_unique(ws_copy=ws_labels, ws_paste=ws_logins, unique_column_name='email')
+
+    @staticmethod
+    def plan_step1(
+            filepath: str,
+            planpath: str,
+            progress_gen: Callable,
+            ask_user_actions: Callable,
+            confirm_users_actions: Callable,
+            message_callback: Callable,
+            *,
+            learning: Optional[LearningDriver] = None,
+            xlsx: Optional[ExcelDriver] = None,
+            sleep_func: Callable[[float], None] = sleep,
+            workers: int = 1,
+            match_fio: bool = False,
+    ) -> bool:
+        """ Обработка файла часть 1, планирование
+            Выполняет поиск пользователей и выбор действий как step1(), но
+            не изменяет ни файл, ни eLearning: выбранные действия
+            записываются в план planpath для apply_plan().
+        """
+        if learning is None:
+            auth = Settings().get_crypted('auth')
+            learning = LearningDriver(AuthCookies(*auth) if auth else None)
+        if xlsx is None:
+            xlsx = ExcelDriver()
+
+        # Листы удаляются только при выполнении плана, здесь, как и в
+        # _prepare_workbook(), пользователи берутся из первого листа
+        xlsx.load(filepath, lazy=True)
+        user_table_data = xlsx.get_all_users_data()
+        user_actions = FileController._choose_user_actions(
+            user_table_data, learning,
+            progress_gen, ask_user_actions, confirm_users_actions, message_callback,
+            sleep_func, workers, None,
+            SuggestionStore.for_file(filepath).find_all(user_table_data),
+            match_fio,
+        )
+        if user_actions is None:
+            return False
+
+        written = ActionPlan.write(planpath, filepath, user_actions)
+        message_callback(f"План сохранён, пользователей с действиями: {written}")
+        return True
+
+    @staticmethod
+    def _perform_learning_actions_batched(
+            learning: LearningDriver,
+            user_actions: List[tuple],
+            progress_gen: Callable,
+            message_callback: Callable,
+            journal: Optional[ActionJournal] = None,
+            workers: int = 1,
+    ) -> set:
+        """ Выполняет действия в eLearning, метки назначаются сразу группе пользователей
+            Returns indexes of user_actions whose actions failed
+        """
+        tasks = []  # ([(index, UserAction), ...], callable)
+        tag_users = dict()  # метка -> [(index, UserAction), ...]
+        for i, (uinfo, uactions) in enumerate(user_actions):
+            single = []
+            for uaction in uactions:
+                if uaction.completed or uaction.action not in FileController.LEARNING_ACTIONS:
+                    continue
+                if uaction == UserActionType.ADD_LABEL:
+                    tag_users.setdefault(uaction.param, []).append((i, uaction))
+                else:
+                    single.append(uaction)
+            if single:
+                tasks.append((
+                    [(i, x) for x in single],
+                    lambda uinfo=uinfo, single=single: FileController.perform_user_actions(
+                        None, learning, uinfo, single, save=False),
+                ))
+
+        size = FileController.TAG_BATCH_SIZE
+        for tag, items in tag_users.items():
+            for start in range(0, len(items), size):
+                chunk = items[start:start + size]
+                user_ids = ",".join(str(user_actions[i][0].mid) for i, _ in chunk)
+                tasks.append((chunk, lambda user_ids=user_ids, tag=tag: learning.add_tag(user_ids, tag)))
+
+        failed = set()
+        recorded = set()  # номера задач, уже записанных в журнал
+
+        def record(n, items, succeeded):
+            recorded.add(n)
+            if succeeded:
+                for _, uaction in items:
+                    uaction.completed = True
+            if journal is not None:
+                journal.extend(
+                    ActionJournal.done_record(user_actions[i][0], [uaction])
+                    for i, uaction in items if uaction.completed)
+
+        futures = []
+        try:
+            with FileController._executor(max(1, workers)) as executor:
+                futures = [(items, executor.submit(func)) for items, func in tasks]
+                for n, (items, future) in enumerate(progress_gen(futures, title="Выполнение действий в eLearning...")):
+                    try:
+                        future.result()
+                    except Exception:
+                        record(n, items, False)
+                        indexes = {i for i, _ in items}
+                        failed.update(indexes)
+                        message_callback(traceback.format_exc(), status="info")
+                        _users = ", ".join(f"({user_actions[i][0].mid}, {user_actions[i][0].email})" for i in sorted(indexes))
+                        message_callback(f"Не удалось выполнить действия в eLearning для пользователей {_users}", status="bad")
+                        message_callback([x for _, x in items], status='info')
+                        continue
+                    record(n, items, True)
+        except BaseException:
+            # При прерывании в журнал попадают и задачи, завершившиеся
+            # в других потоках, чтобы не выполнять их повторно
+            for n, (items, future) in enumerate(futures):
+                if n in recorded or future.cancelled():
+                    continue
+                record(n, items, future.exception() is None)
+            raise
+        return failed
+
+    @staticmethod
+    def apply_plan(
+            planpath: str,
+            progress_gen: Callable,
+            message_callback: Callable,
+            *,
+            filepath: Optional[str] = None,
+            learning: Optional[LearningDriver] = None,
+            xlsx: Optional[ExcelDriver] = None,
+            workers: int = 1,
+    ) -> bool:
+        """ Обработка файла часть 1, выполнение плана plan_step1()
+
+            Действия в eLearning выполняются параллельно, метки - пачками.
+            Выполненные действия записываются в журнал, поэтому после сбоя
+            повторный запуск продолжит с последней контрольной точки.
+        """
+        header, user_actions = ActionPlan.read(planpath)
+        if filepath is None:
+            filepath = header['file']
+        if learning is None:
+            auth = Settings().get_crypted('auth')
+            learning = LearningDriver(AuthCookies(*auth) if auth else None)
+        if xlsx is None:
+            xlsx = ExcelDriver()
+
+        journal = ActionJournal.for_file(planpath, 'apply', get_file_hash(planpath))
+        restored = sum(journal.restore_completed(uinfo, uactions) for uinfo, uactions in user_actions)
+        if restored:
+            message_callback(f"Продолжение выполнения плана, уже выполнено действий: {restored}", status="info")
+
+        if journal.has('prepared'):
+            xlsx.load(filepath)
+            ws_labels = xlsx.get_worksheet("Для предметов и меток")
+        else:
+            # Подготовка повторяема: лишние листы удаляются снова
+            ws_labels = FileController._prepare_workbook(xlsx, filepath)
+            journal.append({'t': 'prepared'})
+
+        failed = FileController._perform_all_user_actions(
+            xlsx, learning, user_actions,
+            progress_gen, message_callback, workers, journal,
+        )
+
+        if xlsx.get_worksheet("Для логинов") is None:
+            FileController._finish_workbook(xlsx, ws_labels)
         xlsx.save()
-        message_callback("Обработка пользователей завершена. Файл сохранён.")
+
+        if failed:
+            message_callback(f"Выполнение плана завершено с ошибками, пользователей: {len(failed)}. "
+                             "Повторный запуск выполнит только невыполненные действия.", status="bad")
+            return False
+        message_callback("Выполнение плана завершено. Файл сохранён.")
         return True
 
     @staticmethod
@@ -164,7 +771,9 @@ class FileController:
 
     @staticmethod
     def perform_user_actions(xlsx: ExcelDriver, 
-            learning: LearningDriver, uinfo: UserInfo, uacts: List[UserAction]):
+            learning: LearningDriver, uinfo: UserInfo, uacts: List[UserAction],
+            save: bool = True):
+        """ save: сохранять файл после каждого изменения таблицы """
         for uact in uacts:
             if uact.completed: continue
             xlsx_changed = False
@@ -205,24 +814,15 @@ class FileController:
             elif uact == UserActionType.SET_COMMENT:
                 xlsx.set_comment(xlsx.get_first_worksheet(), uinfo.table.email, uact.param)
                 xlsx_changed = True
-            if xlsx_changed:
+            if xlsx_changed and save:
                 xlsx.save()
             uact.completed = True
 
     @staticmethod
-    def step2(
-            filepath: str,
-            message_callback: Callable,
-            driver: Optional[ExcelDriver] = None,
-    ) -> bool:
-        if driver is None:
-            driver = ExcelDriver()
-        driver.load(filepath)
-        
-        if not 'Для предметов и меток' in driver._xlsx.sheetnames:
-            message_callback("Отсутствует лист Для предметов и меток", status='bad')
-            return False
-        
+    def _read_label_sheet(driver: ExcelDriver) -> Tuple[dict, dict]:
+        """ Читает лист «Для предметов и меток» без строк, пропущенных по заливке
+            Returns ({email: User}, {email: style of the first row})
+        """
         ws_labels = driver._xlsx['Для предметов и меток']
         ws_labels_users = {}
         ws_labels_style = {}
@@ -243,6 +843,7 @@ class FileController:
         ])
 
         for row in ws_labels.iter_rows(min_row=2):
+            email = row[cols['email']].value
             fill = row[cols['surname']].fill.fgColor
             if fill.type == 'theme':
                 if fill.value == 4: 
@@ -253,7 +854,6 @@ class FileController:
             elif fill.type == 'rgb':
                 if is_blue_color(fill.value): continue
                 if is_red_color(fill.value): continue
-            email = row[cols['email']].value
             if not email: continue
             user = ws_labels_users.get(email)
             if not user:
@@ -270,6 +870,50 @@ class FileController:
                     "font": copy(row[cols['surname']].font)
                 }
             user.subjects.append((row[cols['subject_name']].value, row[cols['subject_date']].value))
+        return ws_labels_users, ws_labels_style
+
+    @staticmethod
+    def _compute_user_labels(users: Iterable, message_callback: Callable) -> Optional[Dict[str, List[str]]]:
+        """ Returns {email: [label of every subject]} for users from _read_label_sheet()
+            или None, если метку удалось определить не для всех предметов
+        """
+        users = list(users)
+        # Метки для всех строк определяются одним проходом
+        pairs = []
+        for user in users:
+            for subject, date in user.subjects:
+                date = convert_date_string(str(date)).date() if date else None
+                pairs.append((subject, date))
+        labels = LabelController.get_labels(pairs)
+
+        # Каждая ошибка выводится один раз, в порядке строк таблицы
+        errors = list(dict.fromkeys(pair for pair, label in zip(pairs, labels) if isinstance(label, LabelControllerError)))
+        if errors:
+            for subject, date in errors:
+                date = date.strftime('%d.%m.%Y') if date else 'не выбрана'
+                message_callback(f"Не удалось определить метку: предмет «{subject}», дата {date}", status='bad')
+            return None
+        labels = iter(labels)
+        return {user.email: [next(labels) for _ in user.subjects] for user in users}
+
+    @staticmethod
+    def step2(
+            filepath: str,
+            message_callback: Callable,
+            driver: Optional[ExcelDriver] = None,
+    ) -> bool:
+        if driver is None:
+            driver = ExcelDriver()
+        driver.load(filepath)
+        
+        if not 'Для предметов и меток' in driver._xlsx.sheetnames:
+            message_callback("Отсутствует лист Для предметов и меток", status='bad')
+            return False
+        
+        ws_labels_users, ws_labels_style = FileController._read_label_sheet(driver)
+        labels = FileController._compute_user_labels(ws_labels_users.values(), message_callback)
+        if labels is None:
+            return False
         
         if '_csv' in driver._xlsx.sheetnames:
             driver._xlsx.remove(driver._xlsx['_csv'])
@@ -283,16 +927,11 @@ class FileController:
 
         reexp = re.compile(r'=\(RIGHT\(..+(;|,)5\)\+23000\)\*15')
         for user in ws_labels_users.values():
-            labels = []
-            for subject_tuple in user.subjects:
-                subject = subject_tuple[0]
-                date = convert_date_string(str(subject_tuple[1])).date() if subject_tuple[1] else None
-                labels.append(LabelController.get_label(subject, selected_date=date))
-            labels = ','.join(labels)
+            user_labels = ','.join(labels[user.email])
             password = (int(user.admission_code[-5:])+23000)*15 if reexp.match(user.password) else user.password
             ws.append((
                 user.admission_code, user.surname, user.name, user.patronymic,
-                user.login, user.email, password, 0, '', labels
+                user.login, user.email, password, 0, '', user_labels
             ))
             ws_rows += 1
             driver.apply_row_style(ws, ws_rows, ws_labels_style[user.email])
@@ -310,6 +949,105 @@ class FileController:
         message_callback("Обработка файла завершена. Файл сохранен.")
         return True
 
+    AUDIT_WORKERS = 4
+
+    @staticmethod
+    def audit_labels(
+            filepath: str,
+            message_callback: Callable,
+            *,
+            learning: Optional[LearningDriver] = None,
+            driver: Optional[ExcelDriver] = None,
+            workers: int = AUDIT_WORKERS,
+    ) -> Optional[Dict[str, Tuple[set, set]]]:
+        """ Сверяет метки пользователей в eLearning с метками, которые назначает
+            вторая часть обработки. Файл не меняется.
+
+            Для каждой метки экзамена из LabelController.get_exams() пользователи
+            загружаются одним просмотром /user/list с фильтром по метке текущего
+            года, затем все пользователи файла сравниваются за один проход.
+            Returns {email: (missing labels, extra labels)} for users with differences,
+            None if the file can't be checked
+        """
+        if learning is None:
+            auth = Settings().get_crypted('auth')
+            learning = LearningDriver(AuthCookies(*auth) if auth else None)
+        if driver is None:
+            driver = ExcelDriver()
+        driver.load(filepath)
+
+        if not 'Для предметов и меток' in driver._xlsx.sheetnames:
+            message_callback("Отсутствует лист Для предметов и меток", status='bad')
+            return None
+        users, _ = FileController._read_label_sheet(driver)
+        labels = FileController._compute_user_labels(users.values(), message_callback)
+        if labels is None:
+            return None
+
+        expected = defaultdict(set)  # normalized email -> метки
+        table_emails = dict()  # normalized email -> email из файла
+        for email, user_labels in labels.items():
+            expected[normalize_email(email)].update(user_labels)
+            table_emails.setdefault(normalize_email(email), email)
+
+        year = datetime.date.today().year
+        prefixes = sorted({f"{exam.tag}{year}" for exam in LabelController.get_exams()})
+        message_callback(f"Загрузка пользователей с метками {len(prefixes)} экзаменов...", status='info')
+
+        def scan(prefix):
+            # Метка экзамена: тег, год, номер блока и «Р» для резервного дня
+            label_re = re.compile(re.escape(prefix) + r'\d+Р?')
+            return [
+                (normalize_email(email), {x for x in tags if label_re.fullmatch(x)})
+                for email, tags in learning.iter_tagged_users(prefix)
+            ]
+
+        actual = defaultdict(set)
+        with FileController._executor(workers) as executor:
+            for rows in executor.map(scan, prefixes):
+                for email, user_labels in rows:
+                    if email in expected:
+                        actual[email].update(user_labels)
+
+        differences = dict()
+        for email, user_labels in expected.items():
+            missing, extra = user_labels - actual[email], actual[email] - user_labels
+            if missing or extra:
+                differences[table_emails[email]] = (missing, extra)
+
+        for email, (missing, extra) in differences.items():
+            text = []
+            if missing:
+                text.append("не назначены " + ", ".join(sorted(missing)))
+            if extra:
+                text.append("лишние " + ", ".join(sorted(extra)))
+            message_callback(f"{email}: " + "; ".join(text), status='bad')
+        _missing = sum(len(x) for x, _ in differences.values())
+        _extra = sum(len(x) for _, x in differences.values())
+        message_callback(
+            f"Проверено {len(expected)} пользователей, расхождения у {len(differences)}: "
+            f"не назначено {_missing}, лишних {_extra} меток",
+            status='bad' if differences else 'ok')
+        return differences
+
+    COURSE_MEMBERS_HEADER = ["email", "ФИО", "ВУЗ", "Статус", "Назначение", "Дата регистрации", "eLearning ID", "login"]
+    COURSE_MEMBERS_COLS_SIZE = [ 35,   42,    58,    20,       32,           20,                 13,            22   ]
+    COURSE_PAGE_SIZE = 100
+    COURSE_PAGES_AHEAD = 2  # страниц участников, загружаемых одновременно
+
+    @staticmethod
+    def _course_member_row(user: dict) -> list:
+        return [
+            user.get('email', ''),
+            user.get('fio', ''),
+            user.get('university', ''),
+            user.get('status', ''),
+            user.get('attachment', ''),
+            user.get('time_registered', ''),
+            user.get('MID', ''),
+            user.get('login', ''),
+        ]
+
     @staticmethod
     def save_course_members(
             data: Iterable[dict],
@@ -327,22 +1065,116 @@ class FileController:
             driver.load(filepath)
         else:
             driver.create_empty()
-            header = ["email", "ФИО", "ВУЗ", "Статус", "Назначение", "Дата регистрации", "eLearning ID", "login"]
-            header_size = [ 35, 42,    58,    20,      32,            20,                  13,             22   ]
-            driver.write_header(header, header_size)
-
-        rows = []
-        for user in data:
-            rows.append([
-                user.get('email', ''),
-                user.get('fio', ''),
-                user.get('university', ''),
-                user.get('status', ''),
-                user.get('attachment', ''),
-                user.get('time_registered', ''),
-                user.get('MID', ''),
-                user.get('login', ''),
-            ])
-        
+            driver.write_header(FileController.COURSE_MEMBERS_HEADER, FileController.COURSE_MEMBERS_COLS_SIZE)
+
+        rows = [FileController._course_member_row(user) for user in data]
         driver.append_rows(rows)
         driver.save(filepath)
+
+    @staticmethod
+    def _fetch_course_pages(learning: LearningDriver, course_id: int, pages: Iterable[int],
+            per_page: int, workers: int):
+        """ Загружает страницы участников курса и карточки участников параллельно
+            Yields (page, [user, ...]) as soon as the page and all its cards are loaded
+
+            Паузу между запросами и их общее число ограничивает LearningDriver.request,
+            потоков больше LearningDriver.MAX_CONCURRENT_REQUESTS не создаётся
+        """
+        pages = iter(pages)
+        workers = max(1, min(workers, LearningDriver.MAX_CONCURRENT_REQUESTS))
+        with FileController._executor(workers) as executor:
+            page_futures = dict()  # future -> page
+            card_futures = dict()  # future -> (page, index)
+            loading = dict()  # page -> [users, cards left]
+            waiting = set()
+
+            def submit_page():
+                page = next(pages, None)
+                if page is not None:
+                    future = executor.submit(learning.get_course_members, course_id, page=page, perPage=per_page)
+                    page_futures[future] = page
+                    waiting.add(future)
+
+            # Следующая страница запрашивается, когда загружена предыдущая, так что
+            # карточки не ждут загрузки всех страниц и страницы завершаются по порядку
+            for _ in range(FileController.COURSE_PAGES_AHEAD):
+                submit_page()
+            while waiting:
+                done, _ = wait(waiting, return_when=FIRST_COMPLETED)
+                waiting -= done
+                for future in done:
+                    if future in page_futures:
+                        page = page_futures.pop(future)
+                        users = future.result()
+                        submit_page()
+                        if not users:
+                            yield page, []
+                            continue
+                        loading[page] = [users, len(users)]
+                        for i, user in enumerate(users):
+                            card_future = executor.submit(learning.get_user_info_card, user['MID'])
+                            card_futures[card_future] = (page, i)
+                            waiting.add(card_future)
+                        continue
+                    page, i = card_futures.pop(future)
+                    users = loading[page][0]
+                    users[i] = users[i] | (future.result() or {})
+                    loading[page][1] -= 1
+                    if not loading[page][1]:
+                        del loading[page]
+                        yield page, users
+
+    @staticmethod
+    def export_course_members(
+            course_id: int,
+            filepath: str,
+            progress_gen: Callable,
+            message_callback: Callable,
+            *,
+            learning: Optional[LearningDriver] = None,
+            workers: int = MAX_WORKERS,
+            per_page: int = COURSE_PAGE_SIZE,
+    ) -> int:
+        """ Выгружает участников курса в Excel файл
+            Загруженные страницы записываются в журнал, прерванная выгрузка
+            в тот же файл продолжается с незагруженных страниц. Файл
+            записывается один раз, когда загружены все страницы: новый -
+            потоково, в существующий участники дописываются в конец.
+            Returns number of exported users, 0 if the course has no members
+        """
+        if learning is None:
+            auth = Settings().get_crypted('auth')
+            learning = LearningDriver(AuthCookies(*auth) if auth else None)
+
+        total_pages = learning.get_course_pages(course_id, per_page)
+        if not total_pages:
+            return 0
+
+        journal = ActionJournal.for_file(
+            filepath, 'export', identity=f"course {course_id}, {total_pages} pages of {per_page}")
+        exported = {x['page'] for x in journal.records('page')}
+        if exported:
+            message_callback(f"Продолжение выгрузки: загружено {len(exported)}/{total_pages} страниц", status="info")
+
+        remaining = [x for x in range(1, total_pages + 1) if x not in exported]
+        pages = FileController._fetch_course_pages(learning, course_id, remaining, per_page, workers)
+        try:
+            for _ in progress_gen(remaining, title="Получение информации о пользователях..."):
+                page, users = next(pages)
+                journal.append({'t': 'page', 'page': page, 'users': users}, sync=False)
+        finally:
+            pages.close()
+
+        records = sorted(journal.records('page'), key=lambda x: x['page'])
+        users = (user for record in records for user in record['users'])
+        if os.path.isfile(filepath):
+            users = list(users)
+            FileController.save_course_members(users, filepath)
+            written = len(users)
+        else:
+            written = ExcelDriver.write_table(
+                filepath, FileController.COURSE_MEMBERS_HEADER, FileController.COURSE_MEMBERS_COLS_SIZE,
+                map(FileController._course_member_row, users),
+            )
+        journal.delete()
+        return written
@@ -0,0 +1,59 @@
+""" Разбор HTML фрагментов из строк таблиц eLearning (ФИО-ссылки, метки, названия групп)
+
+    Одни и те же фрагменты (особенно метки) повторяются у тысяч пользователей,
+    поэтому результаты запоминаются по исходной строке. Частые простые формы
+    (<a ...>текст</a>, набор <p>текст</p>, просто текст) разбираются регулярными
+    выражениями, HTMLParser используется только для остальной разметки.
+    Результат совпадает с HTMLParser(html.unescape(fragment)).
+"""
+import html
+import re
+import sys
+from functools import lru_cache
+from typing import Optional, Tuple
+
+from selectolax.parser import HTMLParser
+
+CACHE_SIZE = 4096
+
+_ATTRS = r'''(?:[^<>"']|"[^"]*"|'[^']*')*'''
+_SINGLE_ELEMENT = re.compile(rf'<([a-z][a-z0-9]*)\b{_ATTRS}>([^<]*)</\1>')
+_ELEMENTS = {
+    'a': re.compile(rf'\s*<a\b{_ATTRS}>([^<]*)</a>\s*'),
+}
+_P_LIST = re.compile(rf'(?:\s*<p\b{_ATTRS}>[^<]*</p>)*\s*')
+_P_ITEM = re.compile(rf'<p\b{_ATTRS}>([^<]*)</p>')
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def fragment_text(fragment: str, selector: Optional[str] = None) -> Optional[str]:
+    """ Returns text of the first element matching selector (tag name),
+        text of the whole fragment without selector, None if there is no such element
+    """
+    unescaped = html.unescape(fragment)
+    if selector is None:
+        if '<' not in unescaped and not unescaped[:1].isspace():
+            return html.unescape(unescaped)
+        match = _SINGLE_ELEMENT.fullmatch(unescaped)
+        if match:
+            return html.unescape(match.group(2))
+        return HTMLParser(unescaped).text()
+
+    pattern = _ELEMENTS.get(selector)
+    if pattern is not None:
+        match = pattern.fullmatch(unescaped)
+        if match:
+            return html.unescape(match.group(1))
+    node = HTMLParser(unescaped).css_first(selector)
+    return node.text() if node is not None else None
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def fragment_texts(fragment: str, selector: str) -> Tuple[str, ...]:
+    """ Returns texts of all elements matching selector, strings are interned """
+    unescaped = html.unescape(fragment)
+    if selector == 'p' and _P_LIST.fullmatch(unescaped):
+        texts = (html.unescape(x) for x in _P_ITEM.findall(unescaped))
+    else:
+        texts = (x.text() for x in HTMLParser(unescaped).css(selector))
+    return tuple(sys.intern(x) for x in texts)
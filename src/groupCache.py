@@ -0,0 +1,103 @@
+import datetime
+import json
+import os
+import threading
+from bisect import bisect_left
+from typing import Dict, List, Optional, Tuple
+
+from settings import Settings
+
+
+class GroupCache:
+    """ Идентификаторы учебных групп по названию
+
+        Заполняется одним просмотром всего списка групп и считается
+        актуальным TTL. Хранится рядом с файлом настроек, поэтому
+        проверка и поиск группы быстрые после первого обращения за день.
+        Группы, найденные отдельным запросом, дописываются без обновления
+        времени просмотра.
+    """
+
+    FILENAME = 'groups.json'
+    TTL = datetime.timedelta(days=1)
+
+    _groups: Optional[Dict[str, int]] = None  # название -> group_id
+    _names: List[Tuple[str, str]] = []  # отсортированные (название в нижнем регистре, название)
+    _updated: Optional[datetime.datetime] = None
+    _lock = threading.RLock()
+
+    @classmethod
+    def _get_filepath(cls) -> str:
+        return os.path.join(Settings.get_dirpath('cache'), cls.FILENAME)
+
+    @classmethod
+    def _load(cls) -> Dict[str, int]:
+        if cls._groups is None:
+            groups, updated = dict(), None
+            try:
+                with open(cls._get_filepath(), 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                groups = {str(k): int(v) for k, v in data['groups'].items()}
+                updated = datetime.datetime.fromisoformat(data['updated'])
+            except (OSError, ValueError, TypeError, KeyError, AttributeError):
+                groups, updated = dict(), None
+            cls._set(groups, updated)
+        return cls._groups
+
+    @classmethod
+    def _set(cls, groups: Dict[str, int], updated: Optional[datetime.datetime]) -> None:
+        cls._groups = groups
+        cls._names = sorted((x.casefold(), x) for x in groups)
+        cls._updated = updated
+
+    @classmethod
+    def _save(cls) -> None:
+        path = cls._get_filepath()
+        data = {'updated': cls._updated.isoformat(timespec='seconds') if cls._updated else None,
+                'groups': cls._groups}
+        try:
+            with open(path + '.tmp', 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False)
+            os.replace(path + '.tmp', path)
+        except OSError:
+            pass
+
+    @classmethod
+    def get(cls, name: str) -> Optional[int]:
+        with cls._lock:
+            return cls._load().get(name)
+
+    @classmethod
+    def is_fresh(cls) -> bool:
+        with cls._lock:
+            cls._load()
+            return cls._updated is not None and datetime.datetime.now() - cls._updated < cls.TTL
+
+    @classmethod
+    def put(cls, name: str, group_id: int) -> None:
+        with cls._lock:
+            groups = dict(cls._load())
+            groups[name] = int(group_id)
+            cls._set(groups, cls._updated)
+            cls._save()
+
+    @classmethod
+    def search(cls, prefix: str, limit: int = 10) -> List[Tuple[str, int]]:
+        """ Returns [(name, group_id), ...] of groups which names start with prefix, case is ignored """
+        prefix = prefix.casefold()
+        with cls._lock:
+            groups = cls._load()
+            names = cls._names
+            found = []
+            i = bisect_left(names, (prefix,))
+            while i < len(names) and names[i][0].startswith(prefix) and len(found) < limit:
+                found.append((names[i][1], groups[names[i][1]]))
+                i += 1
+            return found
+
+    @classmethod
+    def update(cls, groups: Dict[str, int]) -> None:
+        """ Replaces cache with the full list of groups """
+        with cls._lock:
+            cls._set(dict(groups), datetime.datetime.now())
+            cls._save()
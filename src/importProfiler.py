@@ -0,0 +1,97 @@
+import builtins
+import sys
+import threading
+from time import perf_counter
+from typing import Dict, List, Tuple
+
+
+class ImportProfiler:
+    """ Замер времени импорта модулей при запуске (--startup-profile)
+
+        Подменяет builtins.__import__ и учитывает только первый импорт
+        каждого модуля в главном потоке. Собственное время модуля
+        считается без времени вложенных импортов.
+    """
+
+    _original_import = None
+    _started = None
+    _stack: List[List[float]] = []  # [начало, время вложенных импортов]
+    _records: List[Tuple[str, int, float, float]] = []  # имя, глубина, всего, собственное
+
+    @classmethod
+    def is_enabled(cls) -> bool:
+        return cls._original_import is not None
+
+    @classmethod
+    def enable(cls) -> None:
+        if cls.is_enabled(): return
+        cls._original_import = builtins.__import__
+        cls._started = perf_counter()
+        builtins.__import__ = cls._import
+
+    @classmethod
+    def disable(cls) -> None:
+        if not cls.is_enabled(): return
+        builtins.__import__ = cls._original_import
+        cls._original_import = None
+
+    @classmethod
+    def _import(cls, name, globals=None, locals=None, fromlist=(), level=0):
+        original = cls._original_import
+        if (level == 0 and name in sys.modules) or threading.current_thread() is not threading.main_thread():
+            return original(name, globals, locals, fromlist, level)
+
+        loaded = len(sys.modules)
+        frame = [perf_counter(), 0.0]
+        cls._stack.append(frame)
+        try:
+            return original(name, globals, locals, fromlist, level)
+        finally:
+            cls._stack.pop()
+            total = perf_counter() - frame[0]
+            if cls._stack:
+                cls._stack[-1][1] += total
+            if len(sys.modules) != loaded:
+                if level:
+                    package = (globals or {}).get('__package__') or ''
+                    name = f"{package}.{name}" if package else name
+                cls._records.append((name, len(cls._stack), total, total - frame[1]))
+
+    @classmethod
+    def get_totals(cls) -> Dict[str, float]:
+        """ Returns own import time grouped by top-level package """
+        totals = dict()
+        for name, _, _, own in cls._records:
+            package = name.lstrip('.').split('.')[0]
+            totals[package] = totals.get(package, 0.0) + own
+        return totals
+
+    @classmethod
+    def report(cls, console, limit: int = 15) -> None:
+        """ Prints import-time breakdown and stops profiling """
+        from rich.table import Table
+
+        elapsed = perf_counter() - cls._started if cls._started else 0.0
+        cls.disable()
+
+        table = Table(title="Импорт модулей при запуске")
+        table.add_column("Пакет")
+        table.add_column("Время, мс", justify="right")
+        totals = sorted(cls.get_totals().items(), key=lambda x: x[1], reverse=True)
+        for package, own in totals[:limit]:
+            table.add_row(package, f"{own * 1000:.1f}")
+        if len(totals) > limit:
+            rest = sum(own for _, own in totals[limit:])
+            table.add_row(f"[dim]остальные ({len(totals) - limit})", f"[dim]{rest * 1000:.1f}")
+        console.print(table)
+
+        table = Table(title="Импорты верхнего уровня")
+        table.add_column("Модуль")
+        table.add_column("Всего, мс", justify="right")
+        for name, depth, total, _ in cls._records:
+            if depth == 0:
+                table.add_row(name, f"{total * 1000:.1f}")
+        console.print(table)
+
+        imported = sum(own for _, own in totals)
+        console.print(f"[dim]Импорт: {imported * 1000:.1f} мс, до отображения меню: {elapsed * 1000:.1f} мс")
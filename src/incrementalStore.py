@@ -0,0 +1,89 @@
+import hashlib
+import json
+import os
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from datatypes import UserAction, UserInfo, UserTableData
+from settings import Settings
+from utils import normalize_email
+
+
+class IncrementalStore:
+    """ Результаты первой части обработки по строкам файла
+
+        Для каждого email хранится отпечаток строки таблицы до обработки
+        и после неё (действия меняют заливку, логин и т.п.), найденные
+        пользователи eLearning и выбранные действия. Строки, отпечаток
+        которых совпадает с сохранённым, повторно не ищутся.
+    """
+
+    VERSION = 1
+    DIRNAME = 'incremental'
+
+    def __init__(self, path: str):
+        self.path = path
+        self._entries: Dict[str, dict] = dict()
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get('version') == self.VERSION:
+                self._entries = data['entries']
+        except (OSError, json.JSONDecodeError, AttributeError, KeyError):
+            pass
+
+    @classmethod
+    def for_file(cls, filepath: str) -> 'IncrementalStore':
+        key = hashlib.sha1(os.path.abspath(filepath).encode()).hexdigest()
+        return cls(os.path.join(Settings.get_dirpath(cls.DIRNAME), key + '.json'))
+
+    @staticmethod
+    def get_key(table_user: UserTableData) -> str:
+        return normalize_email(table_user.email)
+
+    @classmethod
+    def fingerprint(cls, table_user: UserTableData) -> str:
+        """ Returns fingerprint of email, login, subjects with dates and marks of the user """
+        subjects = [(x.name, x.date) for x in table_user.subjects or ()]
+        data = [cls.get_key(table_user), table_user.login, subjects, sorted(table_user.marks or ())]
+        return hashlib.sha1(json.dumps(data, ensure_ascii=False, default=str).encode()).hexdigest()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def find(self, table_user: UserTableData) -> Optional[Tuple[dict, bool]]:
+        """ Returns (entry, is_processed) for the unchanged row or None
+            entry: {'users': [UserInfo.as_dict(), ...], 'actions': {mid: [UserAction.as_dict(), ...]}}
+            is_processed: строка совпадает с сохранённой после обработки,
+                            т.е. изменения таблицы уже в ней
+        """
+        entry = self._entries.get(self.get_key(table_user))
+        if entry is None:
+            return None
+        fingerprint = self.fingerprint(table_user)
+        if fingerprint == entry.get('post'):
+            return entry, True
+        if fingerprint == entry.get('pre'):
+            return entry, False
+        return None
+
+    def put(self, table_user: UserTableData, processed: Optional[UserTableData],
+            user_actions: Iterable[Tuple[UserInfo, List[UserAction]]]) -> None:
+        """ Stores results for the row
+            processed: строка после обработки, None если она удалена
+        """
+        user_actions = list(user_actions)
+        self._entries[self.get_key(table_user)] = {
+            'pre': self.fingerprint(table_user),
+            'post': self.fingerprint(processed) if processed else None,
+            'users': [uinfo.as_dict() for uinfo, _ in user_actions],
+            'actions': {
+                str(uinfo.mid): [x.as_dict() for x in uactions]
+                for uinfo, uactions in user_actions
+            },
+        }
+
+    def save(self) -> None:
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'version': self.VERSION, 'entries': self._entries}, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
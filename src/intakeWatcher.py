@@ -0,0 +1,157 @@
+import os
+import threading
+from time import monotonic
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable, Dict, List, Optional, Tuple
+
+import requests
+
+from datatypes import UserTableData
+from excelDriver import ExcelDriver
+from incrementalStore import IncrementalStore
+from learning import DataAgreementNotAccepted, LearningDriver, NotAuthorized, RequestError, UserNotFound
+from suggestionStore import SuggestionStore
+from utils import suggest_user_actions
+
+
+class IntakeWatcher:
+    """ Наблюдение за пополняемым файлом заявок
+
+        Файл опрашивается раз в interval секунд (время изменения и размер).
+        Изменившийся файл читается, когда перестаёт меняться, новые и
+        изменённые строки ставятся в очередь: пользователи ищутся и действия
+        подбираются в фоне, результаты сохраняются в SuggestionStore и
+        используются первой частью обработки.
+    """
+
+    POLL_INTERVAL = 5.0
+    WORKERS = 4
+    # Ошибки, после которых строка ставится в очередь снова (JSONDecodeError - ValueError)
+    RETRY_ERRORS = (RequestError, requests.exceptions.RequestException, ValueError)
+    # Ошибки сессии: остальные строки не обработать, наблюдение прекращается
+    STOP_ERRORS = (NotAuthorized, DataAgreementNotAccepted)
+
+    def __init__(self, filepath: str, learning: LearningDriver, message_callback: Callable,
+            *, workers: int = WORKERS, interval: float = POLL_INTERVAL):
+        self.filepath = filepath
+        self.learning = learning
+        self.message_callback = message_callback
+        self.workers = max(1, workers)
+        self.interval = interval
+        self.store = SuggestionStore.for_file(filepath)
+        self._stat: Optional[tuple] = None
+        self._read_stat: Optional[tuple] = None
+        self._queued: Dict[str, str] = dict()  # email -> отпечаток строки в очереди
+
+    def _get_stat(self) -> Optional[tuple]:
+        try:
+            stat = os.stat(self.filepath)
+        except OSError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def _read_rows(self) -> Optional[Tuple[UserTableData]]:
+        """ Returns table rows when the file has changed and is no longer being written """
+        stat, self._stat = self._stat, self._get_stat()
+        if self._stat is None or self._stat != stat or self._stat == self._read_stat:
+            return None
+        xlsx = ExcelDriver()
+        try:
+            xlsx.load(self.filepath, lazy=True)
+            rows = xlsx.get_all_users_data()
+        except Exception as e:
+            # Файл может быть сохранён не полностью, он будет прочитан ещё раз
+            self.message_callback(f"Не удалось прочитать файл: {e!r}", status='bad')
+            self._stat = None
+            return None
+        self._read_stat = self._stat
+        return rows
+
+    def _select_new_rows(self, rows) -> List[UserTableData]:
+        """ Строки, для которых ещё нет ни результатов обработки, ни предложений """
+        processed = IncrementalStore.for_file(self.filepath)
+        new_rows = []
+        for table_user in rows:
+            if not table_user.email:
+                continue
+            key = IncrementalStore.get_key(table_user)
+            fingerprint = IncrementalStore.fingerprint(table_user)
+            if self._queued.get(key) == fingerprint:
+                continue
+            if processed.find(table_user) is not None or self.store.find(table_user) is not None:
+                continue
+            self._queued[key] = fingerprint
+            new_rows.append(table_user)
+        return new_rows
+
+    def _prepare(self, table_user: UserTableData) -> Tuple[UserTableData, List[tuple]]:
+        try:
+            users = self.learning.get_user_info(table_user.email)
+        except UserNotFound:
+            users = []
+        user_suggestions = []
+        for userinfo in users:
+            userinfo.table = table_user
+            user_suggestions.append((userinfo, suggest_user_actions(userinfo, learning=self.learning)))
+        return table_user, user_suggestions
+
+    def _store_results(self, done, pending: dict) -> int:
+        stored = 0
+        for future in done:
+            table_user = pending.pop(future)
+            try:
+                table_user, user_suggestions = future.result()
+            except self.STOP_ERRORS:
+                if stored:
+                    self.store.save()
+                raise
+            except self.RETRY_ERRORS as e:
+                # Строка снова попадёт в очередь при следующем чтении файла
+                self.message_callback(f"Ошибка запроса для {table_user.email}: {e!r}", status='bad')
+                self._queued.pop(IncrementalStore.get_key(table_user), None)
+                self._read_stat = None
+                continue
+            except Exception as e:
+                # Строка остаётся в _queued и не обрабатывается, пока не изменится в файле
+                self.message_callback(f"Не удалось подобрать действия для {table_user.email}: {e!r}. "
+                                      "Строка будет обработана после её изменения в файле", status='bad')
+                continue
+            self.store.put(table_user, user_suggestions)
+            stored += 1
+            found = ", ".join(str(x.login) for x, _ in user_suggestions) or "не найден"
+            self.message_callback(f"Предложения готовы: {table_user.email} ({found})", status='info')
+        return stored
+
+    def run(self, stop: Optional[threading.Event] = None) -> None:
+        """ Наблюдает за файлом до установки stop или KeyboardInterrupt,
+            ошибки сессии (STOP_ERRORS) прекращают наблюдение
+        """
+        if stop is None:
+            stop = threading.Event()
+        self.message_callback(f"Наблюдение за файлом {self.filepath}", status='info')
+        pending = dict()  # future -> строка таблицы
+        unsaved, saved_at = 0, monotonic()
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            try:
+                while not stop.is_set():
+                    # Файл предложений переписывается целиком, поэтому не чаще раза за интервал
+                    if unsaved and (not pending or monotonic() - saved_at >= self.interval):
+                        self.store.save()
+                        unsaved, saved_at = 0, monotonic()
+                    rows = self._read_rows()
+                    if rows is not None:
+                        new_rows = self._select_new_rows(rows)
+                        if new_rows:
+                            self.message_callback(f"Новых строк: {len(new_rows)}", status='info')
+                        for table_user in new_rows:
+                            pending[executor.submit(self._prepare, table_user)] = table_user
+                    if not pending:
+                        stop.wait(self.interval)
+                        continue
+                    done, _ = wait(pending, timeout=self.interval, return_when=FIRST_COMPLETED)
+                    unsaved += self._store_results(done, pending)
+            finally:
+                for future in pending:
+                    future.cancel()
+                if unsaved:
+                    self.store.save()
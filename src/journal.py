@@ -0,0 +1,150 @@
+import hashlib
+import json
+import os
+import threading
+from typing import Iterable, Iterator, List, Optional
+
+from datatypes import UserAction, UserInfo
+from settings import Settings
+
+
+class ActionJournal:
+    """ Журнал выполненных действий для продолжения прерванной обработки
+
+        JSON lines, записи только дописываются. Первая запись - заголовок
+        с идентификатором обрабатываемых данных (например, хэшем плана),
+        если он не совпадает, журнал начинается заново. Остальные записи
+        различаются полем 't': 'done' - выполненные действия пользователя,
+        а также записи, которые ведёт сама обработка ('lookup', 'decision',
+        'checkpoint' и т.п.).
+    """
+
+    VERSION = 1
+    DIRNAME = 'journals'
+
+    def __init__(self, path: str, identity: str):
+        self.path = path
+        self.identity = identity
+        self._lock = threading.Lock()
+        self._records: List[dict] = []
+        self._done = set()
+
+        records = self._read()
+        header = records[0] if records else None
+        if header != {'t': 'start', 'version': self.VERSION, 'identity': identity}:
+            self.clear()
+        else:
+            for record in records[1:]:
+                self._add(record)
+
+    @classmethod
+    def for_file(cls, filepath: str, kind: str, identity: str) -> 'ActionJournal':
+        """ Returns journal of kind (e.g. 'apply') for the file, stored next to settings """
+        key = hashlib.sha1(os.path.abspath(filepath).encode()).hexdigest()
+        path = os.path.join(Settings.get_dirpath(cls.DIRNAME), f"{key}.{kind}.jsonl")
+        return cls(path, identity)
+
+    @staticmethod
+    def get_action_key(uinfo: UserInfo, uaction: UserAction) -> tuple:
+        email = uinfo.table.email if uinfo.table else uinfo.email
+        return (uinfo.mid, email, uaction.action.name, uaction.param)
+
+    def _read(self) -> List[dict]:
+        records = []
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        records.append(json.loads(line))
+                    except json.JSONDecodeError:
+                        # Последняя строка могла не дописаться при аварийном завершении
+                        break
+        except OSError:
+            pass
+        return records
+
+    def _add(self, record: dict) -> None:
+        self._records.append(record)
+        if record.get('t') == 'done':
+            for action in record.get('actions', []):
+                self._done.add((record['mid'], record['email'], action['action'], action['param']))
+
+    def clear(self) -> None:
+        self.reset(keep=())
+
+    def reset(self, keep: Iterable[str] = ()) -> None:
+        """ Starts journal anew, keeping only records of types from keep """
+        keep = tuple(keep)
+        with self._lock:
+            records = [x for x in self._records if x.get('t') in keep]
+            self._records = []
+            self._done = set()
+            tmp_path = self.path + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                header = {'t': 'start', 'version': self.VERSION, 'identity': self.identity}
+                for record in [header] + records:
+                    f.write(json.dumps(record, ensure_ascii=False) + '\n')
+            os.replace(tmp_path, self.path)
+            for record in records:
+                self._add(record)
+
+    def delete(self) -> None:
+        """ Removes journal file when the work is finished """
+        with self._lock:
+            self._records = []
+            self._done = set()
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
+
+    def extend(self, records: Iterable[dict], sync: bool = True) -> None:
+        """ Appends records to the file
+            sync(bool=True): wait until records are written to disk, otherwise
+                            they survive only a crash of the program
+        """
+        records = list(records)
+        if not records: return
+        with self._lock:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                for record in records:
+                    f.write(json.dumps(record, ensure_ascii=False) + '\n')
+                f.flush()
+                if sync:
+                    os.fsync(f.fileno())
+            for record in records:
+                self._add(record)
+
+    def append(self, record: dict, sync: bool = True) -> None:
+        self.extend((record,), sync)
+
+    def records(self, type_: Optional[str] = None) -> Iterator[dict]:
+        for record in self._records:
+            if type_ is None or record.get('t') == type_:
+                yield record
+
+    def has(self, type_: str) -> bool:
+        return any(True for _ in self.records(type_))
+
+    def last(self, type_: str) -> Optional[dict]:
+        for record in reversed(self._records):
+            if record.get('t') == type_:
+                return record
+        return None
+
+    @classmethod
+    def done_record(cls, uinfo: UserInfo, uactions: Iterable[UserAction]) -> dict:
+        email = uinfo.table.email if uinfo.table else uinfo.email
+        return {
+            't': 'done', 'mid': uinfo.mid, 'email': email,
+            'actions': [{'action': x.action.name, 'param': x.param} for x in uactions],
+        }
+
+    def restore_completed(self, uinfo: UserInfo, uactions: Iterable[UserAction]) -> int:
+        """ Marks actions found in the journal as completed, returns their number """
+        restored = 0
+        for uaction in uactions:
+            if not uaction.completed and self.get_action_key(uinfo, uaction) in self._done:
+                uaction.completed = True
+                restored += 1
+        return restored
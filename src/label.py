@@ -1,6 +1,7 @@
 import base64
 import datetime
-from typing import NamedTuple, Optional, List, Tuple, Iterable
+from bisect import bisect_right
+from typing import Dict, NamedTuple, Optional, List, Tuple, Iterable
 import json
 
 import custom_json
@@ -17,9 +18,100 @@ class NoSuitableLabelFound(LabelControllerError):
     pass
 
 
+# Дата, которой обозначается блок без экзамена
+NO_EXAM_DATE = datetime.date(2000, 1, 1)
+
+
+class LabelResolver:
+    """ Скомпилированный индекс экзаменов для LabelController.get_label
+
+        Для каждого предмета хранятся даты блоков (точное совпадение, месяц
+        и отсортированный массив для поиска ближайшего блока) и резервные дни.
+    """
+
+    class _Entry(NamedTuple):
+        tag: str
+        exact: Dict[datetime.date, int]  # дата -> номер блока
+        months: Dict[int, int]  # месяц -> номер блока
+        dates: List[datetime.date]  # отсортированные даты блоков
+        nearest: List[int]  # nearest[i] - наименьший номер блока среди dates[i:]
+
+    def __init__(self, exams: Iterable[Exam], reserve: Iterable[Reserve]):
+        self._subjects: Dict[str, List[LabelResolver._Entry]] = dict()
+        self._reserve: Dict[datetime.date, int] = dict()
+        self._memo: Dict[tuple, str | None] = dict()
+        self._memo_day: datetime.date | None = None
+
+        for exam in exams:
+            exact = dict()
+            months = dict()
+            for block, date in enumerate(exam.dates, start=1):
+                exact.setdefault(date, block)
+                months.setdefault(date.month, block)
+
+            blocks = sorted(
+                (date, block) for block, date in enumerate(exam.dates, start=1)
+                if date != NO_EXAM_DATE
+            )
+            nearest = [block for _, block in blocks]
+            for i in range(len(nearest) - 2, -1, -1):
+                nearest[i] = min(nearest[i], nearest[i + 1])
+
+            entry = self._Entry(exam.tag, exact, months, [date for date, _ in blocks], nearest)
+            self._subjects.setdefault(exam.subject.lower(), list()).append(entry)
+
+        for i, date in enumerate(reserve, start=1):
+            self._reserve.setdefault(date, i)
+
+    def resolve(self, exam_subject: str, selected_date: datetime.date | None,
+            by_month: bool, today: datetime.date) -> str | None:
+        """ Returns label or None. selected_date should be in the year 2000 """
+        entries = self._subjects.get(exam_subject.lower())
+        if not entries: return None
+
+        current_year = today.year
+        # Экзамен переносится на следующий блок, если до него остался один день
+        threshold = today.replace(year=2000) + datetime.timedelta(days=1)
+
+        for entry in entries:
+            block = None
+            if selected_date is None:
+                idx = bisect_right(entry.dates, threshold)
+                if idx < len(entry.dates):
+                    block = entry.nearest[idx]
+            elif by_month:
+                block = entry.months.get(selected_date.month)
+            else:
+                block = entry.exact.get(selected_date)
+            if block is not None:
+                return f"{entry.tag}{current_year}{block}"
+
+            reserve_i = self._reserve.get(selected_date)
+            if reserve_i is not None:
+                # Буква "Р" ниже в конце - кириллица.
+                return f"{entry.tag}{current_year}{reserve_i}Р"
+        return None
+
+    def resolve_cached(self, exam_subject: str, selected_date: datetime.date | None,
+            by_month: bool, today: datetime.date) -> str | None:
+        """ resolve() with memoization, results live as long as the resolver """
+        if today != self._memo_day:
+            self._memo.clear()
+            self._memo_day = today
+        key = (exam_subject.lower(), selected_date, by_month)
+        try:
+            return self._memo[key]
+        except KeyError:
+            label = self._memo[key] = self.resolve(exam_subject, selected_date, by_month, today)
+            return label
+
+
 class LabelController:
 
     _all_exams: List[Exam] = list()
+    _exams_revision = None  # номер изменения настройки экзаменов для _all_exams
+    _resolver: Optional[LabelResolver] = None
+    _resolver_revision = None  # номера изменений экзаменов и резервных дней для _resolver
     _pr = 'LabelController'
 
     @classmethod
@@ -46,18 +138,34 @@ class LabelController:
         Settings()[f"{cls._pr}.exams"] = cls._all_exams
         return True
 
+    @classmethod
+    def _get_resolver(cls) -> LabelResolver:
+        """ Returns compiled resolver, rebuilds it only when exams or reserve were changed """
+        Settings()
+        revision = (
+            Settings.get_revision(f"{cls._pr}.exams"),
+            Settings.get_revision(f"{cls._pr}.reserve")
+        )
+        if cls._resolver is None or revision != cls._resolver_revision:
+            cls.load_exams()
+            cls._resolver = LabelResolver(cls._all_exams, cls.get_reserve())
+            cls._resolver_revision = revision
+        return cls._resolver
+
     @classmethod
     def load_exams(cls) -> None:
         _exams = list()
 
         exams = Settings()[f"{cls._pr}.exams"]
-        if exams == cls._all_exams: return
+        revision = Settings.get_revision(f"{cls._pr}.exams")
+        if revision == cls._exams_revision: return
         if not exams: exams = list()
         
         for exam in exams:
             dates = [datetime.date.fromisoformat(x) for x in exam[2]]
             _exams.append(Exam(exam[0], exam[1], dates))
         cls._all_exams = _exams
+        cls._exams_revision = revision
 
     @classmethod
     def load_exams_from_share_bytes(cls, share: bytes) -> None:
@@ -117,34 +225,45 @@ class LabelController:
         :rtype: str
         """
 
-        cls.load_exams()
-
-        ##
-        by_month = True if selected_date and selected_date.year == 2001 and by_month == False else by_month
-        current_date = datetime.date.today()
-        current_year = current_date.year
-        current_date = current_date.replace(year=2000)
-        day = datetime.timedelta(days=1)
-        selected_date = selected_date.replace(year=2000) if selected_date else None
-        reserve = cls.get_reserve()
-        ##
+        label = cls.get_labels([(exam_subject, selected_date)], by_month)[0]
+        if isinstance(label, LabelControllerError):
+            raise label
+        return label
 
-        for exam in cls._all_exams:
-            if exam.subject.lower() != exam_subject.lower():
-                continue
-            for date_i, date in enumerate(exam.dates):
-                if selected_date == date:
-                    return f"{exam.tag}{current_year}{date_i+1}"
-                elif by_month and selected_date and selected_date.month == date.month:
-                    return f"{exam.tag}{current_year}{date_i+1}"
-                elif selected_date == None and current_date < date - day:
-                    return f"{exam.tag}{current_year}{date_i+1}"
-            for date_i, date in enumerate(reserve):
-                if selected_date == date:
-                    # Буква "Р" ниже в конце - кириллица.
-                    return f"{exam.tag}{current_year}{date_i+1}Р"
-
-        raise NoSuitableLabelFound(f"exam_subject={exam_subject}, selected_date={selected_date}, by_month={by_month}")
+    @classmethod
+    def get_labels(cls, pairs: Iterable[Tuple[str, datetime.date | None]],
+            by_month: bool = False) -> List[str | LabelControllerError]:
+        """Определяет метки для списка пар (предмет, выбранная дата)
+
+        Повторяющиеся пары определяются один раз, результаты запоминаются
+        до изменения экзаменов или резервных дней в настройках.
+
+        :param pairs: Пары (название экзамена, выбранная дата или None)
+        :param by_month: Определить дату по месяцу в выбранной дате
+        :returns: Метки в порядке pairs. Для пар, метку которых определить
+                  не удалось, вместо метки возвращается NoSuitableLabelFound
+        :rtype: list
+        """
+        resolver = cls._get_resolver()
+        today = datetime.date.today()
+        results = dict()
+        labels = list()
+
+        for pair in pairs:
+            label = results.get(pair)
+            if label is None:
+                exam_subject, selected_date = pair
+                _by_month = True if selected_date and selected_date.year == 2001 and by_month == False else by_month
+                selected_date = selected_date.replace(year=2000) if selected_date else None
+
+                label = None
+                if isinstance(exam_subject, str):
+                    label = resolver.resolve_cached(exam_subject, selected_date, _by_month, today)
+                if label is None:
+                    label = NoSuitableLabelFound(f"exam_subject={exam_subject}, selected_date={selected_date}, by_month={_by_month}")
+                results[pair] = label
+            labels.append(label)
+        return labels
 
     @classmethod
     def get_label_primitive(cls, exam_subject: str) -> Label:
@@ -6,13 +6,21 @@ import html
 import requests
 import json
 from selectolax.parser import HTMLParser
-from typing import Tuple, List, Union, Dict
+from typing import Tuple, List, Union, Dict, Iterable, Iterator, Optional
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+import copy
+from contextlib import contextmanager
+import threading
 import urllib
 import time
 from math import ceil
 
 from datatypes import AuthCookies, UserInfo, Course
-from utils import convert_date_string
+from fragments import fragment_text, fragment_texts
+from groupCache import GroupCache
+from noticeLog import LogMessageCache
+from userListIndex import UserListIndex
+from utils import convert_date_string, normalize_email
 
 from rich import print
 
@@ -43,8 +51,29 @@ class LearningDriver:
     _auth_check_completed = False
     _current_role = None
 
+    GRID_PAGE_SIZE = 100
+    GRID_MAX_PAGE_SIZE = 1000
+    GRID_WORKERS = 4
+    NOTIFICATION_CHUNK_SIZE = 16 * 1024
+    GROUP_PAGE_SIZE = 500
+    GROUP_EXCLUDE_CHUNK_SIZE = 100
+    GROUP_EXCLUDE_RETRIES = 2
+    RETRY_DELAY_SECONDS = 2.0
+    # Ограничение нагрузки на eLearning, общее для всех потоков: число
+    # одновременных запросов и пауза между их началами
+    MAX_CONCURRENT_REQUESTS = 8
+    REQUEST_INTERVAL_SECONDS = 0.05
+
+    _request_slots = threading.BoundedSemaphore(MAX_CONCURRENT_REQUESTS)
+    _request_pace_lock = threading.Lock()
+    _next_request_at = 0.0
+
     def __init__(self, auth_cookies: Union[AuthCookies, None] = None):
         self._session = requests.Session()
+        self._inflight: Dict[tuple, Future] = dict()  # запросы get_user_info в процессе выполнения
+        self._inflight_lock = threading.Lock()
+        self._role_lock = threading.Lock()  # роль одна на сессию, её переключает один поток
+        self.user_index = UserListIndex()
         self._session.headers.update({
             'IS_AJAX_REQUEST': 'TRUE',
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:134.0) Gecko/20100101 Firefox/134.0',
@@ -79,6 +108,125 @@ class LearningDriver:
         if not self.auth_check():
             raise NotAuthorized
 
+    def _get_user_info(self, email: str, load_courses: bool) -> List[UserInfo]:
+        """ email - результат normalize_email() """
+        rows = self.user_index.get(email)
+        if rows is None:
+            self._auth_check()
+
+            # Переключаемся на администратора
+            if not self.switch_role('admin'):
+                raise SomethingWrong('Got error while switching to admin role')
+
+            # Поиск по email нечёткий, точное совпадение может быть не на первой странице.
+            # Остальные строки ответа запоминаются для следующих поисков
+            params = {'ordergrid': 'fio_ASC', 'email': email}
+            rows = list(self.iter_grid('/user/list', params, method='post', per_page=30))
+            self.user_index.put(email, rows)
+
+        uinfo_return = list()
+        for row in rows:
+            if normalize_email(row['email']) != email: continue
+            uinfo = self._user_info_from_row(row)
+
+            if load_courses:
+                uinfo.courses = self.get_user_courses(uinfo.mid)
+            
+            uinfo_return.append(uinfo)
+
+        if not uinfo_return:
+            raise UserNotFound
+        return uinfo_return
+
+    @staticmethod
+    def _parse_user_tags(fragment: str) -> Tuple[str, ...]:
+        """ Returns tags from the tags column of /user/list """
+        tags = fragment_texts(fragment, 'p')
+        if (len(tags) > 1): tags = tags[1:]
+        return tags
+
+    @classmethod
+    @contextmanager
+    def _throttle(cls):
+        """ Ждёт свободного места среди MAX_CONCURRENT_REQUESTS запросов и
+            REQUEST_INTERVAL_SECONDS после начала предыдущего запроса
+        """
+        with cls._request_slots:
+            with cls._request_pace_lock:
+                now = time.monotonic()
+                start = max(now, LearningDriver._next_request_at)
+                LearningDriver._next_request_at = start + cls.REQUEST_INTERVAL_SECONDS
+            if start > now:
+                time.sleep(start - now)
+            yield
+
+    def _iter_grid_rows(self, endpoint, params: dict, method: str, start: int, total: int,
+            per_page: int) -> Iterator[dict]:
+        """ Yields rows from start to total requesting pages of per_page one by one """
+        while start < total:
+            page = start // per_page + 1
+            offset = (page - 1) * per_page
+            data = self._request_grid_page(endpoint, params, page, per_page, method).get('data') or []
+            if len(data) < min(per_page, total - offset):
+                raise RequestError(f"Incomplete page {page} of {endpoint}: {len(data)} of {per_page} rows")
+            yield from data[start - offset:]
+            start = offset + len(data)
+
+    def _request_grid_page(self, endpoint, params: dict, page: int, per_page: int, method='get') -> dict:
+        """ Returns one page of the grid (gridmod=ajax) """
+        params = {'gridmod': 'ajax', 'grid': 'grid', **params, 'page': page, 'perPage': per_page}
+        return self.request(endpoint, params, method)
+
+    @staticmethod
+    def _read_notifications_tag(chunks: Iterable[bytes]) -> bytes:
+        """ Returns start tag of hm-notifications as soon as it is read,
+            the whole page if there is no such element
+        """
+        name = b'<hm-notifications'
+        buffer = bytearray()
+        start, pos, quote = -1, 0, None
+        for chunk in chunks:
+            buffer += chunk
+            if start < 0:
+                # Имя элемента может оказаться на границе частей
+                start = buffer.find(name, max(0, pos - len(name) + 1))
+                if start < 0:
+                    pos = len(buffer)
+                    continue
+                pos = start + len(name)
+            # Конец тега - первая '>' вне значения атрибута
+            while pos < len(buffer):
+                char = buffer[pos]
+                if quote is not None:
+                    if char == quote:
+                        quote = None
+                elif char in b'"\'':
+                    quote = char
+                elif char == ord('>'):
+                    return bytes(buffer[start:pos + 1])
+                pos += 1
+        return bytes(buffer)
+
+    @classmethod
+    def _user_info_from_row(cls, row: dict) -> UserInfo:
+        """ UserInfo without courses from the row of /user/list """
+        uinfo = UserInfo(
+            mid = int(row['MID']),
+            login = row['login'],
+            email = row['email'],
+            fio = fragment_text(row['fio'], 'a'),
+        )
+
+        if row.get('Registered'):
+            uinfo.registered = convert_date_string(row['Registered'])
+        if row.get('last_login_date'):
+            uinfo.last_login = convert_date_string(row['last_login_date'])
+        if row.get('tags'):
+            uinfo.tags = cls._parse_user_tags(row['tags'])
+        if row.get('source'):
+            uinfo.source = row['source']
+        return uinfo
+
     def add_tag(self, user_id, tag):
         self._auth_check()
         if not self.switch_role('admin'):
@@ -92,6 +240,7 @@ class LearningDriver:
         
         # response is dumb
         self.request('/user/list/assign-tag', params, 'post')
+        self.user_index.clear()
 
     def auth(self, login, password):
         """ Returns hmkey cookie value """
@@ -131,21 +280,76 @@ class LearningDriver:
         params = {'postMassIds_grid': user_id, 'massActionsAll_grid': user_id}
         
         # успешно!
-        is_ajax_request_value = self._session.headers.pop('IS_AJAX_REQUEST', None)
+        msg = self.request_notification('/user/list/delete-by', params, 'post',
+                                        headers={'IS_AJAX_REQUEST': None})
+        self.user_index.clear()
 
-        page = self.request('/user/list/delete-by', params, 'post', format_='html')
-        
-        if is_ajax_request_value:
-            self._session.headers.update({'IS_AJAX_REQUEST': is_ajax_request_value})
-        
-        msg = self.get_notification(page)
-
-        if "успешно" in msg:
+        if msg and "успешно" in msg:
             return True
         else:
             raise SomethingWrong(f"Something wrong on user {user_id} deleting: " + repr(msg))
 
+    def exclude_from_group(self, group_id, user_ids: Iterable, chunk_size: int = GROUP_EXCLUDE_CHUNK_SIZE,
+            workers: int = GRID_WORKERS, retries: int = GROUP_EXCLUDE_RETRIES,
+            ) -> Iterator[Tuple[List, Optional[Exception]]]:
+        """ Убирает пользователей из группы частями по chunk_size в workers потоков
+            Yields (user ids of the chunk, None or the last error) as chunks are done
+
+            user_ids читается полностью до исключения первой части: если
+            исключать участников, пока список группы ещё загружается
+            (iter_group_members()), смещения следующих страниц сдвигаются и
+            часть участников пропускается.
+            Неудачная часть повторяется до retries раз с паузой.
+        """
+        user_ids = list(user_ids)
+
+        def exclude(chunk):
+            for attempt in range(retries + 1):
+                if attempt:
+                    time.sleep(self.RETRY_DELAY_SECONDS * attempt)
+                try:
+                    self.remove_from_group(group_id, ",".join(map(str, chunk)))
+                    return chunk, None
+                except (RequestError, SomethingWrong, requests.exceptions.RequestException) as e:
+                    error = e
+            return chunk, error
+
+        executor = ThreadPoolExecutor(max_workers=max(1, workers))
+        pending = set()
+        try:
+            chunk = []
+            for user_id in user_ids:
+                chunk.append(user_id)
+                if len(chunk) < chunk_size:
+                    continue
+                pending.add(executor.submit(exclude, chunk))
+                chunk = []
+                # Очередь не больше числа потоков, готовые части выдаются сразу
+                done, pending = wait(pending, timeout=0 if len(pending) < workers else None,
+                                     return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+            if chunk:
+                pending.add(executor.submit(exclude, chunk))
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
     def find_group_id(self, name: str) -> int|None:
+        """ Returns group id by its name or None
+            Группы берутся из GroupCache, который заполняется get_groups()
+            раз в GroupCache.TTL. Группа, созданная позже, ищется запросом
+        """
+        if not GroupCache.is_fresh():
+            GroupCache.update(self.get_groups())
+            return GroupCache.get(name)
+        group_id = GroupCache.get(name)
+        if group_id is not None:
+            return group_id
+
         self._auth_check()
         
         if not self.switch_role('dean'):
@@ -160,8 +364,9 @@ class LearningDriver:
         if not data: return None
 
         for row in data:
-            row_name = HTMLParser(html.unescape(row['name'])).text().strip()
+            row_name = fragment_text(row['name']).strip()
             if row_name == name:
+                GroupCache.put(name, int(row['group_id']))
                 return int(row['group_id'])
         return None
 
@@ -199,28 +404,16 @@ class LearningDriver:
         """ Returns group members in list like [(user_id, user_email), ...]
             email_filter: list of emails in return list
         """
+        return list(self.iter_group_members(group_id, email_filter))
+
+    def get_groups(self) -> Dict[str, int]:
+        """ Returns all study groups as {name: group_id} """
         self._auth_check()
         if not self.switch_role('dean'):
             raise SomethingWrong
-        
-        params = {
-            'gridmod': 'ajax', 'grid': 'grid',
-            'page': 1, 'perPage': -1
-        }
-
-        result = []
-        is_email_filter = bool(email_filter)
-        email_filter = [str(x).lower() for x in email_filter]
-        resp = self.request(f"/study-groups/users/index/group_id/{group_id}", params=params)
-        data = resp.get('data')
-        if not data: return result
 
-        for row in data:
-            if is_email_filter:
-                if row['email'].lower() not in email_filter:
-                    continue
-            result.append((int(row['MID']), row['email']))
-        return result
+        rows = self.iter_grid('/study-groups/list/index/subject_id/0', per_page=self.GROUP_PAGE_SIZE)
+        return {fragment_text(row['name']).strip(): int(row['group_id']) for row in rows}
 
     def get_course_members(self, course_id, page=1, perPage=30) -> List[Dict]:
         """ Returns list of users in course """
@@ -229,21 +422,16 @@ class LearningDriver:
         if not self.switch_role('dean'):
             raise SomethingWrong
         
-        params = {
-            'gridmod': 'ajax', 'grid': 'grid',
-            'page': page, 'perPage': perPage
-        }
-
         result = []
         
-        resp = self.request(f"/assign/student/index/subject_id/{course_id}", params=params)
+        resp = self._request_grid_page(f"/assign/student/index/subject_id/{course_id}", {}, page, perPage)
         data = resp.get('data')
         if not data: return result
 
         for row in data:
             result.append({
                 'MID': int(row['MID']),
-                'fio': HTMLParser(html.unescape(row['fio'])).css_first('a').text(),
+                'fio': fragment_text(row['fio'], 'a'),
                 'time_registered': row['time_registered'],
             })
         return result
@@ -255,12 +443,7 @@ class LearningDriver:
         if not self.switch_role('dean'):
             raise SomethingWrong
 
-        params = {
-            'gridmod': 'ajax', 'grid': 'grid',
-            'page': 1, 'perPage': perPage
-        }
-
-        resp = self.request(f"/assign/student/index/subject_id/{course_id}", params=params)
+        resp = self._request_grid_page(f"/assign/student/index/subject_id/{course_id}", {}, 1, perPage)
         data = resp.get('tableSettings')
         if not data: return 0
 
@@ -268,15 +451,23 @@ class LearningDriver:
 
 
     def get_log_message(self, log_id) -> str | None:
-        """ Returns html-like str if message found, else None """
+        """ Returns html-like str if message found, else None
+            Отправленные письма не меняются, поэтому хранятся в LogMessageCache
+        """
         if not log_id: return None
+        message = LogMessageCache.get(log_id)
+        if message is not None:
+            return message
         resp = self.request(f"/notice/log/one/log_id/{log_id}")
         if not resp: return None
         fields = resp.get('fields')
         if not fields: return None
         for field in fields:
             if field.get('key') == 'Сообщение' or field.get('key') == 'Message':
-                return field.get('value')
+                message = field.get('value')
+                if message:
+                    LogMessageCache.put(log_id, message)
+                return message
         ##
         return None
 
@@ -291,9 +482,15 @@ class LearningDriver:
                 str: if one message
                 dict: ({'message':'...','type':3}) if message is specific
                 list: if more than one message
+            Raises:
+                SomethingWrong: if there is no notification box on the page
+                                (e.g. a gateway error page)
         """
         parser = HTMLParser(html.unescape(html_))
-        hm_notif_attrs = parser.css_first('hm-notifications').attributes
+        hm_notif = parser.css_first('hm-notifications')
+        if hm_notif is None:
+            raise SomethingWrong("There is no hm-notifications element on the page")
+        hm_notif_attrs = hm_notif.attributes
         
         notifications = hm_notif_attrs.get(':notifications')
         if not notifications: return None
@@ -314,16 +511,11 @@ class LearningDriver:
         if not self.switch_role('admin'):
             raise SomethingWrong
 
-        params = {
-            'gridmod': 'ajax', 'grid': 'grid',
-            'page': 1, 'perPage': 30, 'ordergrid': 'subjectId_ASC',
-            'personId': user_id
-        }
-        resp = self.request(f"/report/index/index/report_id/29", params=params, method='post')
-        data = resp.get('data')
-        courses = dict()
+        params = {'ordergrid': 'subjectId_ASC', 'personId': user_id}
+        rows = self.iter_grid(f"/report/index/index/report_id/29", params, method='post', per_page=30)
+        courses = dict()  # course_id -> [title, starts, ends, teachers]
 
-        for row in data:
+        for row in rows:
             person_id = row.get('personId')
             if int(person_id) != int(user_id): continue
             course_id = row.get('subjectId')
@@ -332,75 +524,47 @@ class LearningDriver:
             
             course = courses.get(course_id)
             if not course:
-                course = Course(course_id, title = html.unescape(row['subjectTitle'].replace('&amp;', '&')))
+                course = [html.unescape(row['subjectTitle'].replace('&amp;', '&')), None, None, []]
                 courses[course_id] = course
             
-            if not course.starts: 
-                course.starts = convert_date_string(row.get('subjectBegin'))
-            if not course.ends:
-                course.ends = convert_date_string(row.get('subjectEnd'))
+            if not course[1]: 
+                course[1] = convert_date_string(row.get('subjectBegin'))
+            if not course[2]:
+                course[2] = convert_date_string(row.get('subjectEnd'))
                 
             teacher = row.get('teacherFio')
             if teacher:
-                if course.teachers == None: course.teachers = list()
-                course.teachers.append(teacher)
+                course[3].append(teacher)
         ####
-        return tuple(courses.values())
+        # Course неизменяемый и общий для всех пользователей курса
+        return tuple(
+            Course.get_shared(course_id, title, starts, ends, tuple(teachers) if teachers else None)
+            for course_id, (title, starts, ends, teachers) in courses.items()
+        )
                 
     def get_user_info(self, email, load_courses=True) -> List[UserInfo]:
-        """ Returns user info """
-
-        self._auth_check()
-        
-        # Переключаемся на администратора
-        if not self.switch_role('admin'):
-            raise SomethingWrong('Got error while switching to admin role')
+        """ Returns user info
 
-        params = {
-            'gridmod': 'ajax', 'grid': 'grid',
-            'perPage': 30, 'page': 1, 'ordergrid': 'fio_ASC',
-            'email': email
-        }
-        resp = self.request('/user/list', params=params, method='post')
-        
-        data = resp.get('data')
-
-        if not data:
-            if type(data) == list:
-                raise UserNotFound
-            raise UserNotFound(repr(resp))
-        
-        uinfo_return = list()
-
-        for row in data:
-            if str(row['email']).lower() != str(email).lower(): continue
-            uinfo = UserInfo(
-                mid = int(row['MID']),
-                login = row['login'],
-                email = row['email'],
-                fio = HTMLParser(html.unescape(row['fio'])).css_first('a').text(),
-            )
-
-            if row.get('Registered'):
-                uinfo.registered = convert_date_string(row['Registered'])
-            if row.get('last_login_date'):
-                uinfo.last_login = convert_date_string(row['last_login_date'])
-            if row.get('tags'):
-                tree = HTMLParser(html.unescape(row['tags']))
-                tags = [x for x in map(lambda x: x.text(), tree.css('p'))]
-                if (len(tags) > 1): tags = tags[1:]
-                uinfo.tags = tuple(tags)
-            if row.get('source'):
-                uinfo.source = row['source']
-
-            if load_courses:
-                uinfo.courses = self.get_user_courses(uinfo.mid)
-            
-            uinfo_return.append(uinfo)
-
-        if not uinfo_return:
-            raise UserNotFound
-        return uinfo_return
+            Одновременные запросы одного адреса (без учёта регистра и пробелов)
+            выполняются одним запросом, каждый вызов получает свои копии UserInfo
+        """
+        key = (normalize_email(email), bool(load_courses))
+        with self._inflight_lock:
+            future = self._inflight.get(key)
+            is_owner = future is None
+            if is_owner:
+                future = self._inflight[key] = Future()
+
+        if is_owner:
+            try:
+                future.set_result(self._get_user_info(key[0], load_courses))
+            except BaseException as e:
+                future.set_exception(e)
+            finally:
+                with self._inflight_lock:
+                    del self._inflight[key]
+            return future.result()
+        return [copy.copy(x) for x in future.result()]
 
     def get_user_info_card(self, user_id) -> dict | None:
         """ Get user info from card """
@@ -439,46 +603,31 @@ class LearningDriver:
             raise SomethingWrong
         
         params = {
-            'gridmod': 'ajax', 'receiver_id': user_id,
+            'receiver_id': user_id,
             'cluster': 'general',  # Бизнес-процесс == Общего назначения
-            'grid': 'grid', 'perPage': 30, 'page': 1,
             'ordergrid': 'send_date_DESC'
         }
-        messages_general = self.request('/notice/log', params, 'post')
-        general_data = messages_general.get('data')
-        if not general_data: return None
-        for general_data_row in general_data:
+        # Следующие страницы запрашиваются, только если на первой письма с паролем нет
+        for general_data_row in self.iter_grid('/notice/log', params, 'post', per_page=30):
             receiver_id = general_data_row.get('receiver_id')
             if int(receiver_id) != int(user_id): continue
             theme = general_data_row.get('theme')
-            if not 'Изменение пароля' in theme and not 'Вы зарегистрированы' in theme:
+            if not self.is_password_letter(theme):
                 continue
             # нужно получить самое последнее письмо с паролем
             # письма уже отсортированы по последнему в запросе
             # поэтому, получаем письмо и сразу возвращаем результат
             message = self.get_log_message(general_data_row.get('log_id'))
             if not message: return None  # Мб ошибка, отправляем на ручную проверку
-            message_tree = HTMLParser(html.unescape(message))
-
-            if 'Вы зарегистрированы' in theme:
-                try:
-                    # точка в конце в пароль не входит
-                    password = message_tree.css('li')[1].text()  # ex: 'пароль - 1JXM.'
-                    password = password[9:]  # ex: '1JXM.'
-                    password = password[:-1]  # ex: '1JXM'
-                    return password
-                except Exception:
-                    return None
-            elif 'Изменение пароля' in theme:
-                try:
-                    p_list = message_tree.css('p')
-                    for p in p_list:
-                        if 'Новый пароль: ' in p.text():  # ex: 'Новый пароль: el_6rBOw'
-                            return p.text()[14:]  # ex: '1JXM'
-                except Exception:
-                    return None
+            return self.parse_password_letter(theme, message)
         return None
 
+    PASSWORD_LETTER_THEMES = ('Изменение пароля', 'Вы зарегистрированы')
+
+    @classmethod
+    def is_password_letter(cls, theme) -> bool:
+        return bool(theme) and any(x in theme for x in cls.PASSWORD_LETTER_THEMES)
+
     def is_user_exists(self, email) -> bool:
         self._auth_check()
 
@@ -498,9 +647,131 @@ class LearningDriver:
             if str(row['email']).lower() == str(email).lower(): return True
         return False
 
+    def iter_grid(self, endpoint, params: Optional[dict] = None, method='get',
+            per_page: int = GRID_PAGE_SIZE, workers: int = GRID_WORKERS) -> Iterator[dict]:
+        """ Yields rows of the grid (gridmod=ajax) from all its pages
+
+            Первая страница запрашивается размером per_page, число записей
+            берётся из tableSettings.totalRecords. Остальные страницы
+            запрашиваются, только когда строки первой прочитаны: параллельно,
+            увеличенного размера (кратного per_page, до GRID_MAX_PAGE_SIZE),
+            чтобы их было не больше workers. Строки выдаются по порядку.
+            Если сервер вернул неполную страницу увеличенного размера,
+            остальные строки запрашиваются страницами полученного размера.
+
+            Вызывается и из нескольких потоков сразу: общее число запросов
+            ограничено MAX_CONCURRENT_REQUESTS в request(), а не workers
+        """
+        params = params or {}
+        workers = max(1, min(workers, self.MAX_CONCURRENT_REQUESTS))
+        resp = self._request_grid_page(endpoint, params, 1, per_page, method)
+        rows = resp.get('data') or []
+        yield from rows
+
+        table_settings = resp.get('tableSettings') or {}
+        total = int(table_settings.get('totalRecords') or 0)
+        fetched = len(rows)
+        if not fetched or total <= fetched:
+            return
+
+        if fetched < per_page:
+            # Сервер ограничил размер страницы
+            page_size = fetched
+        else:
+            pages_left = ceil(total / per_page) - 1
+            multiplier = min(ceil(pages_left / max(1, workers)), max(1, self.GRID_MAX_PAGE_SIZE // per_page))
+            page_size = per_page * max(1, multiplier)
+        # Первая страница нового размера может частично совпадать с уже полученной
+        first_page = fetched // page_size + 1
+        pages = range(first_page, ceil(total / page_size) + 1)
+
+        executor = ThreadPoolExecutor(max_workers=min(workers, len(pages)))
+        try:
+            futures = [
+                executor.submit(self._request_grid_page, endpoint, params, page, page_size, method)
+                for page in pages
+            ]
+            position = fetched  # первая ещё не выданная строка
+            for page, future in zip(pages, futures):
+                data = future.result().get('data') or []
+                offset = (page - 1) * page_size
+                if len(data) < min(page_size, total - offset):
+                    if not data:
+                        raise RequestError(f"Empty page {page} of {endpoint}")
+                    # Сервер ограничил размер страницы
+                    for x in futures:
+                        x.cancel()
+                    yield from self._iter_grid_rows(endpoint, params, method, position, total, len(data))
+                    return
+                yield from data[position - offset:]
+                position = offset + len(data)
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def iter_group_members(self, group_id, email_filter: Optional[Iterable[str]] = None) -> Iterator[Tuple[int, str]]:
+        """ Yields group members (user_id, user_email) as pages are loaded
+            email_filter: emails to keep, case and surrounding spaces are ignored
+        """
+        self._auth_check()
+        if not self.switch_role('dean'):
+            raise SomethingWrong
+
+        emails = {normalize_email(x) for x in email_filter} if email_filter else None
+        rows = self.iter_grid(f"/study-groups/users/index/group_id/{group_id}", per_page=self.GROUP_PAGE_SIZE)
+        for row in rows:
+            if emails is not None and normalize_email(row['email']) not in emails:
+                continue
+            yield int(row['MID']), row['email']
+
+    def iter_tagged_users(self, tag: str) -> Iterator[Tuple[str, Tuple[str, ...]]]:
+        """ Yields (email, all tags of the user) for users found by the tag filter of /user/list
+            Фильтр может быть нечётким, метки нужно проверять по возвращённому списку
+        """
+        self._auth_check()
+        if not self.switch_role('admin'):
+            raise SomethingWrong
+
+        params = {'ordergrid': 'fio_ASC', 'tags': tag}
+        for row in self.iter_grid('/user/list', params, method='post'):
+            yield row['email'], self._parse_user_tags(row['tags']) if row.get('tags') else ()
+
+    def iter_users(self) -> Iterator[UserInfo]:
+        """ Yields all users of /user/list without courses """
+        self._auth_check()
+        if not self.switch_role('admin'):
+            raise SomethingWrong
+
+        rows = self.iter_grid('/user/list', {'ordergrid': 'fio_ASC'}, method='post', per_page=self.GRID_MAX_PAGE_SIZE)
+        for row in rows:
+            yield self._user_info_from_row(row)
+
     def logout(self):
         self.request('/logout')
 
+    @staticmethod
+    def parse_password_letter(theme: str, message: str) -> str | None:
+        """ Returns password from the letter about registration or password change """
+        message_tree = HTMLParser(html.unescape(message))
+
+        if 'Вы зарегистрированы' in theme:
+            try:
+                # точка в конце в пароль не входит
+                password = message_tree.css('li')[1].text()  # ex: 'пароль - 1JXM.'
+                password = password[9:]  # ex: '1JXM.'
+                password = password[:-1]  # ex: '1JXM'
+                return password
+            except Exception:
+                return None
+        elif 'Изменение пароля' in theme:
+            try:
+                p_list = message_tree.css('p')
+                for p in p_list:
+                    if 'Новый пароль: ' in p.text():  # ex: 'Новый пароль: el_6rBOw'
+                        return p.text()[14:]  # ex: '1JXM'
+            except Exception:
+                return None
+        return None
+
     def remove_from_group(self, group_id: str|int, user_id: str|int) -> bool:
         """ Убрать пользователей из группы
             Args:
@@ -516,14 +787,10 @@ class LearningDriver:
         params = {'postMassIds_grid': user_id, 'massActionsAll_grid': user_id}
 
         # успешно!
-        is_ajax_request_value = self._session.headers.pop('IS_AJAX_REQUEST', None)
-        page = self.request(f"/study-groups/users/exclude/subject_id/0/group_id/{group_id}", params, 'post', format_='html')
-        if is_ajax_request_value:
-            self._session.headers.update({'IS_AJAX_REQUEST': is_ajax_request_value})
-        
-        msg = self.get_notification(page)
+        msg = self.request_notification(f"/study-groups/users/exclude/subject_id/0/group_id/{group_id}",
+                                        params, 'post', headers={'IS_AJAX_REQUEST': None})
 
-        if "успешно" in msg:
+        if msg and "успешно" in msg:
             return True
         else:
             raise SomethingWrong(f"Something wrong on user {user_id} removing from group {group_id}: " + repr(msg))
@@ -542,28 +809,30 @@ class LearningDriver:
         
         # response is dumb
         self.request('/user/list/unassign-tag', params, 'post')
+        self.user_index.clear()
 
     def request(self, endpoint, params=None, method='get', headers=None, format_="json"):
         if params is None:
             params = {}
         try:
-            if method == 'get':
-                query = '?' + urllib.parse.urlencode(params) if not '?' in endpoint else ''
-                resp = self._session.get(self.website + endpoint + query, headers=headers)
-                # print('GET', resp.url)
-                if format_ == "json":
-                    resp = resp.json()
+            with self._throttle():
+                if method == 'get':
+                    query = '?' + urllib.parse.urlencode(params) if not '?' in endpoint else ''
+                    resp = self._session.get(self.website + endpoint + query, headers=headers)
+                    # print('GET', resp.url)
+                    if format_ == "json":
+                        resp = resp.json()
+                    else:
+                        resp = resp.text
+                elif method == 'post':
+                    resp = self._session.post(self.website + endpoint, data=params, headers=headers)
+                    # print('POST', resp.url)
+                    if format_ == "json":
+                        resp = resp.json()
+                    else:
+                        resp = resp.text
                 else:
-                    resp = resp.text
-            elif method == 'post':
-                resp = self._session.post(self.website + endpoint, data=params, headers=headers)
-                # print('POST', resp.url)
-                if format_ == "json":
-                    resp = resp.json()
-                else:
-                    resp = resp.text
-            else:
-                raise AttributeError('Only get or post methods allowed')
+                    raise AttributeError('Only get or post methods allowed')
         except requests.exceptions.ConnectionError as e:
             raise RequestError(str(e))
 
@@ -578,6 +847,27 @@ class LearningDriver:
 
         return resp
 
+    def request_notification(self, endpoint, params=None, method='post', headers=None) -> None | str | dict | list:
+        """ Requests html page and returns get_notification() for it
+            Страница читается частями, пока не встретится элемент
+            hm-notifications, остальное не загружается и не разбирается
+        """
+        url = self.website + endpoint
+        try:
+            with self._throttle():
+                if method == 'get':
+                    resp = self._session.get(url, params=params, headers=headers, stream=True)
+                elif method == 'post':
+                    resp = self._session.post(url, data=params, headers=headers, stream=True)
+                else:
+                    raise AttributeError('Only get or post methods allowed')
+                with resp:
+                    tag = self._read_notifications_tag(resp.iter_content(self.NOTIFICATION_CHUNK_SIZE))
+                    encoding = resp.encoding or 'utf-8'
+        except requests.exceptions.ConnectionError as e:
+            raise RequestError(str(e))
+        return self.get_notification(tag.decode(encoding, errors='replace'))
+
     def set_password(self, user_id, password) -> bool:
         self._auth_check()
         if not self.switch_role('admin'):
@@ -589,16 +879,12 @@ class LearningDriver:
         }
         
         # Пароль успешно назначен!
-        is_ajax_request_value = self._session.headers.pop('IS_AJAX_REQUEST', None)
-
-        page = self.request('/user/list/set-password', params, 'post', format_='html')
-        
-        if is_ajax_request_value:
-            self._session.headers.update({'IS_AJAX_REQUEST': is_ajax_request_value})
-        
-        msg = self.get_notification(page)
+        # Заголовок убирается только для этого запроса: сессия может
+        # одновременно использоваться из нескольких потоков
+        msg = self.request_notification('/user/list/set-password', params, 'post',
+                                        headers={'IS_AJAX_REQUEST': None})
 
-        if "успешно" in msg:
+        if msg and "успешно" in msg:
             return True
         else:
             raise SomethingWrong("Something wrong on password change: " + repr(msg))
@@ -607,18 +893,21 @@ class LearningDriver:
         self._auth_check()
         if self._current_role == role: return True
 
-        check = self.get_current_role()
-        if check == role:
-            self._current_role = role
-            return True
+        with self._role_lock:
+            if self._current_role == role: return True
 
-        resp = self.request(f"/index/switch/role/{role}")
-        if resp == True:
             check = self.get_current_role()
-            if check != role:
-                return False
-            self._current_role = role
-            return True
-        return False
+            if check == role:
+                self._current_role = role
+                return True
+
+            resp = self.request(f"/index/switch/role/{role}")
+            if resp == True:
+                check = self.get_current_role()
+                if check != role:
+                    return False
+                self._current_role = role
+                return True
+            return False
 
     
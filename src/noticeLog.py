@@ -0,0 +1,162 @@
+import datetime
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from math import ceil
+from typing import TYPE_CHECKING, Dict, Optional, Tuple
+
+from settings import Settings
+from utils import convert_date_string
+
+if TYPE_CHECKING:
+    from learning import LearningDriver
+
+
+class LogMessageCache:
+    """ Тексты отправленных писем журнала уведомлений по log_id
+
+        Письма не меняются, поэтому хранятся без срока, но только в памяти:
+        письма о регистрации и смене пароля содержат пароли. Файл
+        notice_messages.jsonl прежних версий удаляется при первом обращении.
+    """
+
+    LEGACY_FILENAME = 'notice_messages.jsonl'
+
+    _messages: Optional[Dict[str, str]] = None
+    _lock = threading.Lock()
+
+    @classmethod
+    def _load(cls) -> Dict[str, str]:
+        if cls._messages is None:
+            try:
+                os.remove(os.path.join(Settings.get_dirpath('cache'), cls.LEGACY_FILENAME))
+            except OSError:
+                pass
+            cls._messages = dict()
+        return cls._messages
+
+    @classmethod
+    def get(cls, log_id) -> Optional[str]:
+        with cls._lock:
+            return cls._load().get(str(log_id))
+
+    @classmethod
+    def put(cls, log_id, message: str) -> None:
+        with cls._lock:
+            cls._load()[str(log_id)] = message
+
+
+class PasswordIndex:
+    """ Пароли из писем о регистрации и смене пароля, собранные одним
+        просмотром журнала уведомлений «Общего назначения»
+
+        Журнал читается от новых писем к старым до даты since, для каждого
+        получателя запоминается последнее письмо с паролем. Сами письма
+        загружаются при первом обращении к паролю получателя.
+        get_user_password() отвечает так же, как LearningDriver: для
+        получателей, которых нет в индексе, письмо ищется запросом.
+
+        С max_pages просмотр не начинается, если по датам первой страницы
+        до since больше max_pages страниц, и прекращается на max_pages-й
+        странице: build() возвращает None, и пароли нужно искать отдельно.
+    """
+
+    PAGE_SIZE = 500
+    WORKERS = 4
+    # Во сколько раз страница журнала дороже поиска писем одного пользователя (30 строк)
+    PAGE_COST = 4
+
+    def __init__(self, learning: 'LearningDriver', since: Optional[datetime.datetime] = None,
+            workers: int = WORKERS, max_pages: Optional[int] = None):
+        self.learning = learning
+        self.since = since
+        self.workers = max(1, workers)
+        self.max_pages = max_pages
+        self._letters: Dict[int, Tuple[str, str]] = dict()  # receiver_id -> (theme, log_id)
+
+    def __len__(self):
+        return len(self._letters)
+
+    def _add_rows(self, rows) -> bool:
+        """ Returns False when rows older than since were reached """
+        for row in rows:
+            send_date = convert_date_string(row.get('send_date'))
+            if self.since and send_date and send_date < self.since:
+                return False
+            theme = row.get('theme')
+            if not self.learning.is_password_letter(theme):
+                continue
+            try:
+                receiver_id = int(row.get('receiver_id'))
+            except (TypeError, ValueError):
+                continue
+            # Письма идут от новых к старым, нужно последнее
+            self._letters.setdefault(receiver_id, (theme, row.get('log_id')))
+        return True
+
+    def _estimate_pages(self, rows, total_pages: int) -> int:
+        """ Число страниц до since, если письма отправляются так же часто, как на первой """
+        if self.since is None:
+            return total_pages
+        newest = convert_date_string(rows[0].get('send_date'))
+        oldest = convert_date_string(rows[-1].get('send_date'))
+        if not newest or not oldest or newest <= oldest:
+            return total_pages
+        return min(total_pages, ceil((newest - self.since) / (newest - oldest)))
+
+    def build(self) -> Optional[int]:
+        """ Scans the notice log, returns number of users with password letters
+            or None if the scan would take more than max_pages pages or a page
+            came back incomplete
+        """
+        self.learning._auth_check()
+        if not self.learning.switch_role('admin'):
+            from learning import SomethingWrong
+            raise SomethingWrong
+
+        endpoint = '/notice/log'
+        params = {'cluster': 'general', 'ordergrid': 'send_date_DESC'}
+        resp = self.learning._request_grid_page(endpoint, params, 1, self.PAGE_SIZE, 'post')
+        rows = resp.get('data') or []
+        total = int((resp.get('tableSettings') or {}).get('totalRecords') or 0)
+        if not self._add_rows(rows) or not rows or len(rows) >= total:
+            return len(self)
+
+        # Сервер может ограничить размер страницы, следующие запрашиваются по полученному
+        page_size = len(rows)
+        total_pages = ceil(total / page_size)
+        if self.max_pages is not None:
+            if self._estimate_pages(rows, total_pages) > self.max_pages:
+                return None
+            last_page = min(total_pages, self.max_pages)
+        else:
+            last_page = total_pages
+
+        # Страницы загружаются группами по workers, пока не дойдём до since
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for first in range(2, last_page + 1, self.workers):
+                pages = range(first, min(first + self.workers, last_page + 1))
+                responses = executor.map(
+                    lambda page: self.learning._request_grid_page(endpoint, params, page, page_size, 'post'),
+                    pages,
+                )
+                for page, resp in zip(pages, responses):
+                    rows = resp.get('data') or []
+                    if not self._add_rows(rows):
+                        return len(self)
+                    if len(rows) < page_size and page < total_pages:
+                        return None  # страница неполная, письма могли быть пропущены
+        if last_page < total_pages:
+            return None  # since не достигнута
+        return len(self)
+
+    def get_user_password(self, user_id) -> Optional[str]:
+        letter = self._letters.get(int(user_id))
+        if letter is None:
+            # Письмо могло быть отправлено до since, ищется отдельно
+            return self.learning.get_user_password(user_id)
+        theme, log_id = letter
+        message = self.learning.get_log_message(log_id)
+        if not message:
+            return None
+        return self.learning.parse_password_letter(theme, message)
@@ -1,25 +1,60 @@
 from platformdirs import user_config_dir
+import atexit
 import os
 import json
 import sys
+import tempfile
+import threading
 
 from crypt import encode, decode
 import custom_json
 
+_DELETED = object()
+
 class Settings:
+    """ Настройки программы
+
+        Данные хранятся в памяти процесса и перечитываются с диска, только
+        если файл изменился. Изменения записываются в файл с задержкой
+        WRITE_DELAY секунд одной операцией, а также при вызове save()
+        и при завершении программы.
+    """
+
+    WRITE_DELAY = 1.0
 
     _data = dict()
+    _filepath = None
+    _loaded = False
+    _file_state = None  # (mtime_ns, size) файла при последнем чтении или записи
+    _pending = dict()  # ещё не записанные изменения: ключ -> значение или _DELETED
+    _revisions = dict()  # ключ -> номер изменения значения
+    _timer = None
+    _lock = threading.RLock()
 
     def __init__(self, noload=False):
-        if noload: 
+        if noload:
             return
-        self.load()
+        self.reload()
 
     @classmethod
     def get_filepath(cls) -> str:
-        filename = "settings.json"
-        config_dir = user_config_dir("elexam", ensure_exists=True)
-        return os.path.join(config_dir, filename)
+        if cls._filepath is None:
+            filename = "settings.json"
+            config_dir = user_config_dir("elexam", ensure_exists=True)
+            cls._filepath = os.path.join(config_dir, filename)
+        return cls._filepath
+
+    @classmethod
+    def get_dirpath(cls, name: str) -> str:
+        """ Returns path of the directory for program data next to settings file """
+        dirpath = os.path.join(os.path.dirname(cls.get_filepath()), name)
+        os.makedirs(dirpath, exist_ok=True)
+        return dirpath
+
+    @classmethod
+    def get_revision(cls, key) -> int:
+        """ Returns number that changes every time the value of key changes """
+        return cls._revisions.get(key, 0)
 
     def get_crypted(self, param):
         value = self[param]
@@ -31,19 +66,75 @@ class Settings:
             return decoded
 
     @classmethod
-    def load(cls) -> dict:
-        filepath = cls.get_filepath()
+    def _get_file_state(cls):
+        try:
+            stat = os.stat(cls.get_filepath())
+        except OSError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
 
-        if not os.path.isfile(filepath) or os.path.getsize(filepath) == 0:
-            cls._data = dict()
+    @classmethod
+    def _touch(cls, key) -> None:
+        cls._revisions[key] = cls._revisions.get(key, 0) + 1
+
+    @classmethod
+    def load(cls) -> dict:
+        """ Reads settings from file, not yet written changes are kept """
+        with cls._lock:
+            filepath = cls.get_filepath()
+            file_state = cls._get_file_state()
+
+            data = dict()
+            if file_state and file_state[1] != 0:
+                with open(filepath, 'r') as f:
+                    data = json.load(f)
+
+            for key, value in cls._pending.items():
+                if value is _DELETED:
+                    data.pop(key, None)
+                else:
+                    data[key] = value
+
+            cls._replace_data(data)
+            cls._file_state = file_state
+            cls._loaded = True
             return cls._data
 
-        with open(filepath, 'r') as f:
-            cls._data = json.load(f)
+    @classmethod
+    def _replace_data(cls, data: dict) -> None:
+        for key in cls._data.keys() | data.keys():
+            if cls._data.get(key, _DELETED) != data.get(key, _DELETED):
+                cls._touch(key)
+        cls._data = data
+
+    @classmethod
+    def reload(cls) -> dict:
+        """ Reads settings from file only if file was changed since the last reading """
+        if not cls._loaded or cls._get_file_state() != cls._file_state:
+            return cls.load()
         return cls._data
 
     def save(self) -> bool:
-        return self.write(self.__class__._data)
+        return self.flush()
+
+    @classmethod
+    def flush(cls) -> bool:
+        """ Writes not yet written changes to file """
+        with cls._lock:
+            if cls._timer:
+                cls._timer.cancel()
+                cls._timer = None
+            if not cls._pending:
+                return True
+            return cls.write(cls._data)
+
+    @classmethod
+    def _schedule_flush(cls) -> None:
+        with cls._lock:
+            if cls._timer: return
+            cls._timer = threading.Timer(cls.WRITE_DELAY, cls.flush)
+            cls._timer.daemon = True
+            cls._timer.start()
 
     def set_crypted(self, param, value):
         if type(value) != str:
@@ -53,16 +144,42 @@ class Settings:
 
     @classmethod
     def update(cls, key, value) -> bool:
-        settings = cls.load()
-        settings[key] = value
-        return cls.write(settings)
+        with cls._lock:
+            cls.reload()
+            cls._set(key, value)
+            return cls.flush()
 
     @classmethod
     def write(cls, settings: dict) -> bool:
-        with open(cls.get_filepath(), 'w') as f:
-            json.dump(settings, f, indent=4, cls=custom_json.JSONEncoder)
-        cls._data = settings
-        return True
+        """ Atomically replaces settings file with settings """
+        with cls._lock:
+            filepath = cls.get_filepath()
+            fd, tmp_filepath = tempfile.mkstemp(
+                prefix='.settings.', suffix='.tmp', dir=os.path.dirname(filepath))
+            try:
+                with os.fdopen(fd, 'w') as f:
+                    json.dump(settings, f, indent=4, cls=custom_json.JSONEncoder)
+                os.replace(tmp_filepath, filepath)
+            except BaseException:
+                if os.path.exists(tmp_filepath):
+                    os.remove(tmp_filepath)
+                raise
+            if settings is not cls._data:
+                cls._replace_data(settings)
+            cls._pending.clear()
+            cls._file_state = cls._get_file_state()
+            return True
+
+    @classmethod
+    def _set(cls, key, value) -> None:
+        # Храним значение в том же виде, в каком оно будет прочитано из файла
+        value = json.loads(json.dumps(value, cls=custom_json.JSONEncoder))
+        with cls._lock:
+            if cls._data.get(key, _DELETED) != value:
+                cls._touch(key)
+            cls._data[key] = value
+            cls._pending[key] = value
+        cls._schedule_flush()
 
     def __len__(self):
         return len(self.__class__._data)
@@ -74,16 +191,21 @@ class Settings:
         return self.__class__._data.__contains__(item)
 
     def __getitem__(self, key):
-        # self.load()
         if not key in self.__class__._data:
             return None
         return self.__class__._data.__getitem__(key)
 
     def __setitem__(self, key, value):
-        self.__class__._data.__setitem__(key, value)
-        self.write(self.__class__._data)
+        self._set(key, value)
 
     def __delitem__(self, key):
-        if not key in self.__class__._data: return
-        self.__class__._data.__delitem__(key)
-        self.write(self.__class__._data)
+        cls = self.__class__
+        with cls._lock:
+            if not key in cls._data: return
+            cls._data.__delitem__(key)
+            cls._pending[key] = _DELETED
+            cls._touch(key)
+        cls._schedule_flush()
+
+
+atexit.register(Settings.flush)
@@ -0,0 +1,86 @@
+import datetime
+import hashlib
+import json
+import os
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from datatypes import UserAction, UserInfo, UserTableData
+from incrementalStore import IncrementalStore
+from settings import Settings
+
+
+class SuggestionStore:
+    """ Заранее подготовленные предложения действий по строкам файла
+
+        Заполняется в режиме наблюдения за файлом (IntakeWatcher). Первая
+        часть обработки не ищет пользователей и не подбирает действия для
+        строк, которые не изменились с момента подготовки. Предложения
+        старше MAX_AGE не используются: состояние eLearning могло измениться.
+    """
+
+    VERSION = 1
+    DIRNAME = 'suggestions'
+    MAX_AGE = datetime.timedelta(hours=12)
+
+    def __init__(self, path: str):
+        self.path = path
+        self._entries: Dict[str, dict] = dict()
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get('version') == self.VERSION:
+                self._entries = data['entries']
+        except (OSError, json.JSONDecodeError, AttributeError, KeyError):
+            pass
+
+    @classmethod
+    def for_file(cls, filepath: str) -> 'SuggestionStore':
+        key = hashlib.sha1(os.path.abspath(filepath).encode()).hexdigest()
+        return cls(os.path.join(Settings.get_dirpath(cls.DIRNAME), key + '.json'))
+
+    def __len__(self):
+        return len(self._entries)
+
+    def find(self, table_user: UserTableData) -> Optional[List[Tuple[UserInfo, List[UserAction]]]]:
+        """ Returns [(UserInfo, suggested actions), ...] prepared for the unchanged row or None
+            Пустой список - пользователь не найден
+        """
+        entry = self._entries.get(IncrementalStore.get_key(table_user))
+        if entry is None or entry['fingerprint'] != IncrementalStore.fingerprint(table_user):
+            return None
+        prepared = datetime.datetime.fromisoformat(entry['time'])
+        if datetime.datetime.now() - prepared > self.MAX_AGE:
+            return None
+        return [
+            (UserInfo.from_dict(data, table=table_user),
+             [UserAction.from_dict(x) for x in entry['suggested'].get(str(data['mid']), [])])
+            for data in entry['users']
+        ]
+
+    def find_all(self, user_table_data: Iterable[UserTableData]) -> Dict[str, List[tuple]]:
+        """ Returns {table email: find(row)} for rows with prepared suggestions """
+        found = dict()
+        for table_user in user_table_data:
+            prepared = self.find(table_user)
+            if prepared is not None:
+                found[table_user.email] = prepared
+        return found
+
+    def put(self, table_user: UserTableData,
+            user_suggestions: Iterable[Tuple[UserInfo, List[UserAction]]]) -> None:
+        user_suggestions = list(user_suggestions)
+        self._entries[IncrementalStore.get_key(table_user)] = {
+            'fingerprint': IncrementalStore.fingerprint(table_user),
+            'time': datetime.datetime.now().isoformat(timespec='seconds'),
+            'users': [uinfo.as_dict() for uinfo, _ in user_suggestions],
+            'suggested': {
+                str(uinfo.mid): [x.as_dict() for x in suggested]
+                for uinfo, suggested in user_suggestions
+            },
+        }
+
+    def save(self) -> None:
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'version': self.VERSION, 'entries': self._entries}, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,84 @@
+import hashlib
+import os
+import pickle
+from typing import Dict, NamedTuple, Optional, Tuple
+
+from datatypes import UserTableData
+from settings import Settings
+from utils import get_file_hash
+
+
+class TableSnapshot(NamedTuple):
+    users: Tuple[UserTableData, ...]
+    columns: Dict[str, int]  # столбцы первого листа, по которым собраны users
+    headers: Dict[str, Tuple]  # заголовки всех листов книги
+    email_index: Dict[str, int]  # email -> индекс в users
+
+
+class TableCache:
+    """ Кэш разобранных таблиц пользователей.
+
+        Снимок хранится рядом с настройками и привязан к пути файла,
+        его размеру, времени изменения и хэшу содержимого, поэтому
+        повторное открытие неизменённого файла не требует openpyxl.
+    """
+
+    VERSION = 2
+    DIRNAME = 'tables'
+
+    @classmethod
+    def _get_cache_path(cls, filepath: str) -> str:
+        key = hashlib.sha1(os.path.abspath(filepath).encode()).hexdigest()
+        return os.path.join(Settings.get_dirpath(cls.DIRNAME), key + '.pickle')
+
+    @classmethod
+    def _write(cls, filepath: str, meta: dict) -> None:
+        cache_path = cls._get_cache_path(filepath)
+        tmp_path = cache_path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(meta, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, cache_path)
+
+    @classmethod
+    def get(cls, filepath: str) -> Optional[TableSnapshot]:
+        """ Returns snapshot for the file or None if file was changed """
+        cache_path = cls._get_cache_path(filepath)
+        try:
+            stat = os.stat(filepath)
+            with open(cache_path, 'rb') as f:
+                meta = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ImportError):
+            return None
+
+        if not isinstance(meta, dict) or meta.get('version') != cls.VERSION:
+            return None
+        if meta.get('path') != os.path.abspath(filepath) or meta.get('size') != stat.st_size:
+            return None
+        if meta.get('mtime_ns') != stat.st_mtime_ns:
+            # Файл могли пересохранить без изменений
+            if meta.get('sha256') != get_file_hash(filepath):
+                return None
+            meta['mtime_ns'] = stat.st_mtime_ns
+            try:
+                cls._write(filepath, meta)
+            except OSError:
+                pass
+        return meta.get('snapshot')
+
+    @classmethod
+    def put(cls, filepath: str, snapshot: TableSnapshot) -> bool:
+        """ Stores snapshot for the current state of the file """
+        try:
+            stat = os.stat(filepath)
+            meta = {
+                'version': cls.VERSION,
+                'path': os.path.abspath(filepath),
+                'size': stat.st_size,
+                'mtime_ns': stat.st_mtime_ns,
+                'sha256': get_file_hash(filepath),
+                'snapshot': snapshot,
+            }
+            cls._write(filepath, meta)
+        except OSError:
+            return False
+        return True
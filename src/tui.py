@@ -1,2 +1,13 @@
+import sys
+
+if len(sys.argv) > 1 and not sys.argv[1].startswith('-'):
+    # Неинтерактивные команды, например: step1 --policy policy.json file.xlsx
+    import batch
+    sys.exit(batch.main(sys.argv[1:]))
+
+if '--startup-profile' in sys.argv:
+    from importProfiler import ImportProfiler
+    ImportProfiler.enable()
+
 from ui.console import Console
-Console()
\ No newline at end of file
+Console()
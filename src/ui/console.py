@@ -3,9 +3,9 @@ import re
 import sys
 from sys import exit
 import datetime
+import threading
 import traceback
-from time import sleep
-from typing import List, Tuple, Optional, Callable, Iterable, Union
+from typing import List, Tuple, Optional, Callable, Iterable, Union, TYPE_CHECKING
 
 from rich import print
 from rich.console import Console as RichConsole
@@ -20,14 +20,7 @@ from rich.live import Live
 sys.path.append("..")
 from settings import Settings
 from label import LabelController, NoSuitableLabelFound
-from learning import (
-    LearningDriver,
-    InvalidLoginPair, DataAgreementNotAccepted, 
-    RequestError, UserNotFound, NotAuthorized
-)
-from excelDriver import ExcelDriver, UserTableData
-from excelDriver import UserNotFoundException as ExcelUserNotFound
-from fileController import FileController
+from importProfiler import ImportProfiler
 from datatypes import (
     MenuItem, UserInfo, UserAction, 
     UserActionType, AuthCookies, Exam,
@@ -41,10 +34,18 @@ from utils import (
     convert_block_dates
 )
 
+# learning, excelDriver и fileController тянут requests, selectolax и openpyxl,
+# поэтому импортируются в действиях меню при первом использовании
+if TYPE_CHECKING:
+    from learning import LearningDriver
+
 
 class Console(RichConsole):
 
     AUTHCOOKIEID = "auth"
+    LOOKUP_WORKERS = 8  # одновременных запросов при поиске нескольких пользователей
+
+    _auth_check_thread = None
 
     def __init__(self):
         super().__init__()
@@ -57,10 +58,13 @@ class Console(RichConsole):
         if logged:
             menuitems.append(MenuItem('Проверить вход в систему', 'auth_check'))
             menuitems.append(MenuItem('Выполнить обработку файла (часть 1)', 'process_file_1'))
+            menuitems.append(MenuItem('Составить план обработки файла (часть 1)', 'plan_file_1'))
+            menuitems.append(MenuItem('Выполнить план обработки файла (часть 1)', 'apply_plan_1'))
         else:
             menuitems.append(MenuItem('Войти в систему', 'auth_check'))
         menuitems.append(MenuItem('Выполнить обработку файла (часть 2, csv)', 'process_file_2'))
         if logged:
+            menuitems.append(MenuItem('Проверить метки пользователей файла (eLearning)', 'audit_labels'))
             menuitems.append(MenuItem('Выполнить действия с пользователем (eLearning)', 'perform_actions'))
             menuitems.append(MenuItem('Получить информацию о пользователе (eLearning)', 'show_uinfo'))
             menuitems.append(MenuItem('Найти пароль пользователя (eLearning)', 'find_password'))
@@ -405,6 +409,8 @@ class Console(RichConsole):
         usertext += f"{userp}[cyan]Email:[/cyan] {user.email}"
         usertext += f"\n{userp} [red]В таблице {user.table.email}[/red]" if user.table \
                  and user.table.email and user.table.email.lower() != user.email.lower() else ""
+        usertext += f"\n{userp} [yellow]Найден по ФИО, сходство {round(user.fio_match * 100)}%[/yellow]" \
+                 if user.fio_match else ""
         usertext += f"\n{userp}[cyan]ФИО:[/cyan] {user.fio}"
         usertext += f"\n{userp} [red]В таблице {user.table.fio}[/red]" if user.table \
                  and user.table.fio and user.table.fio.lower() != user.fio.lower() else ""
@@ -454,7 +460,9 @@ class Console(RichConsole):
                     self.print("[red]Не получается скопировать данные в буфер :(")
 
     @classmethod
-    def create_learning(cls) -> LearningDriver:
+    def create_learning(cls) -> 'LearningDriver':
+        from learning import LearningDriver
+
         ac = None
         ac_list = Settings().get_crypted(cls.AUTHCOOKIEID)
         if ac_list:
@@ -469,6 +477,8 @@ class Console(RichConsole):
             silent: show only important output
         """
         ##
+        from learning import InvalidLoginPair, DataAgreementNotAccepted
+
         learning = self.create_learning()
 
         with self.status("Проверка входа... ") as status:
@@ -550,21 +560,45 @@ class Console(RichConsole):
             return
         
         try:
-            learning = self.create_learning()
-            with self.status("Загрузка... "):
-                if not learning.auth_check():
-                    del Settings()[self.AUTHCOOKIEID]
+            self.start_auth_check()
             self.run_menu()
         except KeyboardInterrupt:
             pass
         except EOFError:
             pass
 
+    def start_auth_check(self) -> None:
+        """ Checks saved login in background while the menu is shown """
+        if not Settings()[self.AUTHCOOKIEID]:
+            return
+
+        def check():
+            try:
+                if not self.create_learning().auth_check():
+                    del Settings()[self.AUTHCOOKIEID]
+            except Exception:
+                # Ошибки сети и т.п. покажет первое действие с eLearning
+                pass
+
+        self._auth_check_thread = threading.Thread(target=check, daemon=True)
+        self._auth_check_thread.start()
+
+    def wait_auth_check(self) -> bool:
+        """ Waits for start_auth_check(), returns True if saved login became invalid """
+        if self._auth_check_thread is None:
+            return False
+        with self.status("Проверка входа... "):
+            self._auth_check_thread.join()
+        self._auth_check_thread = None
+        return not Settings()[self.AUTHCOOKIEID]
+
     def run_action_get_users_from_course(self, course_id=None, filepath=None) -> None:
         """
         Получить пользователей с курса в Excel с полями:
         id в системе, логин, почта, Фамилия Имя Отчество (в одном), вуз, статус (студент), направление (архитектор) 
         """
+        from fileController import FileController
+
         self.print("[yellow]Запись пользователей из курса в файл Excel\n")
 
         learning = self.create_learning()
@@ -586,20 +620,12 @@ class Console(RichConsole):
             generated_filename += ".xlsx"
             filepath = self.ask("[cyan]Введите путь, куда нужно сохранить файл", default=generated_filename)
 
-        perPage = 10
-
-        total_pages = learning.get_course_pages(course_id, perPage)
-        if not total_pages:
+        exported = FileController.export_course_members(
+            course_id, filepath, self.gen_progress, self.message_callback, learning=learning,
+        )
+        if not exported:
             self.print("[red] В курсе нет участников либо курс не найден")
             return
-        
-        for currentPage in self.gen_progress(range(1, total_pages + 1), title="Получение информации о пользователях..."):
-            users = learning.get_course_members(course_id, page=currentPage, perPage=perPage)
-            for k, user in enumerate(users):
-                sleep(0.01)
-                users[k] = user | learning.get_user_info_card(user['MID'])
-            
-            FileController.save_course_members(users, filepath)
 
         self.print("[green]Обработка завершена. Файл с результатами сохранен по пути:")
         self.print(f"[magenta]{os.path.abspath(filepath)}")
@@ -634,24 +660,33 @@ class Console(RichConsole):
         
         with self.status("Загрузка... "):
             group_id = learning.find_group_id(group_name)
-            
-            # return format: [(user_id, user_email), ...]
-            users = learning.get_group_members(group_id, emails)
-        
+
+        # Список участников загружается полностью до исключения: иначе страницы
+        # группы сдвигаются во время загрузки и часть участников пропускается
+        with self.status("Загрузка участников группы... "):
+            users = dict(learning.iter_group_members(group_id, emails))  # user_id -> user_email
+
+        excluded, failed = 0, []
+        with self.status("Исключение участников из группы... ") as status:
+            for chunk, error in learning.exclude_from_group(group_id, users):
+                if error is None:
+                    excluded += len(chunk)
+                else:
+                    failed.extend(chunk)
+                    self.print(f"[red]Не удалось исключить {len(chunk)} участников: {error!r}")
+                status.update(f"Исключение участников из группы... {excluded}/{len(users)}")
+
         if not users:
             self.print("[red]Участники в группе не найдены")
             input("Нажмите Enter чтобы продолжить...")
             return
 
-        user_ids = ",".join([str(x[0]) for x in users])
-
-        with self.status("Исключение участников из группы... "):
-            learning.remove_from_group(group_id, user_ids)
-        
-        users_len = len(users)
-        _excluded = pluralize(users_len, ['исключен', 'исключены', 'исключено'])
-        _members = pluralize(users_len, ['участник', 'участника', 'участников'])
-        self.print(f"[green]Из группы {group_name} {_excluded} {users_len} {_members}")
+        _excluded = pluralize(excluded, ['исключен', 'исключены', 'исключено'])
+        _members = pluralize(excluded, ['участник', 'участника', 'участников'])
+        self.print(f"[green]Из группы {group_name} {_excluded} {excluded} {_members}")
+        if failed:
+            self.print(f"[red]Не исключены ({len(failed)}):")
+            self.print(Text(", ".join(users[x] for x in failed), style='dim'))
         input("Нажмите Enter чтобы продолжить... ")
 
     def run_action_remove_from_group_manually(self) -> None:
@@ -666,6 +701,10 @@ class Console(RichConsole):
         
 
     def run_action_show_user_info(self) -> Optional[str]:
+        from learning import NotAuthorized
+        from excelDriver import ExcelDriver
+        from daemon import DaemonClient
+
         emails = self.ask("Введите email").split(', ')
         if emails[0] == '!step1':
             emails = Settings()['cache.file_step1_emails']
@@ -678,119 +717,129 @@ class Console(RichConsole):
                 return
         self.print("[dim]Введите путь к файлу, если хотите подгрузить данные из таблицы. Иначе введите «!»")
         filepath = self.ask_filepath(required=False)
-        data_to_show = list()  # Содержит элементы вида (запрашиваемый email, List[UserInfo]|None)
-        
-        status = self.status("Получение информации о пользователе... ")
-        status.start()
-        learning = self.create_learning()
-        driver = ExcelDriver()
+
+        # Запущенный демон (app.py daemon) отвечает из своей сессии и кэша
+        learning = DaemonClient.connect() or self.create_learning()
+        table_data = None
         if filepath != "!":
-            driver.load(filepath)
+            driver = ExcelDriver()
+            driver.load(filepath, lazy=True)
+            table_data = driver.get_users_data(emails)
 
-        # Загрузка данных пользователей
+        # Пользователи загружаются параллельно и выводятся по мере готовности
+        data_to_show_len = len(emails)
         try:
-            for email in emails:
-                try:
-                    uinfo = learning.get_user_info(email)
-                    if filepath != '!':
-                        try:
-                            for _uinfo in uinfo:
-                                _uinfo.table = driver.get_user_data(email)
-                        except ExcelUserNotFound:
-                            pass
-                    data_to_show.append((email, uinfo))
-                except UserNotFound:
-                    data_to_show.append((email, None))
+            for i, data in enumerate(self.stream_users_info(learning, emails, table_data)):
+                title = None
+                if data_to_show_len > 1:
+                    title = f"[cyan][not dim]Пользователь {data[0]} [bold]({i+1}[/bold]/[bold]{data_to_show_len})"
+                if not data[1]:
+                    self.print(f"[magenta]Пользователь {data[0]} [bold]({i+1}[/bold]/[bold]{data_to_show_len})[/bold] не найден")
+                    val = input("Нажмите Enter чтобы продолжить...")
+                    if val == '!!': return
+                    continue
+                for uinfo in data[1]:
+                    self.print()
+                    self.print(self.compose_user_info(uinfo, detailed=True, title=title))
+                    val = input("Нажмите Enter чтобы продолжить...")
+                    if val == '!!': return
         except NotAuthorized:
-            status.stop()
             self.print("[red]Сессия устарела. Необходимо пройти аутентификацию ещё раз")
             del Settings()[self.AUTHCOOKIEID]
             return "rerender menu"
-        status.stop()
-        
-        # Вывод загруженных данных
-        data_to_show_len = len(data_to_show)
-        for i, data in enumerate(data_to_show):
-            title = None
-            if data_to_show_len > 1:
-                title = f"[cyan][not dim]Пользователь {data[0]} [bold]({i+1}[/bold]/[bold]{data_to_show_len})"
-            if not data[1]:
-                self.print(f"[magenta]Пользователь {data[0]} [bold]({i+1}[/bold]/[bold]{data_to_show_len})[/bold] не найден")
-                val = input("Нажмите Enter чтобы продолжить...")
-                if val == '!!': return
-                continue
-            for uinfo in data[1]:
-                self.print()
-                self.print(self.compose_user_info(uinfo, detailed=True, title=title))
-                val = input("Нажмите Enter чтобы продолжить...")
-                if val == '!!': return
         ##
 
+    def stream_users_info(self, learning, emails: List[str],
+            table_data: Optional[dict] = None) -> Iterable[Tuple[str, Optional[List[UserInfo]]]]:
+        """ Запрашивает пользователей параллельно, выдаёт (email, List[UserInfo]|None)
+            в порядке emails, как только готов очередной результат
+            table_data: {email: UserTableData|None} из ExcelDriver.get_users_data()
+        """
+        from concurrent.futures import ThreadPoolExecutor
+        from copy import copy
+        from learning import UserNotFound
+        from utils import normalize_email
+
+        def lookup(email):
+            try:
+                return learning.get_user_info(email)
+            except UserNotFound:
+                return None
+
+        # Один запрос на адрес, даже если он введён несколько раз в разном регистре
+        unique_emails = list(dict.fromkeys(normalize_email(x) for x in emails))
+        executor = ThreadPoolExecutor(max_workers=max(1, min(self.LOOKUP_WORKERS, len(unique_emails))))
+        try:
+            futures = {email: executor.submit(lookup, email) for email in unique_emails}
+            for email in emails:
+                future = futures[normalize_email(email)]
+                if not future.done():
+                    with self.status("Получение информации о пользователе... "):
+                        future.exception()
+                uinfo = future.result()
+                if uinfo is not None:
+                    uinfo = [copy(x) for x in uinfo]
+                    if table_data is not None:
+                        for _uinfo in uinfo:
+                            _uinfo.table = table_data.get(email)
+                yield email, uinfo
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
     def run_action_perform_actions(self) -> Optional[str]:
+        from learning import NotAuthorized
+        from excelDriver import ExcelDriver
+        from fileController import FileController
+        from daemon import invalidate_daemon_cache
+
         emails = self.ask("Введите email").split(', ')
         self.print("[dim]Введите путь к файлу, если хотите подгрузить данные из таблицы. Иначе введите «!»")
         filepath = self.ask_filepath(required=False)
-        data_to_show = list()  # Содержит элементы вида (запрашиваемый email, List[UserInfo]|None)
-        
-        status = self.status("Получение информации о пользователе... ")
-        status.start()
         abilities = ['learning']
         learning = self.create_learning()
         driver = ExcelDriver()
+        table_data = None
         if filepath != "!":
-            driver.load(filepath)
+            driver.load(filepath, lazy=True)
+            table_data = driver.get_users_data(emails)
             abilities.append('excel')
-        
 
-        # Загрузка данных пользователей
+        # Пользователи загружаются параллельно, действия выбираются по мере готовности
+        data_to_show_len = len(emails)
         try:
-            for email in emails:
-                try:
-                    uinfo = learning.get_user_info(email)
-                    if filepath != '!':
-                        try:
-                            for _uinfo in uinfo:
-                                _uinfo.table = driver.get_user_data(email)
-                        except ExcelUserNotFound:
-                            pass
-                    data_to_show.append((email, uinfo))
-                except UserNotFound:
-                    data_to_show.append((email, None))
+            for i, data in enumerate(self.stream_users_info(learning, emails, table_data)):
+                title = None
+                if data_to_show_len > 1:
+                    title = f"[cyan][not dim]Пользователь {data[0]} [bold]({i+1}[not bold]/[bold]{data_to_show_len})"
+                if not data[1]:
+                    self.print(f"[magenta]Пользователь {data[0]} не найден")
+                    val = input("Нажмите Enter чтобы продолжить...")
+                    if val == '!!': return
+                    continue
+                for uinfo in data[1]:
+                    suggested = []
+                    current_abilities = ['learning']
+                    if 'excel' in abilities and uinfo.table:
+                        current_abilities.append('excel')
+                    if 'excel' in current_abilities:
+                        with self.status("Выбор действий... "):
+                            suggested = suggest_user_actions(uinfo, learning=learning)
+                    uactions = self.select_user_actions(uinfo, suggested, current_abilities, add_top_gap=True)
+                    try:
+                        with self.status("Выполнение... "):
+                            FileController.perform_user_actions(driver, learning, uinfo, uactions)
+                        self.print("[green]Действия выполнены")
+                    except Exception:
+                        self.message_callback(traceback.format_exc(), status="info")
+                        self.message_callback('Не удалось выполнить действия', 'bad')
+                        self.message_callback(uactions, status='info')
+                    finally:
+                        if any(x.action in FileController.LEARNING_ACTIONS for x in uactions):
+                            invalidate_daemon_cache(emails=[uinfo.email], user_ids=[uinfo.mid])
         except NotAuthorized:
-            status.stop()
             self.print("[red]Сессия устарела. Необходимо пройти аутентификацию ещё раз")
             del Settings()[self.AUTHCOOKIEID]
             return "rerender menu"
-        status.stop()
-        
-        # Вывод загруженных данных
-        data_to_show_len = len(data_to_show)
-        for i, data in enumerate(data_to_show):
-            title = None
-            if data_to_show_len > 1:
-                title = f"[cyan][not dim]Пользователь {data[0]} [bold]({i+1}[not bold]/[bold]{data_to_show_len})"
-            if not data[1]:
-                self.print(f"[magenta]Пользователь {email} не найден")
-                val = input("Нажмите Enter чтобы продолжить...")
-                if val == '!!': return
-                continue
-            for uinfo in data[1]:
-                suggested = []
-                current_abilities = ['learning']
-                if 'excel' in abilities and uinfo.table:
-                    current_abilities.append('excel')
-                if 'excel' in current_abilities:
-                    with self.status("Выбор действий... "):
-                        suggested = suggest_user_actions(uinfo, learning=learning)
-                uactions = self.select_user_actions(uinfo, suggested, current_abilities, add_top_gap=True)
-                try:
-                    with self.status("Выполнение... "):
-                        FileController.perform_user_actions(driver, learning, uinfo, uactions)
-                    self.print("[green]Действия выполнены")
-                except Exception:
-                    self.message_callback(traceback.format_exc(), status="info")
-                    self.message_callback('Не удалось выполнить действия', 'bad')
-                    self.message_callback(uactions, status='info')
         ##
 
     def run_action_process_file_1(self) -> bool:
@@ -799,6 +848,9 @@ class Console(RichConsole):
         Returns True when authentication state changed and the main menu must
         be rebuilt.
         """
+        from learning import RequestError, NotAuthorized
+        from fileController import FileController
+
         filepath = self.ask_filepath()
 
         confirmed = Confirm.ask(
@@ -807,6 +859,14 @@ class Console(RichConsole):
         if not confirmed:
             return False
 
+        from incrementalStore import IncrementalStore
+        incremental = False
+        if len(IncrementalStore.for_file(filepath)):
+            incremental = Confirm.ask(
+                "Файл уже обрабатывался. Обработать только новые и изменённые строки?"
+            )
+        match_fio = Confirm.ask("Искать по ФИО пользователей, не найденных по email?", default=False)
+
         try:
             FileController.step1(
                 filepath=filepath,
@@ -819,6 +879,8 @@ class Console(RichConsole):
                 ),
                 confirm_users_actions=self.confirm_users_actions,
                 message_callback=self.message_callback,
+                incremental=incremental,
+                match_fio=match_fio,
             )
         except RequestError as error:
             self.print("\n[bold red]Ошибка запроса.[/bold red] Текст ошибки:\n")
@@ -833,10 +895,100 @@ class Console(RichConsole):
 
         return False
 
+    def run_action_plan_file_1(self) -> bool:
+        """ Поиск пользователей и выбор действий без изменения файла и eLearning
+            Returns True when the main menu must be rebuilt
+        """
+        from learning import RequestError, NotAuthorized
+        from fileController import FileController
+
+        filepath = self.ask_filepath()
+        planpath = self.ask("Введите путь для сохранения плана",
+                            default=os.path.splitext(filepath)[0] + '.plan.jsonl')
+        match_fio = Confirm.ask("Искать по ФИО пользователей, не найденных по email?", default=False)
+        try:
+            FileController.plan_step1(
+                filepath=filepath,
+                planpath=planpath,
+                progress_gen=self.gen_progress,
+                ask_user_actions=lambda *args, **kwargs: self.select_user_actions(
+                    *args,
+                    abilities=("learning", "excel"),
+                    add_top_gap=True,
+                    **kwargs,
+                ),
+                confirm_users_actions=self.confirm_users_actions,
+                message_callback=self.message_callback,
+                match_fio=match_fio,
+            )
+        except RequestError as error:
+            self.print("\n[bold red]Ошибка запроса.[/bold red] Текст ошибки:\n")
+            self.print(error)
+            exit()
+        except NotAuthorized:
+            self.print("\n[red]Сессия устарела. Необходимо пройти аутентификацию ещё раз")
+            del Settings()[self.AUTHCOOKIEID]
+            return True
+        self.print(f"[magenta]{os.path.abspath(planpath)}")
+        return False
+
+    def run_action_apply_plan_1(self) -> bool:
+        """ Выполнение плана, составленного run_action_plan_file_1()
+            Returns True when the main menu must be rebuilt
+        """
+        from learning import RequestError, NotAuthorized
+        from fileController import FileController
+        from actionPlan import ActionPlanError
+
+        self.print("[dim]Укажите файл плана")
+        planpath = self.ask_filepath(cache_suffix='planpath')
+        confirmed = Confirm.ask(
+            "[red]Данные в файле из плана будут изменены или удалены. Продолжить?"
+        )
+        if not confirmed:
+            return False
+
+        try:
+            FileController.apply_plan(
+                planpath,
+                progress_gen=self.gen_progress,
+                message_callback=self.message_callback,
+                workers=FileController.MAX_WORKERS,
+            )
+        except ActionPlanError as error:
+            self.print(f"[red]{error}")
+        except RequestError as error:
+            self.print("\n[bold red]Ошибка запроса.[/bold red] Текст ошибки:\n")
+            self.print(error)
+            exit()
+        except NotAuthorized:
+            self.print("\n[red]Сессия устарела. Необходимо пройти аутентификацию ещё раз")
+            del Settings()[self.AUTHCOOKIEID]
+            return True
+        return False
+
     def run_action_process_file_2(self) -> None:
+        from fileController import FileController
+
         filepath = self.ask_filepath()
         FileController.step2(filepath, self.message_callback)
 
+    def run_action_audit_labels(self) -> bool:
+        """ Returns True if menu should be rerendered """
+        from fileController import FileController
+        from learning import NotAuthorized
+
+        filepath = self.ask_filepath()
+        try:
+            with self.status("Проверка меток... "):
+                FileController.audit_labels(filepath, self.message_callback, learning=self.create_learning())
+        except NotAuthorized:
+            self.print("\n[red]Сессия устарела. Необходимо пройти аутентификацию ещё раз")
+            del Settings()[self.AUTHCOOKIEID]
+            return True
+        input("Нажмите Enter чтобы продолжить... ")
+        return False
+
     def run_action_logout(self) -> None:
         learning = self.create_learning()
         with self.status("Выход из системы... "):
@@ -851,8 +1003,16 @@ class Console(RichConsole):
         while True:
             if not _is_first_run: self.print("\n")
             self.print(menu)
+            if ImportProfiler.is_enabled():
+                ImportProfiler.report(self)
             selection = IntPrompt.ask("[yellow]Выберите действие")
 
+            if self.wait_auth_check():
+                self.print("[dim blue]Сохранённый вход больше не действителен[/dim blue]")
+                menu, menuitems, menuitems_len = self._create_menu()  # update menu
+                _is_first_run = False
+                continue
+
             # Выполнение действия
             action = None
             if selection > 0 and selection <= menuitems_len:
@@ -865,8 +1025,17 @@ class Console(RichConsole):
             elif action == 'process_file_1':
                 if self.run_action_process_file_1():
                     menu, menuitems, menuitems_len = self._create_menu()  # update menu
+            elif action == 'plan_file_1':
+                if self.run_action_plan_file_1():
+                    menu, menuitems, menuitems_len = self._create_menu()  # update menu
+            elif action == 'apply_plan_1':
+                if self.run_action_apply_plan_1():
+                    menu, menuitems, menuitems_len = self._create_menu()  # update menu
             elif action == 'process_file_2':
                 self.run_action_process_file_2()
+            elif action == 'audit_labels':
+                if self.run_action_audit_labels():
+                    menu, menuitems, menuitems_len = self._create_menu()  # update menu
             elif action == 'show_uinfo':
                 msg = self.run_action_show_user_info()
                 if msg == "rerender menu":
@@ -1144,8 +1313,13 @@ class Console(RichConsole):
 
     def validate_group_name(self, value):
         with self.status("Проверка... "):
-            id_ = learning.find_group_id(value)
+            id_ = self.create_learning().find_group_id(value)
         if id_ == None:
+            from groupCache import GroupCache
+
             self.print(f"[red]Группа `{value}` не найдена")
+            similar = GroupCache.search(value.strip())
+            if similar:
+                self.print("[dim]Группы с таким началом названия: " + ", ".join(x[0] for x in similar))
         return id_ != None
         
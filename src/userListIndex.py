@@ -0,0 +1,58 @@
+import threading
+from time import monotonic
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from utils import normalize_email
+
+
+class UserListIndex:
+    """ Строки /user/list, полученные при поиске пользователей в этом запуске
+
+        Поиск по email нечёткий: в ответ попадают все пользователи, адрес
+        которых содержит искомый (без учёта регистра). Поэтому для каждого
+        адреса из ответа, содержащего искомый, ответ полный, и поиск по нему
+        можно не выполнять. Строки хранятся TTL секунд, после изменений
+        пользователей в eLearning индекс очищается.
+    """
+
+    TTL = 300.0
+
+    def __init__(self, ttl: float = TTL):
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._rows: Dict[str, Tuple[float, List[dict]]] = dict()  # email -> (time, rows)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._rows)
+
+    @property
+    def lookups(self) -> int:
+        return self.hits + self.misses
+
+    def clear(self) -> None:
+        with self._lock:
+            self._rows.clear()
+
+    def get(self, email: str) -> Optional[List[dict]]:
+        """ Returns rows of the users with normalized email, None if the email was not seen """
+        with self._lock:
+            cached = self._rows.get(email)
+            if cached is not None and monotonic() - cached[0] < self.ttl:
+                self.hits += 1
+                return cached[1]
+            self.misses += 1
+            return None
+
+    def put(self, email: str, rows: Iterable[dict]) -> None:
+        """ rows - все строки ответа поиска по нормализованному адресу email """
+        found = {email: []}
+        for row in rows:
+            row_email = normalize_email(row.get('email'))
+            if email in row_email:
+                found.setdefault(row_email, []).append(row)
+        now = monotonic()
+        with self._lock:
+            for row_email, user_rows in found.items():
+                self._rows[row_email] = (now, user_rows)
@@ -1,8 +1,8 @@
 import datetime
+import hashlib
 from typing import Union, List, Optional, Iterable
 import secrets
 import string
-import pyperclip
 import subprocess
 
 from datatypes import (
@@ -53,6 +53,15 @@ def convert_block_dates(dates: Iterable[Union[datetime.date, datetime.datetime]]
     """ Convert block datetime dates to string like '21.06,21.07' """
     return ",".join([(x.strftime('%d.%m') if x != datetime.date(2000,1,1) else '-') for x in dates])
 
+def get_file_hash(filepath: str) -> str:
+    """ Returns sha256 of the file content """
+    with open(filepath, 'rb') as f:
+        return hashlib.file_digest(f, 'sha256').hexdigest()
+
+def normalize_email(email) -> str:
+    """ Адреса, различающиеся регистром и пробелами по краям, считаются одним """
+    return str(email or '').strip().lower()
+
 def generate_random_string(length=6) -> str:
     """Генерирует случайную строку заданной длины, используя безопасный генератор."""
     alphabet = string.ascii_letters + string.digits  # Буквы (верхний и нижний регистр) + цифры
@@ -95,12 +104,26 @@ def generate_password(user_table_login: str = ""):
     except (ValueError):
         return 'EL_' + generate_random_string(6)
 
-def suggest_user_actions(uinfo: UserInfo, learning = None) -> List[UserAction]:
+def is_password_lookup_needed(uinfo: UserInfo) -> bool:
+    """ Будет ли suggest_user_actions() искать пароль пользователя """
+    if uinfo.registered and uinfo.registered < get_last_autumn():
+        return False
+    if not uinfo.table or (uinfo.table.email and uinfo.table.email.lower() != uinfo.email.lower()):
+        return False
+    return bool(uinfo.login and uinfo.table.login and uinfo.login != uinfo.table.login
+                and uinfo.source != "AD")
+
+def get_last_autumn() -> datetime.datetime:
+    """ Пользователи, зарегистрированные раньше, предлагаются к удалению """
+    return datetime.datetime(year=datetime.datetime.today().year - 1, month=11, day=1)
+
+def suggest_user_actions(uinfo: UserInfo, learning = None, passwords = None) -> List[UserAction]:
+    """ passwords: объект с get_user_password(user_id), например PasswordIndex,
+                    по умолчанию пароль запрашивается через learning
+    """
     suggestions = []
     if uinfo.registered:
-        current_date = datetime.datetime.today()
-        last_autumn = datetime.datetime(year=current_date.year - 1, month=11, day=1)
-        if uinfo.registered < last_autumn:
+        if uinfo.registered < get_last_autumn():
             suggestions.append(UserAction.DELETE)
             return suggestions
 
@@ -120,9 +143,12 @@ def suggest_user_actions(uinfo: UserInfo, learning = None) -> List[UserAction]:
                     password = "<Неизвестно>"
                     
                     # Пробуем узнать пароль
-                    if learning:
+                    if passwords is None:
+                        passwords = learning
+                    if passwords:
                         try:
-                            password = learning.get_user_password(uinfo.mid)
+                            # None - письмо не найдено, пароль проверяется вручную
+                            password = passwords.get_user_password(uinfo.mid)
                         except Exception:
                             pass
 
@@ -148,20 +174,20 @@ def suggest_user_actions(uinfo: UserInfo, learning = None) -> List[UserAction]:
             appended = False
             to_delete = []
 
-            for subject in uinfo.table.subjects:
-                try:
-                    # label = str(LabelController.get_label_primitive(subject))
-                    selected_date = convert_date_string(str(subject.date)).date() if subject.date else None
-                    label = LabelController.get_label(subject.name, selected_date=selected_date)
-
-                    if not uinfo.tags or (uinfo.tags and label not in uinfo.tags):
-                        suggestions.append(UserAction(UserActionType.ADD_LABEL, label))
-                        appended = True
-                    elif not (uinfo.table.marks and 'registered' in uinfo.table.marks):
-                        to_delete.append(UserAction(UserActionType.DELETE_FROM_TABLE_WITH_SUBJECT, subject.name))
-
-                except LabelControllerError:
+            labels = LabelController.get_labels(
+                (subject.name, subject.date.date() if subject.date else None)
+                for subject in uinfo.table.subjects
+            )
+            for subject, label in zip(uinfo.table.subjects, labels):
+                if isinstance(label, LabelControllerError):
                     print("\n\033[31mSUGGESTION ERROR: Cannot get label for subject", subject, "\033[0m")
+                    continue
+
+                if not uinfo.tags or (uinfo.tags and label not in uinfo.tags):
+                    suggestions.append(UserAction(UserActionType.ADD_LABEL, label))
+                    appended = True
+                elif not (uinfo.table.marks and 'registered' in uinfo.table.marks):
+                    to_delete.append(UserAction(UserActionType.DELETE_FROM_TABLE_WITH_SUBJECT, subject.name))
             
             if len(to_delete) == len(uinfo.table.subjects):
                 suggestions.append(UserAction(UserActionType.DELETE_FROM_TABLE))
@@ -176,6 +202,8 @@ def suggest_user_actions(uinfo: UserInfo, learning = None) -> List[UserAction]:
     return suggestions
 
 def copy_to_clipboard(text):
+    import pyperclip  # нужен редко, не загружаем при запуске
+
     try:
         # Пытаемся скопировать через обычный pyperclip (для других платформ)
         pyperclip.copy(text)
@@ -0,0 +1,149 @@
+import json
+import threading
+from urllib.parse import parse_qs, urlsplit
+
+import pytest
+
+from learning import LearningDriver, SomethingWrong
+
+
+GATEWAY_TIMEOUT_PAGE = """<html><head><title>504 Gateway Time-out</title></head>
+<body><center><h1>504 Gateway Time-out</h1></center><hr><center>nginx</center></body></html>"""
+
+
+def notification_page(notifications) -> str:
+    value = json.dumps(notifications, ensure_ascii=False)
+    return f"<html><body><hm-notifications :notifications='{value}'></hm-notifications></body></html>"
+
+
+class FakeResponse:
+    encoding = 'utf-8'
+
+    def __init__(self, data=None, text=''):
+        self._data = data
+        self.text = text
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def json(self):
+        return self._data
+
+    def iter_content(self, chunk_size):
+        data = self.text.encode()
+        for i in range(0, len(data), chunk_size):
+            yield data[i:i + chunk_size]
+
+
+class FakeGroupSession:
+    """ Сервер eLearning с одной учебной группой: постраничный список
+        участников и исключение, сразу сдвигающее следующие страницы
+    """
+
+    def __init__(self, members, error_pages: int = 0):
+        self.cookies = {'PHPSESSID': 'test'}
+        self.members = list(members)  # [(user_id, email), ...]
+        self.error_pages = error_pages  # сколько первых исключений отвечают страницей ошибки
+        self._lock = threading.Lock()
+
+    def get(self, url, headers=None, params=None, stream=False):
+        query = {k: v[0] for k, v in parse_qs(urlsplit(url).query).items()}
+        page, per_page = int(query['page']), int(query['perPage'])
+        with self._lock:
+            rows = self.members[(page - 1) * per_page:page * per_page]
+            total = len(self.members)
+        return FakeResponse({
+            'data': [{'MID': str(user_id), 'email': email} for user_id, email in rows],
+            'tableSettings': {'totalRecords': total},
+        })
+
+    def post(self, url, data=None, headers=None, stream=False):
+        assert '/study-groups/users/exclude/' in url
+        with self._lock:
+            if self.error_pages:
+                self.error_pages -= 1
+                return FakeResponse(text=GATEWAY_TIMEOUT_PAGE)
+            user_ids = {int(x) for x in data['postMassIds_grid'].split(',')}
+            self.members = [x for x in self.members if x[0] not in user_ids]
+        return FakeResponse(text=notification_page(["Пользователи успешно исключены из группы"]))
+
+
+@pytest.fixture
+def make_driver(monkeypatch):
+    monkeypatch.setattr(LearningDriver, 'REQUEST_INTERVAL_SECONDS', 0)
+    monkeypatch.setattr(LearningDriver, 'RETRY_DELAY_SECONDS', 0)
+
+    def make(session):
+        driver = LearningDriver()
+        driver._session = session
+        driver._auth_check_completed = True
+        driver._current_role = 'dean'
+        return driver
+    return make
+
+
+def test_get_notification_returns_single_message():
+    assert LearningDriver.get_notification(notification_page(["Пароль успешно назначен!"])) == "Пароль успешно назначен!"
+
+
+def test_get_notification_without_messages():
+    assert LearningDriver.get_notification(notification_page([])) is None
+
+
+def test_get_notification_without_element():
+    with pytest.raises(SomethingWrong):
+        LearningDriver.get_notification(GATEWAY_TIMEOUT_PAGE)
+
+
+def test_exclude_from_group_retries_error_page(make_driver):
+    session = FakeGroupSession([(10, 'a@example.com'), (11, 'b@example.com')], error_pages=1)
+    driver = make_driver(session)
+
+    result = list(driver.exclude_from_group(1, [10, 11], workers=1, retries=1))
+
+    assert result == [([10, 11], None)]
+    assert session.members == []
+
+
+def test_exclude_while_paging_group_members(make_driver):
+    members = [(i, f"user{i}@example.com") for i in range(1, 2001)]
+    session = FakeGroupSession(members)
+    driver = make_driver(session)
+
+    # Участники передаются генератором, как при загрузке постранично
+    user_ids = (user_id for user_id, _ in driver.iter_group_members(1))
+    result = list(driver.exclude_from_group(1, user_ids))
+
+    assert all(error is None for _, error in result)
+    assert sum(len(chunk) for chunk, _ in result) == len(members)
+    assert session.members == []
+
+
+class FakeGridSession:
+    """ Таблица из total строк, сервер отдаёт не больше max_page_size строк страницы """
+
+    def __init__(self, total: int, max_page_size: int, capped_offsets: bool):
+        self.cookies = {'PHPSESSID': 'test'}
+        self.total = total
+        self.max_page_size = max_page_size
+        self.capped_offsets = capped_offsets  # смещение страницы считается по ограниченному размеру
+
+    def get(self, url, headers=None, params=None, stream=False):
+        query = {k: v[0] for k, v in parse_qs(urlsplit(url).query).items()}
+        page, per_page = int(query['page']), int(query['perPage'])
+        size = min(per_page, self.max_page_size)
+        start = (page - 1) * (size if self.capped_offsets else per_page)
+        rows = range(start, min(start + size, self.total))
+        return FakeResponse({'data': [{'id': x} for x in rows], 'tableSettings': {'totalRecords': self.total}})
+
+
+@pytest.mark.parametrize('capped_offsets', [False, True])
+def test_iter_grid_with_capped_page_size(make_driver, capped_offsets):
+    driver = make_driver(FakeGridSession(2350, 100, capped_offsets))
+
+    rows = list(driver.iter_grid('/grid', per_page=100, workers=2))
+
+    assert [x['id'] for x in rows] == list(range(2350))